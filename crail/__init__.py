@@ -3,12 +3,34 @@
 .. Copyright © 2015, David Maze
 
 .. automodule:: crail.actions
+.. automodule:: crail.admission
 .. automodule:: crail.app
+.. automodule:: crail.assets
+.. automodule:: crail.backup
+.. automodule:: crail.catalog
+.. automodule:: crail.channel
+.. automodule:: crail.compress
+.. automodule:: crail.engine
+.. automodule:: crail.events
+.. automodule:: crail.export
 .. automodule:: crail.globals
+.. automodule:: crail.idempotency
+.. automodule:: crail.ledger
+.. automodule:: crail.lobby
+.. automodule:: crail.loadtest
 .. automodule:: crail.manage
+.. automodule:: crail.metrics
 .. automodule:: crail.models
+.. automodule:: crail.online
 .. automodule:: crail.routes
+.. automodule:: crail.routing
 .. automodule:: crail.settings
+.. automodule:: crail.simulate
+.. automodule:: crail.singleflight
+.. automodule:: crail.statements
+.. automodule:: crail.table
+.. automodule:: crail.traffic
+.. automodule:: crail.versions
 .. automodule:: crail.wsgi
 
 """
@@ -2,15 +2,68 @@
 
 .. Copyright © 2015, David Maze
 
+.. autofunction:: complete_contract
+.. autofunction:: discard_card
 .. autofunction:: draw_card
+.. autofunction:: fill_hand
+.. autofunction:: gain_money
 .. autofunction:: get_or_create_player
+.. autofunction:: hand
+.. autofunction:: hand_ids
+.. autofunction:: hands
+.. autofunction:: join_game
+.. autofunction:: leave_game
+.. autofunction:: new_game
+.. autofunction:: spend_money
+
+Every action that changes a game is recorded in its :mod:`crail.events`
+log.
 
 """
 from random import choice
 
-from .models import Card, PlayedCard, Player, db
+from flask import current_app
+
+from . import events, ledger, statements, versions
+from .models import Card, Contract, Game, PlayedCard, Player, card_contract, \
+    db, player_card
+from .statements import bakery, Statement
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
+played_cards = PlayedCard.__table__  # pylint: disable=invalid-name
+
+_player_by_name = bakery(  # pylint: disable=invalid-name
+    lambda session: session.query(Player))
+_player_by_name += lambda query: query.filter(
+    Player.name == bindparam('name'))
+
+_cards_by_id = bakery(  # pylint: disable=invalid-name
+    lambda session: session.query(Card).options(
+        joinedload(Card.contracts).joinedload(Contract.good),
+        joinedload(Card.contracts).joinedload(Contract.city)))
+_cards_by_id += lambda query: query.filter(
+    Card.id.in_(bindparam('card_ids', expanding=True)))
+
+_deck = Statement(  # pylint: disable=invalid-name
+    select([Card.id]).where(Card.world_id == bindparam('world_id')))
+
+_played = Statement(  # pylint: disable=invalid-name
+    select([played_cards.c.card_id])
+    .where(played_cards.c.game_id == bindparam('game_id')))
+
+_hand = Statement(  # pylint: disable=invalid-name
+    select([player_card.c.card_id])
+    .where(player_card.c.player_id == bindparam('player_id')))
+
+_carrying = Statement(  # pylint: disable=invalid-name
+    select([card_contract.c.card_id])
+    .where(card_contract.c.contract_id == bindparam('contract_id')))
+
+_contract_amount = Statement(  # pylint: disable=invalid-name
+    select([Contract.amount]).where(Contract.id == bindparam('contract_id')))
+
 
 def get_or_create_player(name):
     '''Get a player with a given name.
@@ -23,33 +76,326 @@ def get_or_create_player(name):
 
     '''
     try:
-        return Player.query.filter_by(name=name).one()
+        return _player_by_name(db.session()).params(name=name).one()
     except NoResultFound:
         player = Player(name=name, money=0)
         db.session.add(player)
         return player
 
 
-def draw_card(game):
+def _deck_ids(game):
+    '''Get the IDs of the cards in a game's world.'''
+    return [row.id for row in _deck.execute(world_id=game.world_id)]
+
+
+def _played_ids(game):
+    '''Get the IDs of the cards drawn since a game's last reshuffle.'''
+    with db.shard(game.id):
+        return {row.card_id for row in _played.execute(game_id=game.id)}
+
+
+def _draw(game, player, deck, played):
+    '''Draw one card, updating the set of `played` card IDs.'''
+    with db.shard(game.id):
+        cards = [card_id for card_id in deck if card_id not in played]
+        reshuffle = not cards
+        if reshuffle:
+            db.session.execute(played_cards.delete().where(
+                played_cards.c.game_id == game.id))
+            played.clear()
+            cards = deck
+        card_id = choice(cards)
+        played.add(card_id)
+        db.session.execute(played_cards.insert().values(
+            game_id=game.id, card_id=card_id))
+        if player is not None:
+            db.session.execute(player_card.insert().values(
+                player_id=player.id, card_id=card_id))
+    data = {'card': card_id}
+    if reshuffle:
+        data['reshuffle'] = True
+    events.record(game.id, 'draw', player.id if player else None, **data)
+    return card_id
+
+
+def draw_card(game, player=None):
     '''Draw a card for the current game.
 
     Adds the card to the played-cards table (and may clear that table out
-    to reshuffle it), so intrinsically causes a mutation.
+    to reshuffle it), so intrinsically causes a mutation.  If `player`
+    is given, the card is also added to their hand.
 
     .. todo:: This needs to take into account the possibility that cards
               are in players' hands, and not put them back during the
               reshuffle.
 
+    :param game: :class:`crail.models.Game` to draw from
+    :param player: :class:`crail.models.Player` drawing the card, if any
+    :return: :class:`crail.models.Card` drawn
+
+    '''
+    return statements.get(
+        Card, _draw(game, player, _deck_ids(game), _played_ids(game)))
+
+
+def fill_hand(player):
+    '''Draw cards until a player's hand is full.
+
+    A full hand holds :attr:`crail.models.World.hand_size` cards,
+    counting event cards only if the world's
+    :attr:`~crail.models.World.hand_counts_events` says to.  The deck
+    and played cards are read once however many cards are drawn, and
+    each draw is recorded in the game log as with :func:`draw_card`.
+    Drawing stops after a whole deck's worth of cards even if the hand
+    is not full.  Does not implicitly commit.
+
+    :param player: :class:`crail.models.Player` drawing, who must be in
+      a game
+    :return: list of IDs of the event cards drawn
+    :raise ValueError: if the world has no hand-size rule
+
     '''
-    cards = (Card.query
-             .filter_by(world=game.world)
-             .filter(~Card.played_cards.any(PlayedCard.game == game))
-             .all())
+    game = player.game
+    world = game.world
+    if world.hand_size is None:
+        raise ValueError('World {} has no hand size'.format(world.name))
+    is_event = {row.id: row.event is not None for row in db.session.execute(
+        select([Card.id, Card.event]).where(Card.world_id == world.id))}
+
+    def counts(card_id):
+        '''Decide whether a card counts towards the hand size.'''
+        return world.hand_counts_events or not is_event.get(card_id, False)
+
+    held = sum(1 for card_id in hand_ids(player) if counts(card_id))
+    deck = list(is_event)
+    played = _played_ids(game)
+    drawn = []
+    for _ in range(len(deck)):
+        if held >= world.hand_size:
+            break
+        card_id = _draw(game, player, deck, played)
+        if is_event[card_id]:
+            drawn.append(card_id)
+        if counts(card_id):
+            held += 1
+    return drawn
+
+
+def hand_ids(player):
+    '''Get the IDs of the cards a player holds.
+
+    :param player: :class:`crail.models.Player`
+    :return: list of integer card IDs
+
+    '''
+    with db.shard(player.game_id):
+        return [row.card_id for row in _hand.execute(player_id=player.id)]
+
+
+def hand(player):
+    '''Get the cards a player holds.
+
+    This reads the player's hand from their game's shard and then the
+    cards themselves from the world catalog, so unlike
+    :attr:`crail.models.Player.cards` it works with sharding enabled.
+
+    :param player: :class:`crail.models.Player`
+    :return: list of :class:`crail.models.Card`
+
+    '''
+    card_ids = hand_ids(player)
+    if not card_ids:
+        return []
+    cards = {card.id: card for card in (
+        _cards_by_id(db.session()).params(card_ids=card_ids))}
+    return [cards[card_id] for card_id in card_ids]
+
+
+def hands(game_id, player_ids):
+    '''Get the IDs of the cards several players in one game hold.
+
+    This is a single query however many players there are.
+
+    :param int game_id: identifier of the players' game
+    :param player_ids: identifiers of :class:`crail.models.Player`
+    :return: dictionary mapping player ID to a list of integer card IDs
+
+    '''
+    result = {player_id: [] for player_id in player_ids}
+    if not result:
+        return result
+    with db.shard(game_id):
+        for player_id, card_id in db.session.execute(
+                select([player_card.c.player_id, player_card.c.card_id])
+                .where(player_card.c.player_id.in_(list(result)))):
+            result[player_id].append(card_id)
+    return result
+
+
+def discard_card(player, card_id):
+    '''Remove a card from a player's hand.
+
+    This is a single targeted ``DELETE`` against the hand table; neither
+    the player's hand nor the card is loaded.  Does not implicitly commit.
+
+    :param player: :class:`crail.models.Player` discarding the card
+    :param int card_id: identifier of the :class:`crail.models.Card`
+    :return: number of hand entries removed, zero if the player was not
+      holding the card (or it does not exist)
+
+    '''
+    with db.shard(player.game_id):
+        result = db.session.execute(
+            player_card.delete()
+            .where(player_card.c.player_id == player.id)
+            .where(player_card.c.card_id == card_id))
+    if result.rowcount and player.game_id is not None:
+        events.record(player.game_id, 'discard', player.id, card=card_id)
+    return result.rowcount
+
+
+def complete_contract(player, contract_id):
+    '''Deliver a contract.
+
+    Every card in the player's hand carrying the contract is discarded,
+    and the player is paid the contract amount once per card.  This is
+    a lookup of the cards carrying the contract, one ``DELETE`` against
+    the hand table, and, if anything was removed, one ledger entry
+    referencing the contract; no card holders are loaded.  Does not
+    implicitly commit.
+
+    :param player: :class:`crail.models.Player` delivering the contract
+    :param int contract_id: identifier of the :class:`crail.models.Contract`
+    :return: number of cards turned in, zero if the player holds no card
+      with this contract (or it does not exist)
+
+    '''
+    cards = [row.card_id for row in _carrying.execute(
+        contract_id=contract_id)]
     if not cards:
-        # reshuffle
-        PlayedCard.query.filter_by(game=game).delete()
-        cards = Card.query.filter_by(world=game.world).all()
-    card = choice(cards)
-    played_card = PlayedCard(game=game, card=card)
-    db.session.add(played_card)
-    return card
+        return 0
+    with db.shard(player.game_id):
+        result = db.session.execute(
+            player_card.delete()
+            .where(player_card.c.player_id == player.id)
+            .where(player_card.c.card_id.in_(cards)))
+    count = result.rowcount
+    if count:
+        amount = _contract_amount.execute(contract_id=contract_id).scalar()
+        ledger.record(player, 'contract', amount * count,
+                      contract_id=contract_id)
+        if player.game_id is not None:
+            events.record(player.game_id, 'complete', player.id,
+                          contract=contract_id, amount=amount * count)
+    return count
+
+
+def gain_money(player, amount):
+    '''Increase the amount of money a player has.
+
+    Does not implicitly commit.
+
+    :param player: :class:`crail.models.Player` gaining money
+    :param int amount: amount gained
+
+    '''
+    ledger.record(player, 'gain', amount)
+    if player.game_id is not None:
+        events.record(player.game_id, 'gain', player.id, amount=amount)
+
+
+def spend_money(player, amount):
+    '''Decrease the amount of money a player has.
+
+    Does not implicitly commit.
+
+    :param player: :class:`crail.models.Player` spending money
+    :param int amount: amount spent
+
+    '''
+    ledger.record(player, 'spend', -amount)
+    if player.game_id is not None:
+        events.record(player.game_id, 'spend', player.id, amount=-amount)
+
+
+def _move_player(player, game):
+    '''Set a player's game, carrying their hand and money along.
+
+    With sharding, if the new game's state lives in a different
+    database, the hand is moved there and the money is transferred with
+    a pair of ``adjust`` ledger entries.
+
+    '''
+    moving = (db.get_shard_engine(current_app, player.game_id) is not
+              db.get_shard_engine(current_app, game.id if game else None))
+    if moving:
+        cards = hand_ids(player)
+        money = ledger.balance(player)
+        with db.shard(player.game_id):
+            db.session.execute(player_card.delete().where(
+                player_card.c.player_id == player.id))
+        if money:
+            ledger.record(player, 'adjust', -money)
+    player.game = game
+    db.session.flush()
+    versions.bump_lobby()
+    if moving:
+        with db.shard(player.game_id):
+            if cards:
+                db.session.execute(player_card.insert(),
+                                   [{'player_id': player.id, 'card_id': c}
+                                    for c in cards])
+        if money:
+            ledger.record(player, 'adjust', money)
+
+
+def join_game(player, game):
+    '''Move a player into a game.
+
+    The player brings their current hand and money with them.  If they
+    are already in some other game they leave it first.  Does not
+    implicitly commit.
+
+    :param player: :class:`crail.models.Player` joining
+    :param game: :class:`crail.models.Game` to join
+
+    '''
+    if player.game_id == game.id:
+        return
+    leave_game(player)
+    _move_player(player, game)
+    events.record(game.id, 'join', player.id,
+                  money=ledger.balance(player), cards=hand_ids(player))
+
+
+def leave_game(player):
+    '''Remove a player from their current game.
+
+    This is a no-op if the player is not in a game.  Does not
+    implicitly commit.
+
+    :param player: :class:`crail.models.Player` leaving
+
+    '''
+    if player.game_id is None:
+        return
+    events.record(player.game_id, 'leave', player.id)
+    _move_player(player, None)
+
+
+def new_game(player, world):
+    '''Start a new game and move a player into it.
+
+    Does not implicitly commit.
+
+    :param player: :class:`crail.models.Player` starting the game
+    :param world: :class:`crail.models.World` to play in
+    :return: the new :class:`crail.models.Game`
+
+    '''
+    game = Game(world=world)
+    db.session.add(game)
+    db.session.flush()
+    events.record(game.id, 'new', player.id, world=world.id)
+    join_game(player, game)
+    return game
@@ -0,0 +1,163 @@
+"""Admission control for mutating requests.
+
+.. Copyright © 2015, David Maze
+
+When many people act at once -- a whole room starting games together --
+requests that change the database would otherwise all pile up behind
+its write lock, each one making the others slower, until they time
+out.  Instead each process runs at most
+:data:`crail.settings.CRAIL_ADMISSION_LIMIT` mutating (``POST``)
+requests at a time, and at most
+:data:`crail.settings.CRAIL_ADMISSION_GAME_LIMIT` for any one game.
+Up to :data:`crail.settings.CRAIL_ADMISSION_QUEUE` more wait their
+turn, for at most :data:`crail.settings.CRAIL_ADMISSION_WAIT`
+seconds.  Anything beyond that is turned away at once with ``503
+Service Unavailable`` and a ``Retry-After`` of
+:data:`crail.settings.CRAIL_ADMISSION_RETRY_AFTER` seconds, which
+the client honors with a randomized backoff.
+
+Setting :data:`crail.settings.CRAIL_ADMISSION_LIMIT` to 0 turns this
+off.  Limits are per process, so a server's total is the limit times
+its number of workers.
+
+The numbers of running and waiting requests are the
+``admission.running`` and ``admission.waiting`` gauges in
+:mod:`crail.metrics`; ``admission.admitted`` and
+``admission.rejected`` count outcomes, and ``admission.wait_ms`` is a
+histogram of time spent waiting.
+
+.. autoclass:: Limiter
+   :members:
+.. autofunction:: init_app
+
+"""
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from . import metrics
+from .globals import current_player
+
+#: Key of the limiter in the Flask application's extensions.
+EXTENSION = 'crail_admission'
+
+
+class Limiter(object):
+    """Bounded concurrency with a bounded queue.
+
+    :param int limit: most requests running at once
+    :param int game_limit: most requests for one game running at once
+    :param int depth: most requests waiting at once
+
+    """
+
+    def __init__(self, limit, game_limit, depth):
+        self.limit = limit
+        self.game_limit = game_limit
+        self.depth = depth
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.games = {}
+
+    def _free(self, game_id):
+        """Decide whether a request for `game_id` may run now."""
+        return (self.running < self.limit and
+                (game_id is None or
+                 self.games.get(game_id, 0) < self.game_limit))
+
+    def _publish(self):
+        """Update the gauges."""
+        metrics.gauge('admission.running', self.running)
+        metrics.gauge('admission.waiting', self.waiting)
+
+    def acquire(self, game_id, timeout):
+        """Wait for a turn to run.
+
+        :param int game_id: identifier of the request's game, or
+          :const:`None` if it is not about a game
+        :param float timeout: most seconds to wait
+        :return: whether the request may run; if so, call
+          :meth:`release` when it finishes
+
+        """
+        with self.condition:
+            if not self._free(game_id):
+                if self.waiting >= self.depth:
+                    return False
+                self.waiting += 1
+                self._publish()
+                deadline = time.monotonic() + timeout
+                try:
+                    while not self._free(game_id):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+            if game_id is not None:
+                self.games[game_id] = self.games.get(game_id, 0) + 1
+            self._publish()
+            return True
+
+    def release(self, game_id):
+        """Finish running a request admitted by :meth:`acquire`."""
+        with self.condition:
+            self.running -= 1
+            if game_id is not None:
+                self.games[game_id] -= 1
+                if not self.games[game_id]:
+                    del self.games[game_id]
+            self._publish()
+            self.condition.notify_all()
+
+
+def _admit(app, limiter):
+    """Admit or turn away a request, before it runs."""
+    if request.method != 'POST' or request.blueprint != 'crail':
+        return None
+    player = current_player._get_current_object()
+    game_id = player.game_id if player else None
+    start = time.monotonic()
+    admitted = limiter.acquire(game_id,
+                               app.config['CRAIL_ADMISSION_WAIT'])
+    metrics.observe('admission.wait_ms',
+                    int((time.monotonic() - start) * 1000))
+    if not admitted:
+        metrics.increment('admission.rejected')
+        response = jsonify({'error': 'busy'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(
+            app.config['CRAIL_ADMISSION_RETRY_AFTER'])
+        return response
+    metrics.increment('admission.admitted')
+    g.crail_admitted = game_id
+    return None
+
+
+def init_app(app):
+    """Limit an application's concurrent mutating requests.
+
+    :param app: the Flask application
+
+    """
+    if not app.config['CRAIL_ADMISSION_LIMIT']:
+        return
+    limiter = app.extensions[EXTENSION] = Limiter(
+        app.config['CRAIL_ADMISSION_LIMIT'],
+        app.config['CRAIL_ADMISSION_GAME_LIMIT'],
+        app.config['CRAIL_ADMISSION_QUEUE'])
+
+    @app.before_request
+    def admit():  # pylint: disable=unused-variable
+        """Wait for a turn, or turn the request away."""
+        return _admit(app, limiter)
+
+    @app.teardown_request
+    def finish(exc=None):  # pylint: disable=unused-argument,unused-variable
+        """Give up the request's turn."""
+        if 'crail_admitted' in g:
+            limiter.release(g.pop('crail_admitted'))
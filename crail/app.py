@@ -5,22 +5,20 @@
 .. autofunction:: make_app
 
 """
-import os
-
 from flask import Flask
-from flask.ext.assets import Environment
-
-from .models import db, migrate
-from .routes import crail_bp, crail_css, crail_js
 
-assets = Environment()  # pylint: disable=invalid-name
+from . import admission, assets, channel, compress, traffic
+from .models import db
+from .routes import crail_bp
 
 
 def make_app(config=None):
     """Create the fully-assembled Flask application.
 
-    This sets up the application, binding the database, migrations,
-    Web assets, and the actual routes all together into one object.
+    This sets up the application, binding the database, Web assets,
+    and the actual routes all together into one object.  Nothing that
+    is only needed for management, like database migrations, is
+    loaded here; see :func:`crail.manage.make_manage_app`.
 
     If the environment variable :env:`CRAIL_SETTINGS` is set and the
     `config` parameter is :const:`None`, then the file named in the
@@ -39,18 +37,11 @@ def make_app(config=None):
         app.config.update(config)
 
     db.init_app(app)
-
-    # flask-migrate is super-useful, except that it depends on an
-    # unpacked tree.  It doesn't look like Alembic does.  Alas!
-    # At any rate, feed it the right directory so tooling works.
-    migrate.init_app(app, db,
-                     directory=os.path.join(os.path.dirname(__file__),
-                                            'migrations'))
-
+    traffic.init_app(app)
     assets.init_app(app)
-    assets.register('crail_js', crail_js)
-    assets.register('crail_css', crail_css)
-
+    compress.init_app(app)
+    admission.init_app(app)
     app.register_blueprint(crail_bp)
+    channel.init_app(app)
 
     return app
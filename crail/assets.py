@@ -0,0 +1,88 @@
+"""Web asset bundles.
+
+.. Copyright © 2015, David Maze
+
+Serving pages only needs the URLs of the packed JavaScript and CSS
+bundles, so templates call :func:`asset_urls` rather than using the
+Flask-Assets ``{% assets %}`` tag.  Flask-Assets (and its minifying
+filters) is only imported when bundles have to be built: by
+``crail_manage assets build``, or on demand when
+:data:`crail.settings.CRAIL_ASSETS_AUTO_BUILD` is set (by default, in
+debug mode).  Otherwise the prebuilt files are served as plain static
+files.
+
+.. autodata:: BUNDLES
+.. autofunction:: asset_urls
+.. autofunction:: environment
+.. autofunction:: init_app
+
+"""
+from flask import current_app, url_for
+
+#: Bundle definitions: name mapped to source files, filter, and output.
+BUNDLES = {
+    'crail_js': (['bower_components/jquery/dist/jquery.js',
+                  'bower_components/bootstrap/dist/js/bootstrap.js',
+                  'bower_components/underscore/underscore.js',
+                  'bower_components/js-cookie/src/js.cookie.js',
+                  'crail.js'],
+                 'rjsmin', 'gen/packed.js'),
+    'crail_css': (['bower_components/bootstrap/dist/css/bootstrap.css',
+                   'bower_components/bootstrap/dist/css/bootstrap-theme.css'],
+                  'cssmin', 'gen/packed.css'),
+}
+
+#: Key in :attr:`flask.Flask.extensions` holding the assets environment.
+EXTENSION = 'crail_assets'
+
+
+def _auto_build(app):
+    """Determine whether bundles should be built on demand."""
+    auto = app.config['CRAIL_ASSETS_AUTO_BUILD']
+    return app.debug if auto is None else auto
+
+
+def environment(app):
+    """Get the Flask-Assets environment for an application.
+
+    This imports Flask-Assets and registers :data:`BUNDLES` the first
+    time it is called.
+
+    :param app: the Flask application
+    :return: :class:`flask_assets.Environment`
+
+    """
+    env = app.extensions.get(EXTENSION)
+    if env is None:
+        from flask.ext.assets import Bundle, Environment
+        env = Environment()
+        env.init_app(app)
+        for name, (contents, filters, output) in BUNDLES.items():
+            env.register(name, Bundle(*contents, filters=filters,
+                                      output=output))
+        app.extensions[EXTENSION] = env
+    return env
+
+
+def asset_urls(name):
+    """Get the URLs to load a bundle.
+
+    :param str name: name of the bundle in :data:`BUNDLES`
+    :return: list of URLs
+
+    """
+    app = current_app._get_current_object()
+    if _auto_build(app):
+        return environment(app)[name].urls()
+    return [url_for('static', filename=BUNDLES[name][2])]
+
+
+def init_app(app):
+    """Make :func:`asset_urls` available to templates.
+
+    :param app: the Flask application
+
+    """
+    app.jinja_env.globals['asset_urls'] = asset_urls
+    if _auto_build(app):
+        environment(app)
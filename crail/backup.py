@@ -0,0 +1,172 @@
+"""Single-game backup files.
+
+.. Copyright © 2015, David Maze
+
+``crail_manage snapshot GAME_ID`` writes one game's mutable state --
+its players, their money and hands, and the played cards -- to a small
+gzipped JSON file, and ``crail_manage restore FILE`` loads it back as a
+new game, in this database or another one with the same world loaded.
+Cards are identified by their printed :attr:`crail.models.Card.number`
+within the world, not by database ID, so the file does not depend on
+the order worlds were imported in.
+
+The file contents are a JSON object:
+
+`format`
+  always ``crail-game``
+`version`
+  :data:`VERSION`
+`world`
+  name of the game's world
+`players`
+  list of objects with a player's `name`, `money`, and `cards` (card
+  numbers)
+`played`
+  list of card numbers drawn since the last reshuffle
+
+Hands, played cards, card numbers, and balances are each read with a
+fixed number of queries however many players there are, and restoring
+writes hands and played cards back with bulk inserts (see
+:func:`crail.events.restore`).  Restoring still costs a few statements
+per player: each one leaves any other game they are in, and has their
+money zeroed and then set with ``adjust`` ledger entries.
+
+.. autodata:: VERSION
+.. autofunction:: dump
+.. autofunction:: load
+.. autofunction:: read
+.. autofunction:: write
+
+"""
+import gzip
+import json
+
+from sqlalchemy import select
+
+from . import actions, events, ledger
+from .models import Card, Game, PlayedCard, Player, World, db, player_card
+
+#: Version of the backup file format.
+VERSION = 1
+
+#: Value of the `format` key.
+FORMAT = 'crail-game'
+
+
+def dump(game):
+    """Capture a game's state.
+
+    :param game: :class:`crail.models.Game` to capture
+    :return: dictionary in the backup file format
+
+    """
+    numbers = {card_id: number for card_id, number in db.session.execute(
+        select([Card.id, Card.number]).where(Card.world_id == game.world_id))}
+    if None in numbers.values():
+        raise ValueError('world {} has unnumbered cards'
+                         .format(game.world.name))
+    players = Player.query.filter_by(game_id=game.id).order_by(Player.id).all()
+    money = ledger.balances(game.id, [player.id for player in players])
+    played = PlayedCard.__table__
+    hands = {player.id: [] for player in players}
+    with db.shard(game.id):
+        if players:
+            for player_id, card_id in db.session.execute(
+                    select([player_card.c.player_id, player_card.c.card_id])
+                    .where(player_card.c.player_id.in_(list(hands)))):
+                hands[player_id].append(numbers[card_id])
+        drawn = [numbers[row.card_id] for row in db.session.execute(
+            select([played.c.card_id])
+            .where(played.c.game_id == game.id)
+            .order_by(played.c.id))]
+    return {
+        'format': FORMAT,
+        'version': VERSION,
+        'world': game.world.name,
+        'players': [{'name': player.name,
+                     'money': money[player.id],
+                     'cards': hands[player.id]}
+                    for player in players],
+        'played': drawn,
+    }
+
+
+def load(data):
+    """Create a new game from a captured state.
+
+    Players are matched by name, and created if needed.  A player who
+    is in some other game leaves it, and their hand and money there are
+    replaced by what is in `data`.  Does not implicitly commit.
+
+    :param dict data: game state, as returned by :func:`dump`
+    :return: the new :class:`crail.models.Game`
+    :raise ValueError: if `data` is not a supported backup, or its
+      world or cards are not in the database
+
+    """
+    if data.get('format') != FORMAT or data.get('version') != VERSION:
+        raise ValueError('not a version {} game backup'.format(VERSION))
+    world = World.query.filter_by(name=data['world']).first()
+    if world is None:
+        raise ValueError('World {} does not exist'.format(data['world']))
+    ids = {number: card_id for card_id, number in db.session.execute(
+        select([Card.id, Card.number]).where(Card.world_id == world.id))}
+
+    def card_ids(numbers):
+        """Translate card numbers to database IDs."""
+        try:
+            return [ids[number] for number in numbers]
+        except KeyError as exc:
+            raise ValueError('World {} has no card {}'
+                             .format(world.name, exc.args[0]))
+
+    game = Game(world=world)
+    db.session.add(game)
+    db.session.flush()
+    events.record(game.id, 'new', None, world=world.id)
+
+    state = events.empty_state()
+    state['played'] = card_ids(data['played'])
+    players = {}
+    for saved in data['players']:
+        player = actions.get_or_create_player(saved['name'])
+        actions.leave_game(player)
+        players[player.id] = player
+        state['players'][player.id] = {'money': saved['money'],
+                                       'cards': card_ids(saved['cards'])}
+    db.session.flush()
+
+    # Whatever the players held outside any game is superseded too
+    player_ids = list(players)
+    if player_ids:
+        with db.shard(None):
+            db.session.execute(player_card.delete().where(
+                player_card.c.player_id.in_(player_ids)))
+        money = ledger.balances(None, player_ids)
+        for player in players.values():
+            if money[player.id]:
+                ledger.record(player, 'adjust', -money[player.id])
+    events.restore(game.id, state)
+    return game
+
+
+def write(game, filename):
+    """Write a game's backup file.
+
+    :param game: :class:`crail.models.Game` to save
+    :param str filename: name of the file to write
+
+    """
+    with gzip.open(filename, 'wt', encoding='utf-8') as backup:
+        backup.write(events.dumps(dump(game)))
+
+
+def read(filename):
+    """Read a backup file.
+
+    :param str filename: name of the file to read
+    :return: dictionary in the backup file format
+
+    """
+    with gzip.open(filename, 'rt', encoding='utf-8') as backup:
+        return json.load(backup)
@@ -0,0 +1,264 @@
+"""Local performance benchmarks.
+
+.. Copyright © 2015, David Maze
+
+``crail_manage benchmark SUITE`` times parts of the application
+against a scratch SQLite database in a temporary directory, never the
+configured one, and prints one line per case.
+
+`channel`
+  The same stream of ``gain`` and ``spend`` actions sent as HTTP
+  requests and as :mod:`crail.channel` messages, both in-process, so
+  this measures the server's per-message cost and reply size but not
+  the network.
+
+`engine`
+  The same stream of actions sent as HTTP requests with and without
+  the in-memory :mod:`crail.engine`.
+
+`statements`
+  The hot lookups in :mod:`crail.statements`, each timed as the
+  original query built from scratch (*before*) and precompiled
+  (*after*).  ORM lookups start from an empty session each time, so
+  they are not answered from the identity map.
+
+.. autofunction:: channel
+.. autofunction:: engine
+.. autofunction:: statements
+.. autofunction:: scratch_app
+
+"""
+import contextlib
+import json
+import tempfile
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from werkzeug.test import EnvironBuilder
+
+from . import actions, channel as channels, engine as engines, ledger, \
+    statements as precompiled, versions
+from .app import make_app
+from .models import Card, City, Contract, GameEvent, Good, MoneyEntry, \
+    MoneySnapshot, Player, World, db, player_card
+
+
+@contextlib.contextmanager
+def scratch_app(world='Benchmark', **config):
+    """Create an application with an empty database.
+
+    The database is deleted when the context exits.
+
+    :param str world: name of a world to create, or :const:`None`
+    :param config: extra configuration settings
+    :return: context manager yielding the Flask application
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        app = make_app(dict({
+            'SQLALCHEMY_DATABASE_URI':
+            'sqlite:///{}/benchmark.db'.format(directory),
+            'SECRET_KEY': 'benchmark',
+            'CRAIL_ASSETS_AUTO_BUILD': False,
+            'CRAIL_ENGINE_JOURNAL_DIR': '{}/journal'.format(directory),
+        }, **config))
+        with app.app_context():
+            db.create_all()
+            if world is not None:
+                db.session.add(World(name=world))
+            db.session.commit()
+        try:
+            yield app
+        finally:
+            owner = engines.get(app)
+            if owner is not None:
+                owner.close()
+
+
+_PATHS = {'gain': '/api/gain', 'spend': '/api/spend'}
+
+
+def _actions(messages):
+    """Generate a stream of alternating gains and spends."""
+    for number in range(messages):
+        yield ('gain' if number % 2 == 0 else 'spend'), {'amount': 1}
+
+
+def _join(client):
+    """Log a test client in and start a game."""
+    for path, data in (('/api/login', {'name': 'benchmark'}),
+                       ('/api/game/new', {'world': 1})):
+        client.post(path, data=json.dumps(data),
+                    content_type='application/json')
+
+
+def _post(client, messages):
+    """Send a stream of actions over HTTP.
+
+    :return: pair of elapsed seconds and total reply bytes
+
+    """
+    size = 0
+    start = time.perf_counter()
+    for action, data in _actions(messages):
+        response = client.post(_PATHS[action], data=json.dumps(data),
+                               content_type='application/json')
+        size += len(response.get_data())
+    return time.perf_counter() - start, size
+
+
+def channel(messages=1000):
+    """Compare the HTTP and WebSocket channel paths.
+
+    :param int messages: number of actions to send each way
+    :return: list of tuples of case name, messages, elapsed seconds,
+      and total reply bytes
+
+    """
+    results = []
+    with scratch_app() as app:
+        client = app.test_client()
+        _join(client)
+        results.append(('http', messages) + _post(client, messages))
+
+        cookie = '; '.join('{}={}'.format(c.name, c.value)
+                           for c in client.cookie_jar)
+        builder = EnvironBuilder(path=channels.PATH,
+                                 headers={'Cookie': cookie})
+        try:
+            conn = channels.Channel(app, builder.get_environ())
+        finally:
+            builder.close()
+        conn.handle(json.dumps({'action': 'state'}))
+        size = 0
+        start = time.perf_counter()
+        for number, (action, data) in enumerate(_actions(messages)):
+            size += len(conn.handle(json.dumps(
+                {'id': number, 'action': action, 'data': data})))
+        results.append(('channel', messages, time.perf_counter() - start,
+                        size))
+    return results
+
+
+def engine(messages=1000):
+    """Compare actions with and without the in-memory engine.
+
+    :param int messages: number of actions to send each way
+    :return: list of tuples of case name, messages, elapsed seconds,
+      and total reply bytes
+
+    """
+    results = []
+    for name, enabled in (('database', False), ('engine', True)):
+        with scratch_app(CRAIL_ENGINE=enabled) as app:
+            client = app.test_client()
+            _join(client)
+            results.append((name, messages) + _post(client, messages))
+    return results
+
+
+def _time(func, calls):
+    """Call a function repeatedly, returning the elapsed seconds."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return time.perf_counter() - start
+
+
+def _before_game_version(game_id):
+    """Get a game version, as before :mod:`crail.statements`."""
+    events = GameEvent.__table__
+    with db.shard(game_id):
+        return db.session.execute(
+            select([func.coalesce(func.max(events.c.seq), 0)])
+            .where(events.c.game_id == game_id)).scalar()
+
+
+def _before_balance(player):
+    """Get a balance, as before :mod:`crail.statements`."""
+    snapshots, entries = MoneySnapshot.__table__, MoneyEntry.__table__
+    with db.shard(player.game_id):
+        row = db.session.execute(
+            select([snapshots.c.entry_id, snapshots.c.balance])
+            .where(snapshots.c.player_id == player.id)
+            .order_by(snapshots.c.entry_id.desc())
+            .limit(1)).first()
+        entry_id, base = row if row is not None else (0, 0)
+        total = db.session.execute(
+            select([func.coalesce(func.sum(entries.c.amount), 0)])
+            .where(entries.c.player_id == player.id)
+            .where(entries.c.id > entry_id)).scalar()
+    return base + total
+
+
+def _before_hand(player):
+    """Get a hand, as before :mod:`crail.statements`."""
+    with db.shard(player.game_id):
+        card_ids = [row.card_id for row in db.session.execute(
+            select([player_card.c.card_id])
+            .where(player_card.c.player_id == player.id))]
+    return (Card.query
+            .options(joinedload(Card.contracts).joinedload(Contract.good),
+                     joinedload(Card.contracts).joinedload(Contract.city))
+            .filter(Card.id.in_(card_ids)).all())
+
+
+def _fresh(func):
+    """Wrap a lookup so it starts from an empty session."""
+    def wrapper():
+        """Empty the session, then look up."""
+        db.session.expunge_all()
+        return func()
+    return wrapper
+
+
+def statements(calls=1000):
+    """Time hot lookups before and after precompiling them.
+
+    :param int calls: number of calls in each case
+    :return: list of tuples of case name, calls, elapsed seconds, and
+      :const:`None`
+
+    """
+    results = []
+    with scratch_app() as app, app.app_context():
+        world = World.query.one()
+        good = Good(name='Benchmark')
+        city = City(name='Benchmark', produces=[good], world=world)
+        contract = Contract(good=good, city=city, amount=1)
+        db.session.add(Card(number=1, contracts=[contract], world=world))
+        player = actions.get_or_create_player('benchmark')
+        game = actions.new_game(player, world)
+        card_id = actions.draw_card(game, player).id
+        actions.gain_money(player, 5)
+        db.session.commit()
+        player_id, game_id = player.id, game.id
+
+        cases = [
+            ('player by name',
+             _fresh(lambda: Player.query.filter_by(name='benchmark').one()),
+             _fresh(lambda: actions.get_or_create_player('benchmark'))),
+            ('card by id',
+             _fresh(lambda: Card.query.get(card_id)),
+             _fresh(lambda: precompiled.get(Card, card_id))),
+            ('game version',
+             lambda: _before_game_version(game_id),
+             lambda: versions.game_version(game_id)),
+            ('balance',
+             lambda: _before_balance(player),
+             lambda: ledger.balance(player)),
+            ('hand',
+             _fresh(lambda: _before_hand(Player.query.get(player_id))),
+             _fresh(lambda: actions.hand(precompiled.get(Player,
+                                                         player_id)))),
+        ]
+        for name, before, after in cases:
+            # Warm both up, so compilation happens outside the timing
+            before()
+            after()
+            results.append(('{} (before)'.format(name), calls,
+                            _time(before, calls), None))
+            results.append(('{} (after)'.format(name), calls,
+                            _time(after, calls), None))
+    return results
@@ -0,0 +1,269 @@
+"""Compiled world catalogs.
+
+.. Copyright © 2015, David Maze
+
+A world's cards never change while it is being played, so
+``crail_manage game`` also compiles each world into a small binary file
+in :data:`crail.settings.CRAIL_CATALOG_DIR`.  Every worker
+memory-maps the file read-only, so all the workers on a machine share a
+single page-cache copy, loading it needs no database queries, and
+finding a card by ID is indexing into an array.
+
+The file is little-endian and laid out as:
+
+1. A header, :data:`HEADER`: the magic string ``CRAILCAT``, the format
+   :data:`VERSION`, the world ID, the string index of the world's name,
+   the ID of the first card slot, and the number of card slots,
+   contracts, and strings.
+2. One :data:`CARD` record per card ID from the first slot through the
+   last card in the world: the card ID (zero for IDs that are not in
+   this world), printed number (``-1`` if none), string index of the
+   event text (:data:`NONE` if none), and the index and count of its
+   contracts.
+3. One :data:`CONTRACT` record per contract on every card, grouped by
+   card: the contract ID, string indexes of the good and city names,
+   and the amount.
+4. A string table: one offset per string plus a final end offset, then
+   the UTF-8 string data.
+
+.. autodata:: VERSION
+.. autoclass:: Catalog
+   :members:
+.. autofunction:: compile_world
+.. autofunction:: get
+.. autofunction:: path_for
+.. autofunction:: write
+
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+from sqlalchemy.orm import joinedload
+
+from .models import Card, Contract
+
+#: Version of the catalog file format.
+VERSION = 1
+
+#: Magic string at the start of every catalog file.
+MAGIC = b'CRAILCAT'
+
+#: String index meaning "no string".
+NONE = 0xffffffff
+
+#: File header layout.
+HEADER = struct.Struct('<8sHHIIIIII')
+
+#: Card record layout.
+CARD = struct.Struct('<IiIIH2x')
+
+#: Contract record layout.
+CONTRACT = struct.Struct('<IIIi')
+
+#: String offset layout.
+OFFSET = struct.Struct('<I')
+
+#: Key in :attr:`flask.Flask.extensions` holding open catalogs.
+EXTENSION = 'crail_catalog'
+
+
+def compile_world(world):
+    """Compile a world into catalog file contents.
+
+    :param world: :class:`crail.models.World` to compile
+    :return: :class:`bytes`
+
+    """
+    strings, index = [], {}
+
+    def intern(text):
+        """Get the string table index of `text`."""
+        if text is None:
+            return NONE
+        if text not in index:
+            index[text] = len(strings)
+            strings.append(text.encode('utf-8'))
+        return index[text]
+
+    name = intern(world.name)
+    cards = (Card.query
+             .options(joinedload(Card.contracts).joinedload(Contract.good),
+                      joinedload(Card.contracts).joinedload(Contract.city))
+             .filter(Card.world_id == world.id)
+             .order_by(Card.id)
+             .all())
+    base = cards[0].id if cards else 0
+    slots = cards[-1].id - base + 1 if cards else 0
+
+    card_data = bytearray(CARD.size * slots)
+    contract_data = bytearray()
+    first = 0
+    for card in cards:
+        contracts = sorted(card.contracts, key=lambda c: c.id)
+        CARD.pack_into(card_data, CARD.size * (card.id - base),
+                       card.id,
+                       -1 if card.number is None else card.number,
+                       intern(card.event), first, len(contracts))
+        for contract in contracts:
+            contract_data += CONTRACT.pack(contract.id,
+                                           intern(contract.good.name),
+                                           intern(contract.city.name),
+                                           contract.amount)
+        first += len(contracts)
+
+    offsets, position = bytearray(), 0
+    for data in strings:
+        offsets += OFFSET.pack(position)
+        position += len(data)
+    offsets += OFFSET.pack(position)
+
+    header = HEADER.pack(MAGIC, VERSION, 0, world.id, name, base, slots,
+                         first, len(strings))
+    return b''.join([header, bytes(card_data), bytes(contract_data),
+                     bytes(offsets)] + strings)
+
+
+def path_for(directory, world_id):
+    """Get the name of a world's catalog file.
+
+    :param str directory: catalog directory
+    :param int world_id: identifier of the world
+    :return: path name
+
+    """
+    return os.path.join(directory, 'world-{}.catalog'.format(world_id))
+
+
+def write(world, directory):
+    """Compile a world and write its catalog file.
+
+    The file is replaced atomically, so running workers either see the
+    old catalog or the new one.
+
+    :param world: :class:`crail.models.World` to compile
+    :param str directory: catalog directory
+    :return: path name of the catalog file
+
+    """
+    data = compile_world(world)
+    path = path_for(directory, world.id)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+    return path
+
+
+class Catalog(object):
+    """A memory-mapped compiled world catalog.
+
+    :param str path: name of the catalog file
+    :raise ValueError: if the file is not a catalog of this version
+
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as catalog_file:
+            #: Memory map of the file contents.
+            self.data = mmap.mmap(catalog_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        (magic, version, _, self.world_id, name, self.base, self.slots,
+         contracts, strings) = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError('{} is not a version {} catalog'
+                             .format(path, VERSION))
+        self._contracts = HEADER.size + CARD.size * self.slots
+        self._offsets = self._contracts + CONTRACT.size * contracts
+        self._strings = self._offsets + OFFSET.size * (strings + 1)
+        #: Name of the world.
+        self.name = self.string(name)
+
+    def close(self):
+        """Unmap the file."""
+        self.data.close()
+
+    def string(self, number):
+        """Get an entry from the string table."""
+        if number == NONE:
+            return None
+        start, end = struct.unpack_from(
+            '<II', self.data, self._offsets + OFFSET.size * number)
+        return self.data[self._strings + start:
+                         self._strings + end].decode('utf-8')
+
+    def __contains__(self, card_id):
+        return self._record(card_id) is not None
+
+    def _record(self, card_id):
+        """Get the raw record for a card, or :const:`None`."""
+        slot = card_id - self.base
+        if not 0 <= slot < self.slots:
+            return None
+        record = CARD.unpack_from(self.data, HEADER.size + CARD.size * slot)
+        return record if record[0] == card_id else None
+
+    def card(self, card_id):
+        """Get a card in the form of :func:`crail.routes.card_to_dict`.
+
+        :param int card_id: identifier of the card
+        :return: dictionary, or :const:`None` if the card is not in this
+          world
+
+        """
+        record = self._record(card_id)
+        if record is None:
+            return None
+        _, number, event, first, count = record
+        jcard = {'id': card_id}
+        if number != -1 and number:
+            jcard['number'] = number
+        if event != NONE:
+            jcard['event'] = self.string(event)
+        if count:
+            jcard['contracts'] = []
+            for position in range(first, first + count):
+                contract_id, good, city, amount = CONTRACT.unpack_from(
+                    self.data, self._contracts + CONTRACT.size * position)
+                jcard['contracts'].append({'id': contract_id,
+                                           'good': self.string(good),
+                                           'city': self.string(city),
+                                           'amount': amount})
+        return jcard
+
+
+def get(app, world_id):
+    """Get the catalog for a world, if it has been compiled.
+
+    Catalogs are opened once per process, and reopened if the file is
+    replaced.
+
+    :param app: the Flask application
+    :param int world_id: identifier of the world
+    :return: :class:`Catalog`, or :const:`None` if catalogs are
+      disabled or this world has none
+
+    """
+    directory = app.config['CRAIL_CATALOG_DIR']
+    if directory is None:
+        return None
+    path = path_for(directory, world_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    catalogs = app.extensions.setdefault(EXTENSION, {})
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = catalogs.get(world_id)
+    if cached is None or cached[0] != key:
+        cached = (key, Catalog(path))
+        catalogs[world_id] = cached
+    return cached[1]
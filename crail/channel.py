@@ -0,0 +1,200 @@
+"""WebSocket action channel.
+
+.. Copyright © 2015, David Maze
+
+Every action from the client is normally its own HTTP request, with
+its own cookies and headers, answered with the complete player state.
+A client that plays for a while can instead open a WebSocket to
+:data:`PATH` and send actions over it.  Each message is a JSON object
+
+.. code-block:: json
+
+   {"id": 7, "action": "gain", "data": {"amount": 5}, "key": "..."}
+
+where `action` is one of :data:`ACTIONS`, `data` is the body the
+matching HTTP call takes, and the optional `key` is an idempotency key
+(see :mod:`crail.idempotency`).  The reply is
+
+.. code-block:: json
+
+   {"id": 7, "status": 200, "version": "1:42", "delta": {...}}
+
+with the HTTP status the call would have had, the game version (see
+:data:`crail.routes.VERSION_HEADER`), and, if it succeeded, the
+difference between the new player state and the one last sent on this
+connection (see :func:`delta`).  The ``state`` action sends the whole
+state again.
+
+Each message runs the same view as the HTTP call, with the cookies
+from the WebSocket handshake, so validation, idempotency, and metrics
+behave identically; only the HTTP parsing, connection handling, and
+full-state response are saved.  Logging in and out still happen over
+HTTP, and a connection keeps the identity it was opened with.
+
+The endpoint is only served if
+:data:`crail.settings.CRAIL_WEBSOCKET` is set and the optional
+:mod:`flask_sockets` package is installed (``pip install
+crail[websocket]``).  It needs a server that can hold many idle
+connections per worker, for instance
+
+.. code-block:: sh
+
+   gunicorn -k flask_sockets.worker crail.wsgi:application
+
+.. autodata:: PATH
+.. autodata:: ACTIONS
+.. autoclass:: Channel
+   :members:
+.. autofunction:: delta
+.. autofunction:: init_app
+
+"""
+import json
+
+from flask import url_for
+from werkzeug.test import EnvironBuilder
+
+from . import metrics
+from .events import dumps
+from .idempotency import HEADER as KEY_HEADER
+from .routes import VERSION_HEADER
+
+#: URL path of the WebSocket endpoint.
+PATH = '/api/ws'
+
+#: Map of channel action to the :mod:`crail.routes` endpoint it runs.
+ACTIONS = {
+    'state': 'crail.state',
+    'gain': 'crail.gain_money',
+    'spend': 'crail.spend_money',
+    'draw': 'crail.draw',
+    'fill': 'crail.fill',
+    'discard': 'crail.discard',
+    'complete': 'crail.complete',
+    'join': 'crail.join_game',
+}
+
+_MISSING = object()
+
+
+def delta(old, new):
+    """Describe how one player state differs from another.
+
+    :param dict old: state previously sent, or :const:`None`
+    :param dict new: current state
+    :return: dictionary with `set`, a dictionary of top-level keys whose
+      values changed (other than `cards`), `unset`, a list of keys no
+      longer present, and, if the hand changed, `cards`, a dictionary
+      with `add`, a list of new cards, and `remove`, a list of IDs of
+      cards no longer held
+
+    """
+    old = old or {}
+    result = {
+        'set': {key: value for key, value in new.items()
+                if key != 'cards' and old.get(key, _MISSING) != value},
+        'unset': sorted(key for key in old if key not in new),
+    }
+    old_cards = {card['id'] for card in old.get('cards', [])}
+    new_cards = {card['id'] for card in new.get('cards', [])}
+    if old_cards != new_cards:
+        result['cards'] = {
+            'add': [card for card in new.get('cards', [])
+                    if card['id'] not in old_cards],
+            'remove': sorted(old_cards - new_cards),
+        }
+    return result
+
+
+class Channel(object):
+    """One client's open channel.
+
+    :param app: the Flask application
+    :param dict environ: WSGI environment of the WebSocket handshake
+
+    """
+
+    def __init__(self, app, environ):
+        self.app = app
+        self.state = None
+        self.headers = {}
+        if 'HTTP_COOKIE' in environ:
+            self.headers['Cookie'] = environ['HTTP_COOKIE']
+        self.base = {key: environ[key]
+                     for key in ('REMOTE_ADDR', 'SCRIPT_NAME')
+                     if key in environ}
+        with app.request_context(environ):
+            self.paths = {action: url_for(endpoint)
+                          for action, endpoint in ACTIONS.items()}
+
+    def handle(self, text):
+        """Run one message.
+
+        :param str text: JSON text of the message
+        :return: JSON text of the reply
+
+        """
+        try:
+            message = json.loads(text)
+            action = message['action']
+            path = self.paths[action]
+            data = message.get('data', {})
+        except (ValueError, TypeError, KeyError):
+            metrics.increment('channel.invalid')
+            return dumps({'id': None, 'status': 400})
+        metrics.increment('channel.{}'.format(action))
+        reply = {'id': message.get('id'), 'status': None}
+        headers = dict(self.headers)
+        if message.get('key'):
+            headers[KEY_HEADER] = message['key']
+        builder = EnvironBuilder(
+            path=path, method='GET' if action == 'state' else 'POST',
+            headers=headers, environ_base=self.base,
+            data=dumps(data), content_type='application/json')
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        with self.app.request_context(environ):
+            try:
+                response = self.app.full_dispatch_request()
+            except Exception as exc:  # pylint: disable=broad-except
+                response = self.app.make_response(
+                    self.app.handle_exception(exc))
+        reply['status'] = response.status_code
+        if response.status_code == 200:
+            state = json.loads(response.get_data(as_text=True))
+            reply['delta'] = delta(None if action == 'state' else self.state,
+                                   state)
+            reply['version'] = response.headers.get(VERSION_HEADER)
+            self.state = state
+        return dumps(reply)
+
+
+def init_app(app):
+    """Serve the channel, if it is enabled and possible.
+
+    :param app: the Flask application
+
+    """
+    if not app.config['CRAIL_WEBSOCKET']:
+        return
+    try:
+        from flask_sockets import Sockets
+    except ImportError:
+        app.logger.warning('CRAIL_WEBSOCKET is set but flask_sockets is '
+                           'not installed; not serving %s', PATH)
+        return
+
+    sockets = Sockets(app)
+
+    @sockets.route(PATH)
+    def channel(socket):  # pylint: disable=unused-variable
+        """Run a client's channel until it closes."""
+        client = Channel(app, socket.environ)
+        metrics.increment('channel.opened')
+        while not socket.closed:
+            text = socket.receive()
+            if text is None:
+                break
+            socket.send(client.handle(text))
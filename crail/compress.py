@@ -0,0 +1,72 @@
+"""Response compression.
+
+.. Copyright © 2015, David Maze
+
+JSON responses of at least :data:`crail.settings.CRAIL_COMPRESS_MIN_SIZE`
+bytes are compressed with whichever of Brotli or gzip the client prefers
+in its ``Accept-Encoding`` header.  Brotli needs the optional
+:mod:`brotli` package (``pip install crail[brotli]``); without it only
+gzip is offered.  Smaller responses go out as they are, since
+compressing them costs more than it saves.
+
+Every JSON response's size is recorded in :mod:`crail.metrics`, before
+(``response.bytes``) and after (``response.sent_bytes``) compression.
+
+.. autofunction:: init_app
+
+"""
+import gzip
+
+from flask import request
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # pylint: disable=invalid-name
+
+#: Content types that are compressed.
+COMPRESSIBLE = frozenset(['application/json'])
+
+
+def _encodings():
+    """List the encodings we can produce, best first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def _compress(app, response):
+    """Compress a response if it is worth it."""
+    if (response.mimetype not in COMPRESSIBLE or
+            response.direct_passthrough or
+            'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    metrics.observe('response.bytes', len(data))
+    if (response.status_code == 200 and
+            len(data) >= app.config['CRAIL_COMPRESS_MIN_SIZE']):
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(_encodings())
+        if encoding == 'br':
+            data = brotli.compress(data,
+                                   quality=app.config['CRAIL_BROTLI_QUALITY'])
+        elif encoding == 'gzip':
+            data = gzip.compress(data, app.config['CRAIL_GZIP_LEVEL'])
+        if encoding is not None:
+            response.set_data(data)
+            response.headers['Content-Encoding'] = encoding
+            metrics.increment('response.{}'.format(encoding))
+    metrics.observe('response.sent_bytes', len(data))
+    return response
+
+
+def init_app(app):
+    """Compress an application's JSON responses.
+
+    :param app: the Flask application
+
+    """
+    @app.after_request
+    def compress(response):  # pylint: disable=unused-variable
+        """Compress the response body if the client accepts it."""
+        return _compress(app, response)
@@ -0,0 +1,545 @@
+"""In-memory game engine.
+
+.. Copyright © 2015, David Maze
+
+Normally every action loads what it needs from the database, changes
+it, and commits, so a game plays no faster than the database can
+commit.  If :data:`crail.settings.CRAIL_ENGINE` is set, each game in
+play is instead owned by one actor thread in the process.  The actor
+holds the game state (see :mod:`crail.events`) in memory, applies
+actions to it one at a time, and answers straight away; the database
+catches up behind it.
+
+Every change is first appended to the game's journal file in
+:data:`crail.settings.CRAIL_ENGINE_JOURNAL_DIR`, as the
+:mod:`crail.events` entry it will become.  The journal is written on
+every action and forced to disk at least every
+:data:`crail.settings.CRAIL_ENGINE_FSYNC_INTERVAL` seconds, which
+bounds what a power failure can lose; a crashed process loses nothing
+that reached the journal.  Every
+:data:`crail.settings.CRAIL_ENGINE_FLUSH_INTERVAL` seconds, after
+:data:`crail.settings.CRAIL_ENGINE_FLUSH_BATCH` actions, or whenever
+the game goes quiet, the actor writes the journaled changes to the
+usual tables in one transaction and empties the journal.  When an actor
+starts, or the engine is created, any journal entries newer than the
+game's event log are written to the database first, so a crash is
+recovered the next time the game is played.
+
+Reads of a game's state in :mod:`crail.routes` go through its actor.
+Everything else that reads the tables -- the table view, the history,
+exports, backups -- may be up to a flush interval behind.  Joining,
+leaving, or starting a game releases the actors of the games involved,
+writing their changes out, and the next action loads the game afresh.
+An actor that has been idle for
+:data:`crail.settings.CRAIL_ENGINE_IDLE` seconds is released too.
+
+Only one process may own a game, so this mode needs a single server
+process (with as many threads as you like), or a front end that sends
+all of a game's requests to the same process.
+
+.. autoclass:: Engine
+   :members:
+.. autoclass:: Journal
+   :members:
+.. autofunction:: get
+
+"""
+import atexit
+import collections
+import concurrent.futures
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from . import events, ledger, metrics, versions
+from .events import dumps
+from .models import Card, Contract, Game, PlayedCard, World, card_contract, \
+    db, player_card
+
+#: Key of the engine in the Flask application's extensions.
+EXTENSION = 'crail_engine'
+
+_STOP = object()
+_create_lock = threading.Lock()  # pylint: disable=invalid-name
+
+#: Stand-in for :class:`crail.models.Player` in :func:`crail.ledger.record`.
+_Seat = collections.namedtuple('_Seat', ['id', 'game_id'])
+
+
+def _contract(contract_id):
+    """Get the cards carrying a contract and its amount."""
+    cards = {row.card_id for row in db.session.execute(
+        select([card_contract.c.card_id])
+        .where(card_contract.c.contract_id == contract_id))}
+    amount = db.session.execute(
+        select([Contract.amount])
+        .where(Contract.id == contract_id)).scalar()
+    return cards, amount
+
+
+def get(app):
+    """Get an application's engine.
+
+    :param app: the Flask application
+    :return: the :class:`Engine`, or :const:`None` if
+      :data:`crail.settings.CRAIL_ENGINE` is not set
+
+    """
+    if not app.config['CRAIL_ENGINE']:
+        return None
+    engine = app.extensions.get(EXTENSION)
+    if engine is None:
+        with _create_lock:
+            engine = app.extensions.get(EXTENSION)
+            if engine is None:
+                engine = Engine(app)
+                app.extensions[EXTENSION] = engine
+    return engine
+
+
+class Journal(object):
+    """Append-only file of not-yet-persisted game events.
+
+    :param str path: name of the file
+    :param float interval: most seconds between forcing it to disk
+
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.file = open(path, 'a', encoding='utf-8')
+        self.synced = time.monotonic()
+        self.dirty = False
+
+    @staticmethod
+    def read(path):
+        """Read the entries in a journal file.
+
+        A torn last line, from a crash in the middle of a write, is
+        ignored.
+
+        :param str path: name of the file
+        :return: list of entries, empty if the file does not exist
+
+        """
+        entries = []
+        try:
+            with open(path, 'r', encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def append(self, entry):
+        """Add an entry."""
+        self.file.write(dumps(entry) + '\n')
+        self.file.flush()
+        self.dirty = True
+        if time.monotonic() - self.synced >= self.interval:
+            self.sync()
+
+    def sync(self):
+        """Force everything written so far to disk."""
+        if self.dirty:
+            os.fsync(self.file.fileno())
+            self.dirty = False
+        self.synced = time.monotonic()
+
+    def clear(self):
+        """Discard every entry."""
+        self.file.seek(0)
+        self.file.truncate()
+        self.sync()
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+
+class _Actor(object):
+    """Owner of one game's in-memory state."""
+
+    def __init__(self, engine, game_id, previous=None):
+        self.engine = engine
+        self.game_id = game_id
+        self.previous = previous
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._run, name='crail-game-{}'.format(game_id),
+            daemon=True)
+        self.journal = None
+        self.state = None
+        self.version = 0
+        self.pending = []
+        self.world = None
+        self.is_event = {}
+        self.contracts = {}
+
+    # Loading and persisting; these run in the actor's application
+    # context.
+
+    def _load(self):
+        """Recover the journal and load the game."""
+        if self.previous is not None:
+            self.previous.join()
+        self.engine.recover(self.game_id)
+        game = Game.query.get(self.game_id)
+        if game is None:
+            raise ValueError('Game {} does not exist'.format(self.game_id))
+        world = World.query.get(game.world_id)
+        self.world = (world.name, world.hand_size, world.hand_counts_events)
+        self.is_event = {row.id: row.event is not None
+                         for row in db.session.execute(
+                             select([Card.id, Card.event])
+                             .where(Card.world_id == game.world_id))}
+        self.state, self.version, _ = events.replay(self.game_id)
+        db.session.rollback()
+        self.journal = Journal(
+            self.engine.path(self.game_id),
+            self.engine.config['CRAIL_ENGINE_FSYNC_INTERVAL'])
+
+    def _contract(self, contract_id):
+        """Get the cards carrying a contract and its amount, cached."""
+        if contract_id not in self.contracts:
+            self.contracts[contract_id] = _contract(contract_id)
+        return self.contracts[contract_id]
+
+    def _flush(self):
+        """Write the journaled changes to the database."""
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        try:
+            self.engine.persist(self.game_id, self.pending, self._contract)
+            db.session.commit()
+        except Exception:  # pylint: disable=broad-except
+            db.session.rollback()
+            current_app.logger.exception(
+                'engine: could not persist game %d; will retry',
+                self.game_id)
+            metrics.increment('engine.flush_failed')
+            return
+        metrics.increment('engine.flushed', len(self.pending))
+        metrics.observe('engine.flush_batch', len(self.pending))
+        self.pending = []
+        self.journal.clear()
+        current_app.logger.debug('engine: flushed game %d in %.3fs',
+                                 self.game_id, time.perf_counter() - start)
+
+    # Actions; these run only in the actor's thread, one at a time.
+
+    def _event(self, kind, player_id, **data):
+        """Apply and journal one event."""
+        self.version += 1
+        entry = {'seq': self.version, 'kind': kind,
+                 'player_id': player_id, 'data': data}
+        self.journal.append(entry)
+        contracts = ({data['contract']: self._contract(data['contract'])[0]}
+                     if kind == 'complete' else {})
+        events.apply_event(self.state, kind, player_id, data, contracts)
+        self.pending.append(entry)
+
+    def _hand(self, player_id):
+        """Get a player's cards."""
+        return self.state['players'].get(player_id, {}).get('cards', [])
+
+    def _draw(self, player_id):
+        """Draw a card into a player's hand."""
+        deck = list(self.is_event)
+        played = set(self.state['played'])
+        cards = [card_id for card_id in deck if card_id not in played]
+        reshuffle = not cards
+        card_id = random.choice(deck if reshuffle else cards)
+        if reshuffle:
+            self._event('draw', player_id, card=card_id, reshuffle=True)
+        else:
+            self._event('draw', player_id, card=card_id)
+        return card_id
+
+    def _apply(self, kind, player_id, data):
+        """Apply one action, returning what its caller gets."""
+        if kind == 'view':
+            seat = self.state['players'].get(player_id, {})
+            return (self.version, seat.get('money', 0),
+                    list(seat.get('cards', [])))
+        if kind == 'gain':
+            self._event('gain', player_id, amount=data['amount'])
+        elif kind == 'spend':
+            self._event('spend', player_id, amount=-data['amount'])
+        elif kind == 'draw':
+            return self._draw(player_id)
+        elif kind == 'discard':
+            count = self._hand(player_id).count(data['card'])
+            if count:
+                self._event('discard', player_id, card=data['card'])
+            return count
+        elif kind == 'complete':
+            cards, amount = self._contract(data['contract'])
+            count = sum(1 for card_id in self._hand(player_id)
+                        if card_id in cards)
+            if count:
+                self._event('complete', player_id,
+                            contract=data['contract'], amount=amount * count)
+            return count
+        elif kind == 'fill':
+            return self._fill(player_id)
+        else:
+            raise ValueError('unknown action {}'.format(kind))
+
+    def _fill(self, player_id):
+        """Draw until a player's hand is full.
+
+        This follows the same rule as :func:`crail.actions.fill_hand`.
+
+        """
+        name, hand_size, counts_events = self.world
+        if hand_size is None:
+            raise ValueError('World {} has no hand size'.format(name))
+
+        def counts(card_id):
+            """Decide whether a card counts towards the hand size."""
+            return counts_events or not self.is_event.get(card_id, False)
+
+        held = sum(1 for card_id in self._hand(player_id) if counts(card_id))
+        drawn = []
+        for _ in range(len(self.is_event)):
+            if held >= hand_size:
+                break
+            card_id = self._draw(player_id)
+            if self.is_event[card_id]:
+                drawn.append(card_id)
+            if counts(card_id):
+                held += 1
+        return drawn
+
+    def _run(self):
+        """Serve actions until stopped or idle."""
+        config = self.engine.config
+        with self.engine.app.app_context():
+            try:
+                self._load()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.engine.evict(self, force=True)
+                self._fail(exc)
+                return
+            last_flush = idle_since = time.monotonic()
+            while True:
+                try:
+                    item = self.queue.get(
+                        timeout=config['CRAIL_ENGINE_FSYNC_INTERVAL'])
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                now = time.monotonic()
+                if item is not None:
+                    future, kind, player_id, data = item
+                    if future.set_running_or_notify_cancel():
+                        try:
+                            future.set_result(
+                                self._apply(kind, player_id, data))
+                        except Exception as exc:  # pylint: disable=W0703
+                            future.set_exception(exc)
+                    idle_since = now
+                if (self.pending and
+                        (item is None or
+                         len(self.pending) >=
+                         config['CRAIL_ENGINE_FLUSH_BATCH'] or
+                         now - last_flush >=
+                         config['CRAIL_ENGINE_FLUSH_INTERVAL'])):
+                    self._flush()
+                    last_flush = now
+                if item is None:
+                    self.journal.sync()
+                    if (now - idle_since >= config['CRAIL_ENGINE_IDLE'] and
+                            not self.pending and self.engine.evict(self)):
+                        break
+            self._flush()
+            self.journal.close()
+            db.session.remove()
+
+    def _fail(self, exc):
+        """Fail every queued action."""
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[0].set_running_or_notify_cancel():
+                item[0].set_exception(exc)
+
+
+class Engine(object):
+    """The game actors of one application.
+
+    Creating the engine recovers every journal left by a previous
+    process.  Use :func:`get` rather than creating one directly.
+
+    :param app: the Flask application
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.lock = threading.Lock()
+        self.actors = {}
+        self.retired = {}
+        self.directory = app.config['CRAIL_ENGINE_JOURNAL_DIR']
+        os.makedirs(self.directory, exist_ok=True)
+        with app.app_context():
+            for name in sorted(os.listdir(self.directory)):
+                if name.startswith('game-') and name.endswith('.journal'):
+                    self.recover(int(name[len('game-'):-len('.journal')]))
+        atexit.register(self.close)
+
+    def path(self, game_id):
+        """Get the name of a game's journal file."""
+        return os.path.join(self.directory, 'game-{}.journal'.format(game_id))
+
+    def recover(self, game_id):
+        """Write a game's journal entries that the database lacks.
+
+        Runs in the caller's application context and commits.
+
+        :param int game_id: identifier of the game
+        :return: number of entries written
+
+        """
+        path = self.path(game_id)
+        known = versions.game_version(game_id)
+        entries = [entry for entry in Journal.read(path)
+                   if entry['seq'] > known]
+        if entries:
+            self.persist(game_id, entries, _contract)
+            db.session.commit()
+            current_app.logger.warning(
+                'engine: recovered %d events for game %d from %s',
+                len(entries), game_id, path)
+            metrics.increment('engine.recovered', len(entries))
+        if os.path.exists(path):
+            os.remove(path)
+        return len(entries)
+
+    @staticmethod
+    def persist(game_id, entries, contract):
+        """Write journal entries to the database, without committing.
+
+        :param int game_id: identifier of the game
+        :param list entries: journal entries, in order
+        :param contract: function of a contract ID returning the set of
+          card IDs carrying it and its amount
+
+        """
+        played = PlayedCard.__table__
+        for entry in entries:
+            kind, player_id, data = (entry['kind'], entry['player_id'],
+                                     entry['data'])
+            seat = _Seat(player_id, game_id)
+            with db.shard(game_id):
+                if kind in ('gain', 'spend'):
+                    ledger.record(seat, kind, data['amount'])
+                elif kind == 'draw':
+                    if data.get('reshuffle'):
+                        db.session.execute(played.delete().where(
+                            played.c.game_id == game_id))
+                    db.session.execute(played.insert().values(
+                        game_id=game_id, card_id=data['card']))
+                    if player_id is not None:
+                        db.session.execute(player_card.insert().values(
+                            player_id=player_id, card_id=data['card']))
+                elif kind == 'discard':
+                    db.session.execute(player_card.delete()
+                                       .where(player_card.c.player_id ==
+                                              player_id)
+                                       .where(player_card.c.card_id ==
+                                              data['card']))
+                elif kind == 'complete':
+                    cards = contract(data['contract'])[0]
+                    db.session.execute(player_card.delete()
+                                       .where(player_card.c.player_id ==
+                                              player_id)
+                                       .where(player_card.c.card_id.in_(
+                                           list(cards))))
+                    ledger.record(seat, 'contract', data['amount'],
+                                  contract_id=data['contract'])
+            seq = events.record(game_id, kind, player_id, **data)
+            if seq != entry['seq']:
+                current_app.logger.error(
+                    'engine: game %d event %d persisted as %d; was it '
+                    'changed by another process?', game_id, entry['seq'], seq)
+
+    def do(self, game_id, kind, player_id=None, **data):
+        """Run an action in a game's actor, starting it if needed.
+
+        :param int game_id: identifier of the game
+        :param str kind: ``view``, ``gain``, ``spend``, ``draw``,
+          ``fill``, ``discard``, or ``complete``
+        :param int player_id: identifier of the acting player
+        :param data: the action's parameters, as for :mod:`crail.actions`
+        :return: for ``view``, a tuple of the game version, the player's
+          money, and their card IDs; otherwise what the corresponding
+          :mod:`crail.actions` function returns, with card IDs in place
+          of cards
+        :raise ValueError: if the action is not possible
+
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            actor = self.actors.get(game_id)
+            if actor is None:
+                actor = _Actor(self, game_id, self.retired.pop(game_id, None))
+                self.actors[game_id] = actor
+                actor.thread.start()
+            actor.queue.put((future, kind, player_id, data))
+        return future.result(timeout=self.config['CRAIL_ENGINE_TIMEOUT'])
+
+    def evict(self, actor, force=False):
+        """Forget an actor that has nothing queued.
+
+        :return: whether the actor was forgotten and should stop
+
+        """
+        with self.lock:
+            if self.actors.get(actor.game_id) is not actor:
+                return False
+            if not force and not actor.queue.empty():
+                return False
+            del self.actors[actor.game_id]
+            self.retired[actor.game_id] = actor.thread
+            return True
+
+    def release(self, *game_ids):
+        """Stop owning games, writing their changes to the database.
+
+        :param game_ids: identifiers of games; :const:`None` is ignored
+
+        """
+        stopping = []
+        with self.lock:
+            for game_id in game_ids:
+                actor = self.actors.pop(game_id, None)
+                if actor is not None:
+                    actor.queue.put(_STOP)
+                    self.retired[game_id] = actor.thread
+                    stopping.append(actor.thread)
+        for thread in stopping:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def close(self):
+        """Release every game."""
+        with self.lock:
+            game_ids = list(self.actors)
+        self.release(*game_ids)
@@ -0,0 +1,333 @@
+"""Per-game event log.
+
+.. Copyright © 2015, David Maze
+
+Every mutation in :mod:`crail.actions` appends a compact
+:class:`crail.models.GameEvent` to its game's log.  Every
+:data:`crail.settings.CRAIL_EVENT_SNAPSHOT_INTERVAL` events the game
+state is saved as a :class:`crail.models.GameSnapshot`, so rebuilding
+a game at any point is loading the nearest earlier snapshot and
+replaying the few events after it.
+
+A game state is a dictionary with two keys:
+
+`players`
+  Dictionary mapping player ID to a dictionary with `money` (the
+  player's balance) and `cards` (list of card IDs in their hand), for
+  every player in the game
+`played`
+  List of card IDs drawn since the last reshuffle
+
+Event data is a dictionary whose keys depend on the kind of event:
+
+``new``
+  `world`, the world ID
+``join``
+  `money` and `cards` the player brought into the game
+``leave``
+  nothing
+``gain``, ``spend``, ``adjust``
+  signed `amount`
+``draw``
+  `card` drawn, and `reshuffle` if the played cards were reset first
+``discard``
+  `card` discarded
+``complete``
+  `contract` delivered and total `amount` paid
+``restore``
+  an entire game state
+
+The log lives in the game's shard (see :mod:`crail.routing`).  None of
+these functions commit.
+
+.. autofunction:: apply_event
+.. autofunction:: history
+.. autofunction:: record
+.. autofunction:: replay
+.. autofunction:: restore
+.. autofunction:: write_snapshot
+
+"""
+import copy
+import json
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import ledger, versions
+from .models import GameEvent, GameSequence, GameSnapshot, PlayedCard, \
+    Player, card_contract, db, player_card
+
+events = GameEvent.__table__  # pylint: disable=invalid-name
+sequences = GameSequence.__table__  # pylint: disable=invalid-name
+snapshots = GameSnapshot.__table__  # pylint: disable=invalid-name
+
+
+def dumps(obj):
+    """Serialize an object as compact JSON."""
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True)
+
+
+def empty_state():
+    """Get the state of a game before anything has happened."""
+    return {'players': {}, 'played': []}
+
+
+def _encode_state(state):
+    """Serialize a game state (JSON object keys must be strings)."""
+    return dumps({'players': {str(k): v
+                              for k, v in state['players'].items()},
+                  'played': state['played']})
+
+
+def _decode_state(text):
+    """Deserialize a game state."""
+    state = json.loads(text)
+    state['players'] = {int(k): v for k, v in state['players'].items()}
+    return state
+
+
+def _next_seq(game_id):
+    """Allocate the next sequence number in a game's log.
+
+    Incrementing the game's :class:`crail.models.GameSequence` row locks
+    it, so a concurrent writer to the same game waits for this
+    transaction and then gets the following number.  Call within the
+    game's shard.
+
+    """
+    result = db.session.execute(
+        sequences.update()
+        .where(sequences.c.game_id == game_id)
+        .values(seq=sequences.c.seq + 1))
+    if result.rowcount:
+        return db.session.execute(
+            select([sequences.c.seq])
+            .where(sequences.c.game_id == game_id)).scalar()
+    # a new game, or one whose log predates the counter
+    seq = (db.session.execute(
+        select([func.max(events.c.seq)])
+        .where(events.c.game_id == game_id)).scalar() or 0) + 1
+    db.session.execute(sequences.insert().values(game_id=game_id, seq=seq))
+    return seq
+
+
+def record(game_id, kind, player_id=None, **data):
+    """Append an event to a game's log.
+
+    Writes a snapshot as well if this event lands on the snapshot
+    interval.
+
+    :param int game_id: identifier of the game
+    :param str kind: kind of event
+    :param int player_id: identifier of the acting player, if any
+    :param data: event details
+    :return: the event's sequence number
+
+    """
+    with db.shard(game_id):
+        seq = _next_seq(game_id)
+        db.session.execute(events.insert().values(
+            game_id=game_id, seq=seq, kind=kind, player_id=player_id,
+            data=dumps(data)))
+    if seq % current_app.config['CRAIL_EVENT_SNAPSHOT_INTERVAL'] == 0:
+        write_snapshot(game_id)
+    return seq
+
+
+def _player(players, player_id):
+    """Get a player's state, even if the log never saw them join."""
+    return players.setdefault(player_id, {'money': 0, 'cards': []})
+
+
+def apply_event(state, kind, player_id, data, contract_cards):
+    """Apply one event to a game state in place.
+
+    :param dict state: game state
+    :param str kind: kind of event
+    :param int player_id: identifier of the acting player, if any
+    :param dict data: event details
+    :param dict contract_cards: mapping of contract ID to the set of
+      card IDs carrying it, for at least every contract completed
+
+    """
+    players = state['players']
+    if kind == 'join':
+        players[player_id] = {'money': data['money'],
+                              'cards': list(data['cards'])}
+    elif kind == 'leave':
+        players.pop(player_id, None)
+    elif kind in ('gain', 'spend', 'adjust'):
+        _player(players, player_id)['money'] += data['amount']
+    elif kind == 'draw':
+        if data.get('reshuffle'):
+            state['played'] = []
+        state['played'].append(data['card'])
+        if player_id is not None:
+            _player(players, player_id)['cards'].append(data['card'])
+    elif kind == 'discard':
+        hand = _player(players, player_id)
+        hand['cards'] = [c for c in hand['cards'] if c != data['card']]
+    elif kind == 'complete':
+        hand = _player(players, player_id)
+        carrying = contract_cards.get(data['contract'], ())
+        hand['cards'] = [c for c in hand['cards'] if c not in carrying]
+        hand['money'] += data['amount']
+    elif kind == 'restore':
+        state.clear()
+        state.update(copy.deepcopy(data))
+        state['players'] = {int(k): v for k, v in state['players'].items()}
+
+
+def _contract_cards(contract_ids):
+    """Map contract IDs to the set of cards carrying them."""
+    result = {}
+    if contract_ids:
+        for card_id, contract_id in db.session.execute(
+                select([card_contract.c.card_id,
+                        card_contract.c.contract_id])
+                .where(card_contract.c.contract_id.in_(contract_ids))):
+            result.setdefault(contract_id, set()).add(card_id)
+    return result
+
+
+def replay(game_id, seq=None, use_snapshots=True):
+    """Rebuild a game's state.
+
+    :param int game_id: identifier of the game
+    :param int seq: rebuild the state just after this event; if
+      :const:`None`, rebuild the current state
+    :param bool use_snapshots: start from the nearest snapshot; if
+      false, replay the entire log
+    :return: tuple of the game state, the sequence number of the last
+      event included, and the number of events replayed
+
+    """
+    state, start = empty_state(), 0
+    with db.shard(game_id):
+        if use_snapshots:
+            query = (select([snapshots.c.seq, snapshots.c.state])
+                     .where(snapshots.c.game_id == game_id)
+                     .order_by(snapshots.c.seq.desc())
+                     .limit(1))
+            if seq is not None:
+                query = query.where(snapshots.c.seq <= seq)
+            row = db.session.execute(query).first()
+            if row is not None:
+                start, state = row.seq, _decode_state(row.state)
+
+        query = (select([events.c.seq, events.c.kind, events.c.player_id,
+                         events.c.data])
+                 .where(events.c.game_id == game_id)
+                 .where(events.c.seq > start)
+                 .order_by(events.c.seq))
+        if seq is not None:
+            query = query.where(events.c.seq <= seq)
+        rows = [(row.seq, row.kind, row.player_id, json.loads(row.data))
+                for row in db.session.execute(query)]
+
+    contract_cards = _contract_cards(
+        {data['contract'] for _, kind, _, data in rows if kind == 'complete'})
+    for _, kind, player_id, data in rows:
+        apply_event(state, kind, player_id, data, contract_cards)
+    last = rows[-1][0] if rows else start
+    return state, last, len(rows)
+
+
+def history(game_id, before=None, limit=50):
+    """Get a page of a game's log, newest first.
+
+    This is keyset pagination over the ``(game_id, seq)`` unique index:
+    every page, including the first, is one index range scan of at most
+    ``limit + 1`` rows, however long the game has run.
+
+    :param int game_id: identifier of the game
+    :param int before: only return events before this sequence number;
+      if :const:`None`, start from the most recent event
+    :param int limit: maximum number of events to return
+    :return: tuple of a list of :class:`crail.models.GameEvent`-like
+      rows, with `data` decoded, and the `before` value for the next
+      page, or :const:`None` if this is the last page
+
+    """
+    query = (select([events.c.seq, events.c.created, events.c.kind,
+                     events.c.player_id, events.c.data])
+             .where(events.c.game_id == game_id)
+             .order_by(events.c.seq.desc())
+             .limit(limit + 1))
+    if before is not None:
+        query = query.where(events.c.seq < before)
+    with db.shard(game_id):
+        rows = db.session.execute(query).fetchall()
+    page = [{'seq': row.seq, 'created': row.created, 'kind': row.kind,
+             'player_id': row.player_id, 'data': json.loads(row.data)}
+            for row in rows[:limit]]
+    cursor = page[-1]['seq'] if len(rows) > limit else None
+    return page, cursor
+
+
+def write_snapshot(game_id):
+    """Save a game's current state as a snapshot.
+
+    :param int game_id: identifier of the game
+    :return: the game state
+
+    """
+    state, seq, count = replay(game_id)
+    if count:
+        with db.shard(game_id):
+            db.session.execute(snapshots.insert().values(
+                game_id=game_id, seq=seq, state=_encode_state(state)))
+    return state
+
+
+def restore(game_id, state):
+    """Make a game's tables match a game state.
+
+    Players in `state` are moved into the game and given exactly its
+    cards and money (through ``adjust`` ledger entries); other players
+    in the game are removed from it; the played cards are replaced.
+    With sharding, players' hands and money from other shards are not
+    carried over.  This is recorded as a ``restore`` event, so the log stays
+    consistent with the tables.
+
+    :param int game_id: identifier of the game
+    :param dict state: game state, as returned from :func:`replay`
+    :return: the ``restore`` event's sequence number
+
+    """
+    player_ids = list(state['players'])
+    db.session.execute(Player.__table__.update().where(
+        Player.game_id == game_id).values(game_id=None))
+    if player_ids:
+        db.session.execute(Player.__table__.update().where(
+            Player.id.in_(player_ids)).values(game_id=game_id))
+    db.session.expire_all()
+    versions.bump_lobby()
+
+    with db.shard(game_id):
+        if player_ids:
+            db.session.execute(player_card.delete().where(
+                player_card.c.player_id.in_(player_ids)))
+            hands = [{'player_id': player_id, 'card_id': card_id}
+                     for player_id, hand in state['players'].items()
+                     for card_id in hand['cards']]
+            if hands:
+                db.session.execute(player_card.insert(), hands)
+            for player in Player.query.filter(Player.id.in_(player_ids)):
+                difference = (state['players'][player.id]['money'] -
+                              ledger.balance(player))
+                if difference:
+                    ledger.record(player, 'adjust', difference)
+
+        played = PlayedCard.__table__
+        db.session.execute(played.delete().where(
+            played.c.game_id == game_id))
+        if state['played']:
+            db.session.execute(played.insert(),
+                               [{'game_id': game_id, 'card_id': card_id}
+                                for card_id in state['played']])
+
+    return record(game_id, 'restore', None,
+                  players={str(k): v for k, v in state['players'].items()},
+                  played=state['played'])
@@ -0,0 +1,207 @@
+"""Bulk export for offline analytics.
+
+.. Copyright © 2015, David Maze
+
+``crail_manage export DIRECTORY`` copies games, players, played cards,
+hands, and completed contracts into gzipped JSON-lines files, one JSON
+object per row:
+
+.. code-block:: none
+
+   DIRECTORY/
+     watermarks.json
+     game/20151019T120000.000000Z.jsonl.gz
+     played_card/20151019T120000.000000Z.jsonl.gz
+     ...
+
+Rows are read and written in batches, so memory use does not depend on
+the size of the tables.  Append-only tables (games, played cards, and
+completed contracts) are exported incrementally: the highest ID
+exported from each is kept in ``watermarks.json``, and the next run only
+copies newer rows.  The :class:`crail.models.PlayedCard` rows
+themselves are deleted on every reshuffle, so played cards come from
+the ``draw`` events in the game log (see :mod:`crail.events`) instead.
+Players and hands change in place, so every run copies them in full.
+The watermarks are only updated once a run has
+finished, so if a run fails the next one repeats its rows; consumers
+should deduplicate by `id`.
+
+With sharding (see :mod:`crail.routing`) every shard is exported, and
+each shard keeps its own watermarks.  So is the primary database,
+which holds the hands and money of players who are not in a game.
+
+.. autofunction:: export
+
+"""
+import datetime
+import gzip
+import json
+import os
+
+from flask import current_app
+from sqlalchemy import select
+
+from .events import dumps
+from .models import Game, GameEvent, MoneyEntry, Player, World, db, \
+    player_card
+
+games = Game.__table__  # pylint: disable=invalid-name
+players = Player.__table__  # pylint: disable=invalid-name
+events = GameEvent.__table__  # pylint: disable=invalid-name
+entries = MoneyEntry.__table__  # pylint: disable=invalid-name
+
+#: Name of the file holding the watermarks, in the export directory.
+WATERMARKS = 'watermarks.json'
+
+
+def _streams():
+    """Describe what is exported.
+
+    :return: list of tuples of the stream name, a query, the column
+      used as the watermark (or :const:`None` to copy everything every
+      time), whether the table is sharded, and a function turning a
+      row into a dictionary
+
+    """
+    return [
+        ('game',
+         select([games.c.id, games.c.world_id, World.name.label('world')])
+         .select_from(games.join(World.__table__)),
+         games.c.id, False, _row),
+        ('player',
+         select([players.c.id, players.c.name, players.c.game_id])
+         .order_by(players.c.id),
+         None, False, _row),
+        ('played_card',
+         select([events.c.id, events.c.game_id, events.c.seq,
+                 events.c.player_id, events.c.created, events.c.data])
+         .where(events.c.kind == 'draw'),
+         events.c.id, True, _draw),
+        ('hand',
+         select([player_card.c.player_id, player_card.c.card_id])
+         .order_by(player_card.c.player_id),
+         None, True, _row),
+        ('completed_contract',
+         select([entries.c.id, entries.c.game_id, entries.c.player_id,
+                 entries.c.contract_id, entries.c.amount])
+         .where(entries.c.kind == 'contract'),
+         entries.c.id, True, _row),
+    ]
+
+
+def _row(row):
+    """Translate a row to a dictionary."""
+    return dict(zip(row.keys(), row))
+
+
+def _draw(row):
+    """Translate a ``draw`` event to a played card."""
+    data = json.loads(row.data)
+    return {'id': row.id, 'game_id': row.game_id, 'seq': row.seq,
+            'player_id': row.player_id, 'card_id': data['card'],
+            'reshuffle': data.get('reshuffle', False),
+            'time': row.created.isoformat() + 'Z' if row.created else None}
+
+
+def _shards():
+    """List the shards as pairs of a label and a game ID in the shard.
+
+    The primary database is included with a game ID of :const:`None`.
+
+    """
+    shards = current_app.config['CRAIL_SHARDS']
+    if not shards:
+        return [(None, None)]
+    if shards == 'game':
+        keys = [(str(row.id), row.id)
+                for row in db.session.execute(select([games.c.id]))]
+    else:
+        keys = [(str(key), key) for key in range(shards)]
+    return [('primary', None)] + keys
+
+
+class _Writer(object):
+    """Lazily-opened gzipped JSON-lines file."""
+
+    def __init__(self, path, translate):
+        self.path = path
+        self.translate = translate
+        self.file = None
+        self.count = 0
+
+    def write(self, rows):
+        """Write a batch of rows."""
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        for row in rows:
+            self.file.write(dumps(self.translate(row)))
+            self.file.write('\n')
+        self.count += len(rows)
+
+    def close(self):
+        """Finish the file, if anything was written."""
+        if self.file is not None:
+            self.file.close()
+
+
+def _load_watermarks(directory):
+    """Read the watermarks from a previous export."""
+    try:
+        with open(os.path.join(directory, WATERMARKS), 'r') as marks:
+            return json.load(marks)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_watermarks(directory, watermarks):
+    """Atomically replace the watermarks file."""
+    path = os.path.join(directory, WATERMARKS)
+    with open(path + '.tmp', 'w') as marks:
+        json.dump(watermarks, marks, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def export(directory, full=False, batch=1000):
+    """Export the database for analytics.
+
+    :param str directory: directory to write to
+    :param bool full: ignore the watermarks and export everything
+    :param int batch: number of rows read at a time
+    :return: dictionary mapping stream name to the number of rows
+      exported
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    watermarks = {} if full else _load_watermarks(directory)
+    run = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S.%fZ')
+    counts = {}
+    for name, query, mark, sharded, translate in _streams():
+        writer = _Writer(os.path.join(directory, name,
+                                      '{}.jsonl.gz'.format(run)), translate)
+        try:
+            for label, game_id in (_shards() if sharded else [(None, None)]):
+                key = name if label is None else '{}@{}'.format(name, label)
+                with db.shard(game_id):
+                    if mark is None:
+                        result = db.session.execute(query)
+                        rows = result.fetchmany(batch)
+                        while rows:
+                            writer.write(rows)
+                            rows = result.fetchmany(batch)
+                        continue
+                    last = watermarks.get(key, 0)
+                    while True:
+                        rows = db.session.execute(
+                            query.where(mark > last)
+                            .order_by(mark).limit(batch)).fetchall()
+                        if not rows:
+                            break
+                        writer.write(rows)
+                        last = rows[-1][mark.name]
+                    watermarks[key] = last
+        finally:
+            writer.close()
+        counts[name] = writer.count
+    _save_watermarks(directory, watermarks)
+    return counts
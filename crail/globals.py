@@ -20,6 +20,7 @@ thread-locals.
 from flask import session
 from werkzeug.local import LocalProxy
 
+from . import statements
 from .models import Player
 
 
@@ -28,7 +29,7 @@ def _get_current_player():
     player_id = session.get('player_id')
     if player_id is None:
         return None
-    return Player.query.get(int(player_id))
+    return statements.get(Player, int(player_id))
 
 # pylint: disable=invalid-name
 current_player = LocalProxy(_get_current_player)
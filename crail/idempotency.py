@@ -0,0 +1,100 @@
+"""Idempotent mutating requests.
+
+.. Copyright © 2015, David Maze
+
+The client queues actions while it is offline and replays them when the
+connection returns, and it cannot tell whether a request that timed out
+was applied.  So it sends a unique :data:`HEADER` with every action,
+and views decorated with :func:`idempotent` apply each key at most once
+per player.
+
+The key is recorded as a :class:`crail.models.ActionKey` in the same
+transaction as the action itself, so either both are committed or
+neither is.  A request whose key has already been recorded is not run
+again; the client gets the current state instead, with
+:data:`REPLAYED_HEADER` set.  Keys are forgotten after
+:data:`crail.settings.CRAIL_IDEMPOTENCY_TTL` seconds.
+
+With sharding (see :mod:`crail.routing`) the key lives in the primary
+database while most of the action lands in the game's shard, so the
+two are committed one after the other rather than atomically.
+
+.. autodata:: HEADER
+.. autodata:: REPLAYED_HEADER
+.. autofunction:: idempotent
+
+"""
+import datetime
+import functools
+
+from flask import abort, current_app, request
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics, statements
+from .globals import current_player
+from .models import ActionKey, db
+
+#: Request header carrying the client's key.
+HEADER = 'Idempotency-Key'
+
+#: Response header set when a request was not run because its key had
+#: already been applied.
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _forget_old_keys(player_id):
+    """Delete a player's expired keys."""
+    cutoff = (datetime.datetime.utcnow() -
+              datetime.timedelta(
+                  seconds=current_app.config['CRAIL_IDEMPOTENCY_TTL']))
+    db.session.execute(ActionKey.__table__.delete()
+                       .where(ActionKey.player_id == player_id)
+                       .where(ActionKey.created < cutoff))
+
+
+def idempotent(replay):
+    """Decorate a view so repeated requests are only applied once.
+
+    Requests without :data:`HEADER`, or from clients that are not
+    logged in, run as usual.  The view must commit the session.
+
+    :param replay: function returning the response to send, without
+      running the view, for a key that has already been applied
+
+    """
+    def decorator(view):
+        """Wrap `view`."""
+        def replayed():
+            """Respond to a repeated request."""
+            metrics.increment('idempotency.replayed')
+            response = replay()
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            player = current_player._get_current_object()
+            if not key or not player:
+                return view(*args, **kwargs)
+            if len(key) > ActionKey.key.type.length:
+                abort(400)
+            if statements.get(ActionKey, (player.id, key)) is not None:
+                return replayed()
+
+            _forget_old_keys(player.id)
+            db.session.add(ActionKey(player_id=player.id, key=key))
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # A concurrent request with the same key got there first
+                db.session.rollback()
+                return replayed()
+            try:
+                return view(*args, **kwargs)
+            except Exception:
+                # Forget the key along with the failed action
+                db.session.rollback()
+                raise
+        return wrapper
+    return decorator
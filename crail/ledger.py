@@ -0,0 +1,208 @@
+"""Append-only money ledger.
+
+.. Copyright © 2015, David Maze
+
+Money is never stored as a single mutable number.  Every gain, spend,
+and contract payout is a new :class:`crail.models.MoneyEntry` row, and
+a player's balance is their most recent
+:class:`crail.models.MoneySnapshot` plus the sum of the entries after
+it.  Recording money is a plain insert.  Each process counts the
+entries it records for each player, and every
+:data:`crail.settings.CRAIL_LEDGER_SNAPSHOT_INTERVAL` of them it reads
+the player's tail and writes a new snapshot if the tail has grown that
+long, so the tail sum stays short.  With several processes a tail
+can grow to a few times the interval before one of them cuts it.
+
+Ledger rows live in the shard of the player's current game (see
+:mod:`crail.routing`).  None of these functions commit.
+
+.. autofunction:: balance
+.. autofunction:: balances
+.. autofunction:: earned
+.. autofunction:: record
+.. autofunction:: snapshot
+.. autofunction:: totals
+
+"""
+import threading
+
+from flask import current_app
+from sqlalchemy import bindparam, func, select
+
+from .models import MoneyEntry, MoneySnapshot, db
+from .statements import Statement
+
+entries = MoneyEntry.__table__  # pylint: disable=invalid-name
+snapshots = MoneySnapshot.__table__  # pylint: disable=invalid-name
+
+#: Kinds of entries that count as money earned.
+EARNED_KINDS = ('gain', 'contract')
+
+#: Key of the per-player entry counts in the Flask application's
+#: extensions.
+EXTENSION = 'crail_ledger'
+
+_lock = threading.Lock()  # pylint: disable=invalid-name
+
+
+_last_snapshot = Statement(  # pylint: disable=invalid-name
+    select([snapshots.c.entry_id, snapshots.c.balance])
+    .where(snapshots.c.player_id == bindparam('player_id'))
+    .order_by(snapshots.c.entry_id.desc())
+    .limit(1))
+
+_entries_after = Statement(  # pylint: disable=invalid-name
+    select([func.count(), func.coalesce(func.sum(entries.c.amount), 0),
+            func.max(entries.c.id)])
+    .where(entries.c.player_id == bindparam('player_id'))
+    .where(entries.c.id > bindparam('entry_id')))
+
+
+def _tail(player_id):
+    """Find a player's latest snapshot and the entries after it.
+
+    :return: tuple of snapshot entry ID, snapshot balance, number of
+      later entries, sum of later entries, and ID of the last entry
+
+    """
+    row = _last_snapshot.execute(player_id=player_id).first()
+    entry_id, base = row if row is not None else (0, 0)
+    count, total, last = _entries_after.execute(
+        player_id=player_id, entry_id=entry_id).first()
+    return entry_id, base, count, total, last
+
+
+def record(player, kind, amount, contract_id=None):
+    """Record a movement of money.
+
+    This inserts one ledger entry for `player` in their current game.
+    Every so many entries it also checks whether enough have
+    accumulated since the last snapshot, and writes a new one if so.
+
+    :param player: :class:`crail.models.Player` whose money moves
+    :param str kind: ``gain``, ``spend``, ``contract``, or ``adjust``
+    :param int amount: signed amount; spending should be negative
+    :param int contract_id: identifier of the contract paid out, if any
+
+    """
+    with db.shard(player.game_id):
+        db.session.execute(entries.insert().values(
+            player_id=player.id, game_id=player.game_id, kind=kind,
+            amount=amount, contract_id=contract_id))
+        interval = current_app.config['CRAIL_LEDGER_SNAPSHOT_INTERVAL']
+        with _lock:
+            counts = current_app.extensions.setdefault(EXTENSION, {})
+            recorded = counts.get(player.id, 0) + 1
+            check = recorded >= interval
+            counts[player.id] = 0 if check else recorded
+        if check:
+            _, base, count, total, last = _tail(player.id)
+            if count >= interval:
+                db.session.execute(snapshots.insert().values(
+                    player_id=player.id, entry_id=last,
+                    balance=base + total))
+
+
+def snapshot(player):
+    """Write a balance snapshot for a player now.
+
+    :param player: :class:`crail.models.Player`
+    :return: the player's balance
+
+    """
+    with db.shard(player.game_id):
+        _, base, count, total, last = _tail(player.id)
+        if count:
+            db.session.execute(snapshots.insert().values(
+                player_id=player.id, entry_id=last, balance=base + total))
+    return base + total
+
+
+def balance(player):
+    """Get the amount of money a player has.
+
+    :param player: :class:`crail.models.Player`
+    :return: integer balance
+
+    """
+    with db.shard(player.game_id):
+        _, base, _, total, _ = _tail(player.id)
+    return base + total
+
+
+def balances(game_id, player_ids):
+    """Get the amount of money several players in one game have.
+
+    This is two queries however many players there are: one for their
+    latest snapshots and one for the entries after them.
+
+    :param int game_id: identifier of the players' game
+    :param player_ids: identifiers of :class:`crail.models.Player`
+    :return: dictionary mapping player ID to integer balance
+
+    """
+    player_ids = list(player_ids)
+    result = {player_id: 0 for player_id in player_ids}
+    if not player_ids:
+        return result
+    latest = (select([snapshots.c.player_id,
+                      func.max(snapshots.c.entry_id).label('entry_id')])
+              .where(snapshots.c.player_id.in_(player_ids))
+              .group_by(snapshots.c.player_id)
+              .alias('latest'))
+    with db.shard(game_id):
+        for player_id, base in db.session.execute(
+                select([snapshots.c.player_id, snapshots.c.balance])
+                .select_from(snapshots.join(
+                    latest,
+                    (snapshots.c.player_id == latest.c.player_id) &
+                    (snapshots.c.entry_id == latest.c.entry_id)))):
+            result[player_id] = base
+        for player_id, total in db.session.execute(
+                select([entries.c.player_id, func.sum(entries.c.amount)])
+                .select_from(entries.outerjoin(
+                    latest, entries.c.player_id == latest.c.player_id))
+                .where(entries.c.player_id.in_(player_ids))
+                .where(entries.c.id > func.coalesce(latest.c.entry_id, 0))
+                .group_by(entries.c.player_id)):
+            result[player_id] += total
+    return result
+
+
+def totals(game_id):
+    """Sum the money movements in a game.
+
+    :param int game_id: identifier of the game
+    :return: dictionary mapping player ID to a dictionary mapping entry
+      kind to the total amount of that kind
+
+    """
+    result = {}
+    with db.shard(game_id):
+        rows = db.session.execute(
+            select([entries.c.player_id, entries.c.kind,
+                    func.sum(entries.c.amount)])
+            .where(entries.c.game_id == game_id)
+            .group_by(entries.c.player_id, entries.c.kind)).fetchall()
+    for player_id, kind, total in rows:
+        result.setdefault(player_id, {})[kind] = total
+    return result
+
+
+def earned(game_id, player_id=None):
+    """Total money earned in a game.
+
+    This counts gains and contract payouts, but not spending.
+
+    :param int game_id: identifier of the game
+    :param int player_id: if given, only count this player's earnings
+    :return: integer amount
+
+    """
+    query = (select([func.coalesce(func.sum(entries.c.amount), 0)])
+             .where(entries.c.game_id == game_id)
+             .where(entries.c.kind.in_(EARNED_KINDS)))
+    if player_id is not None:
+        query = query.where(entries.c.player_id == player_id)
+    with db.shard(game_id):
+        return db.session.execute(query).scalar()
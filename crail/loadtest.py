@@ -0,0 +1,305 @@
+"""Load testing with simulated players.
+
+.. Copyright © 2015, David Maze
+
+``crail_manage loadtest URL`` finds out how many tables a running
+server can handle.  It starts bots, each one a player with its own
+session, that sit down at tables of ``--table`` players: the first bot
+at each table starts a game and the others join it.  Each bot then
+plays turns like a person at the table would -- draw a card, discard
+events, now and then complete a contract or buy something, glance at
+the table -- pausing a random think time (``--think`` seconds on
+average) between actions.
+
+The bots are added in stages: ``--ramp 50,200,1000`` runs 50 bots for
+``--stage`` seconds, then adds more to reach 200, then 1000.  After
+each stage it prints the request throughput, latency percentiles, and
+error rate seen during that stage.  ``503 Service Unavailable`` answers
+from :mod:`crail.admission` are counted separately as *busy*, and the
+bot waits out the ``Retry-After`` before going on.
+
+.. code-block:: sh
+
+   crail_manage loadtest http://localhost:8000 --ramp 100,500,2000
+
+The bots are :mod:`asyncio` tasks in a single process, so one machine
+can run thousands of them; this needs the optional :mod:`aiohttp`
+package (``pip install crail[loadtest]``).  Run it against a server
+with a world loaded and a database you do not mind filling with bot
+players and games.
+
+.. autoclass:: Stats
+   :members:
+.. autoclass:: Bot
+   :members:
+.. autofunction:: run
+
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import aiohttp
+
+from .idempotency import HEADER as KEY_HEADER
+from .traffic import percentile
+
+
+class Stats(object):
+    """Requests made during one stage of a load test."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.latencies = []
+        self.errors = 0
+        self.busy = 0
+
+    def record(self, elapsed, status):
+        """Count one request.
+
+        :param float elapsed: milliseconds it took
+        :param int status: HTTP status, or :const:`None` if there was
+          no response
+
+        """
+        self.latencies.append(elapsed)
+        if status == 503:
+            self.busy += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+
+    def summary(self, bots):
+        """Summarize the stage.
+
+        :param int bots: number of bots running
+        :return: dictionary of `bots`, `requests`, `seconds`,
+          `throughput` in requests per second, `p50`, `p95`, and `p99`
+          in milliseconds, `errors`, `busy`, and `error_rate`
+
+        """
+        seconds = time.monotonic() - self.start
+        requests = len(self.latencies)
+        return {
+            'bots': bots,
+            'requests': requests,
+            'seconds': seconds,
+            'throughput': requests / max(seconds, 1e-9),
+            'p50': percentile(self.latencies, 0.50),
+            'p95': percentile(self.latencies, 0.95),
+            'p99': percentile(self.latencies, 0.99),
+            'errors': self.errors,
+            'busy': self.busy,
+            'error_rate': (self.errors + self.busy) / max(requests, 1),
+        }
+
+
+class _Table(object):
+    """A game the bots at one table share."""
+
+    def __init__(self):
+        self.claimed = False
+        self.game_id = asyncio.Future()
+
+
+class Bot(object):
+    """One simulated player.
+
+    :param session: :class:`aiohttp.ClientSession` with this bot's
+      cookies
+    :param str url: base URL of the server
+    :param str name: player name to log in as
+    :param runner: object whose `stats` attribute is the current
+      stage's :class:`Stats`
+    :param float think: average seconds between actions
+
+    """
+
+    #: Most cards a bot holds before it discards one.
+    HAND_LIMIT = 8
+
+    def __init__(self, session, url, name, runner, think):
+        self.session = session
+        self.url = url
+        self.name = name
+        self.runner = runner
+        self.think = think
+        self.state = {}
+
+    async def request(self, method, path, data=None):
+        """Make one request.
+
+        :param str method: HTTP method
+        :param str path: path on the server
+        :param dict data: JSON request body, if any
+        :return: the decoded JSON response, or :const:`None` if the
+          request failed
+
+        """
+        headers = {}
+        if method == 'POST':
+            headers[KEY_HEADER] = uuid.uuid4().hex
+        status, body, retry = None, None, 0
+        start = time.perf_counter()
+        try:
+            async with self.session.request(
+                    method, self.url + path, json=data,
+                    headers=headers) as response:
+                status = response.status
+                body = await response.read()
+                retry = float(response.headers.get('Retry-After', 1))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+        self.runner.stats.record((time.perf_counter() - start) * 1000,
+                                 status)
+        if status == 503:
+            await asyncio.sleep(retry * (1 + random.random()))
+        if status != 200:
+            return None
+        state = json.loads(body.decode('utf-8'))
+        if 'player_id' in state:
+            self.state = state
+        return state
+
+    async def pause(self):
+        """Think before the next action."""
+        await asyncio.sleep(random.expovariate(1 / self.think)
+                            if self.think > 0 else 0)
+
+    async def sit(self, table, world):
+        """Log in and start or join the table's game.
+
+        :param table: the table this bot sits at
+        :param int world: world ID for new games, or :const:`None` for
+          the first one the server lists
+        :return: whether the bot is in a game
+
+        """
+        state = await self.request('POST', '/api/login', {'name': self.name})
+        if state is None:
+            return False
+        if world is None:
+            if not state.get('worlds'):
+                return False
+            world = state['worlds'][0]['id']
+        if not table.claimed:
+            table.claimed = True
+            game = None
+            if await self.request('POST', '/api/game/new',
+                                  {'world': world}) is not None:
+                game = await self.request('GET', '/api/game/table')
+            table.game_id.set_result(game['id'] if game else None)
+            return game is not None
+        game_id = await table.game_id
+        if game_id is None:
+            return await self.request('POST', '/api/game/new',
+                                      {'world': world}) is not None
+        return await self.request('POST', '/api/game/join',
+                                  {'game': game_id}) is not None
+
+    async def turn(self):
+        """Take one turn."""
+        await self.request('POST', '/api/draw')
+        for card in list(self.state.get('cards', [])):
+            if card.get('event'):
+                await self.pause()
+                await self.request('POST', '/api/discard',
+                                   {'card': card['id']})
+        contracts = [contract['id']
+                     for card in self.state.get('cards', [])
+                     for contract in card.get('contracts', [])]
+        if contracts and random.random() < 0.4:
+            await self.pause()
+            await self.request('POST', '/api/complete',
+                               {'contract': random.choice(contracts)})
+        elif random.random() < 0.3:
+            await self.pause()
+            await self.request('POST', '/api/spend',
+                               {'amount': random.randint(1, 20)})
+        cards = self.state.get('cards', [])
+        if len(cards) > self.HAND_LIMIT:
+            await self.pause()
+            await self.request('POST', '/api/discard',
+                               {'card': random.choice(cards)['id']})
+        await self.pause()
+        await self.request('GET', '/api/game/table')
+
+    async def play(self, table, world):
+        """Sit down and play until cancelled."""
+        await asyncio.sleep(random.uniform(0, self.think))
+        while not await self.sit(table, world):
+            await self.pause()
+        while True:
+            await self.pause()
+            await self.turn()
+
+
+class _Runner(object):
+    """Holds the current stage's statistics."""
+
+    def __init__(self):
+        self.stats = Stats()
+
+
+async def _run(url, ramp, stage, table_size, think, world, report):
+    """Run a load test in the current event loop."""
+    runner = _Runner()
+    prefix = 'bot-{}'.format(uuid.uuid4().hex[:8])
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=60)
+    sessions, tasks, tables, results = [], [], [], []
+    try:
+        for bots in ramp:
+            while len(tasks) < bots:
+                if len(tasks) % table_size == 0:
+                    tables.append(_Table())
+                session = aiohttp.ClientSession(
+                    connector=connector, connector_owner=False,
+                    cookie_jar=aiohttp.CookieJar(unsafe=True),
+                    timeout=timeout)
+                sessions.append(session)
+                bot = Bot(session, url.rstrip('/'),
+                          '{}-{}'.format(prefix, len(tasks)), runner, think)
+                tasks.append(asyncio.ensure_future(
+                    bot.play(tables[-1], world)))
+            runner.stats = Stats()
+            await asyncio.sleep(stage)
+            summary = runner.stats.summary(len(tasks))
+            summary['tables'] = len(tables)
+            results.append(summary)
+            report(summary)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in sessions:
+            await session.close()
+        await connector.close()
+    return results
+
+
+def run(url, ramp, stage=30.0, table_size=4, think=2.0, world=None,
+        report=None):
+    """Run a load test against a server.
+
+    :param str url: base URL of the server
+    :param list ramp: increasing numbers of bots to run in each stage
+    :param float stage: seconds each stage runs
+    :param int table_size: bots in each game
+    :param float think: average seconds between a bot's actions
+    :param int world: world ID for new games, or :const:`None` for the
+      first one the server lists
+    :param report: function called with each stage's summary as it
+      finishes
+    :return: list of stage summaries from :meth:`Stats.summary`, each
+      with an extra `tables` count
+
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_run(
+            url, ramp, stage, table_size, think, world,
+            report or (lambda summary: None)))
+    finally:
+        loop.close()
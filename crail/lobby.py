@@ -0,0 +1,86 @@
+"""Shared lobby listing.
+
+.. Copyright © 2015, David Maze
+
+Everyone outside a game sees the same list of games and worlds, and it
+only changes when a game is created, someone joins or leaves one, or a
+world is imported -- all of which bump the lobby version (see
+:mod:`crail.versions`).  Each process keeps one pre-serialized copy of
+the listing per application, and rebuilds it only when the version
+changes, so a room full of players idling in the lobby costs one
+rebuild per change rather than one per request.
+
+Checking the version is itself a query.  Once a copy has been checked
+it is trusted for :data:`crail.settings.CRAIL_LOBBY_CHECK_INTERVAL`
+seconds, unless this process has bumped the lobby since, so changes
+made by other processes can take up to that long to appear.  Set it to
+0 to check on every request.
+
+Hits and rebuilds are counted as ``lobby.hit`` and ``lobby.miss`` in
+:mod:`crail.metrics`.
+
+.. autofunction:: listing
+
+"""
+import threading
+import time
+
+from flask import current_app
+
+from . import metrics, versions
+
+#: Key of the cache in the Flask application's extensions.
+EXTENSION = 'crail_lobby'
+
+
+class _Listing(object):
+    """One application's cached lobby listing."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.value = None
+        self.checked = None
+        self.bumps = None
+
+
+_create_lock = threading.Lock()  # pylint: disable=invalid-name
+
+
+def _cache(app):
+    """Get an application's cached listing, creating it if needed."""
+    with _create_lock:
+        return app.extensions.setdefault(EXTENSION, _Listing())
+
+
+def listing(build):
+    """Get the current lobby listing.
+
+    :param build: function of the lobby version that builds the
+      listing, called only when the cached copy is out of date
+    :return: whatever `build` returned for the current lobby version
+
+    """
+    app = current_app._get_current_object()
+    cache = _cache(app)
+    interval = app.config['CRAIL_LOBBY_CHECK_INTERVAL']
+    bumps = versions.lobby_bumps()
+    now = time.monotonic()
+    with cache.lock:
+        if (cache.value is not None and cache.bumps == bumps and
+                now - cache.checked < interval):
+            metrics.increment('lobby.hit')
+            return cache.value
+        version, value = cache.version, cache.value
+    current = versions.lobby_version()
+    if value is None or version != current:
+        metrics.increment('lobby.miss')
+        value = build(current)
+    else:
+        metrics.increment('lobby.hit')
+    with cache.lock:
+        # A slower request must not replace a newer listing
+        if cache.version is None or current >= cache.version:
+            cache.version, cache.value = current, value
+            cache.checked, cache.bumps = now, bumps
+    return value
@@ -3,7 +3,7 @@
 
 .. Copyright © 2015, David Maze
 
-There are three important things you can do with this tool.
+There are eleven important things you can do with this tool.
 
 
 1. Create the specified database, or migrate from the previous schema.
@@ -12,42 +12,173 @@ There are three important things you can do with this tool.
 
       crail_manage db upgrade
 
-1. Load a YAML file of game data into the database.
+1. Apply migrations that batch their work (see :mod:`crail.online`)
+   while games are running, or estimate how long they would take.
+
+   .. code-block:: sh
+
+      crail_manage migrate --dry-run
+      crail_manage migrate --batch 500
+
+1. Load a YAML file of game data into the database.  If
+   :data:`crail.settings.CRAIL_CATALOG_DIR` is set, this also compiles
+   the world's :mod:`crail.catalog` file.
 
    .. code-block:: sh
 
       crail_manage game game.yaml
 
+1. Rebuild a game's state from its event log, optionally writing it
+   back to the database.
+
+   .. code-block:: sh
+
+      crail_manage replay 1 --seq 42 --restore
+
+1. Save one game to a file, and load it back as a new game (here or in
+   another database with the same world).
+
+   .. code-block:: sh
+
+      crail_manage snapshot 1 --output game-1.crail.gz
+      crail_manage restore game-1.crail.gz
+
+1. Estimate contract payouts and event frequency for a world by
+   simulating many games.
+
+   .. code-block:: sh
+
+      crail_manage simulate 'Boston Rails' --games 100000
+
+1. Export games, hands, and payouts for offline analytics.  Run this
+   again later to copy only what is new.
+
+   .. code-block:: sh
+
+      crail_manage export /srv/crail-export
+
+1. Time parts of the application against a scratch database.
+
+   .. code-block:: sh
+
+      crail_manage benchmark statements --count 5000
+
+1. Replay traffic recorded by :mod:`crail.traffic` against this build
+   and a scratch database, comparing latency and errors with the
+   recording or an earlier replay.
+
+   .. code-block:: sh
+
+      crail_manage replay-traffic --world game.yaml --speed 10 \
+          --save replay.json traffic.jsonl*
+
+1. Find out how many tables a running server can handle, with
+   simulated players (see :mod:`crail.loadtest`).
+
+   .. code-block:: sh
+
+      crail_manage loadtest http://localhost:8000 --ramp 100,500,2000
+
 1. Run the debug server.
 
    .. code-block:: sh
 
       crail_manage runserver
 
-To run a production server, use a standard WSGI server, e.g.
+To run a production server, build the Web asset bundles once, then use
+a standard WSGI server, e.g.
 
 .. code-block:: sh
 
+   crail_manage assets build
    gunicorn crail.wsgi
 
+.. autofunction:: make_manage_app
+
 """
+import json
+import os
 import sys
+import time
 import yaml
+from . import assets, backup, catalog, events, export as exporter, \
+    versions
 from .app import make_app
-from .models import Card, City, Contract, Good, World, db
+from .models import Card, City, Contract, Game, Good, Player, World, db
+from flask import current_app
 from flask.ext.assets import ManageAssets
-from flask.ext.migrate import MigrateCommand
-from flask.ext.script import Manager
+from flask.ext.migrate import Migrate, MigrateCommand, \
+    upgrade as upgrade_database
+from flask.ext.script import Command, Manager, Option
 from flask.ext.script.commands import InvalidCommand
 from sqlalchemy.orm.exc import NoResultFound
 
 
+#: The Flask-Migrate Alembic wrapper.  This lives here, and not in
+#: :mod:`crail.models`, so that serving requests never imports Alembic.
+migrate = Migrate(db=db)  # pylint: disable=invalid-name
+
+
+def make_manage_app(config=None):
+    """Create the Flask application with management extensions.
+
+    This is :func:`crail.app.make_app` plus database migrations and the
+    Flask-Assets environment needed to build the Web asset bundles.
+
+    :param dict config: optional extra configuration parameters
+
+    """
+    app = make_app(config)
+    # flask-migrate is super-useful, except that it depends on an
+    # unpacked tree.  It doesn't look like Alembic does.  Alas!
+    # At any rate, feed it the right directory so tooling works.
+    migrate.init_app(app, db,
+                     directory=os.path.join(os.path.dirname(__file__),
+                                            'migrations'))
+    assets.environment(app)
+    return app
+
+
 #: Flask-Script CLI instance.
-manager = Manager(make_app)  # pylint: disable=invalid-name
+manager = Manager(make_manage_app)  # pylint: disable=invalid-name
 manager.add_command('assets', ManageAssets)
 manager.add_command('db', MigrateCommand)
 
 
+class MigrateOnline(Command):
+    """Upgrade the database, batching large changes."""
+
+    option_list = (
+        Option('revision', nargs='?', default='head'),
+        Option('--dry-run', action='store_true',
+               help='estimate the time, then roll everything back'),
+        Option('--batch', type=int, default=None,
+               help='rows in each batch (default CRAIL_ONLINE_BATCH)'),
+        Option('--pause', type=float, default=None,
+               help='seconds between batches (default CRAIL_ONLINE_PAUSE)'),
+    )
+
+    def run(self, revision, dry_run, batch, pause):
+        # pylint: disable=arguments-differ
+        from . import online
+        x_arg = []
+        if dry_run:
+            x_arg.append('dry_run=1')
+        if batch is not None:
+            x_arg.append('batch={}'.format(batch))
+        if pause is not None:
+            x_arg.append('pause={}'.format(pause))
+        start = time.perf_counter()
+        upgrade_database(revision=revision, x_arg=x_arg)
+        if dry_run:
+            print('Dry run took {:.3f}s and changed nothing; batched steps '
+                  'would take about {:.0f}s more'.format(
+                      time.perf_counter() - start, online.estimated()))
+
+
+manager.add_command('migrate', MigrateOnline())
+
+
 @manager.option('filename')
 def game(filename):
     """Import a YAML file of game data."""
@@ -60,6 +191,8 @@ def game(filename):
     except NoResultFound:
         world = World(name=world_name)
         db.session.add(world)
+    world.hand_size = contents.get('hand_size')
+    world.hand_counts_events = contents.get('hand_counts_events', False)
 
     for city_name, city_produces in contents['cities'].items():
         try:
@@ -104,8 +237,291 @@ def game(filename):
             contract.amount = contract_data[2]
             card.contracts.append(contract)
 
+    versions.bump_lobby()
     db.session.commit()
 
+    directory = current_app.config['CRAIL_CATALOG_DIR']
+    if directory is not None:
+        print('Compiled {}'.format(catalog.write(world, directory)))
+
+
+@manager.option('--restore', action='store_true',
+                help='write the rebuilt state back to the database')
+@manager.option('--full', action='store_true',
+                help='replay the whole log, ignoring snapshots')
+@manager.option('--seq', type=int, default=None,
+                help='rebuild the state just after this event')
+@manager.option('game_id', type=int)
+def replay(game_id, seq, full, restore):
+    """Rebuild a game's state from its event log."""
+    start = time.perf_counter()
+    state, last, count = events.replay(game_id, seq=seq,
+                                       use_snapshots=not full)
+    elapsed = time.perf_counter() - start
+
+    players = {player.id: player for player in
+               Player.query.filter(Player.id.in_(list(state['players'])))}
+    for player_id, hand in sorted(state['players'].items()):
+        print('{}: {} with cards {}'.format(
+            players[player_id] if player_id in players else player_id,
+            hand['money'], ', '.join(str(c) for c in hand['cards'])))
+    print('{} cards played since the last reshuffle'
+          .format(len(state['played'])))
+    print('Replayed {} events up to #{} in {:.3f}s ({:.0f} events/sec)'
+          .format(count, last, elapsed, count / max(elapsed, 1e-9)))
+
+    if restore:
+        events.restore(game_id, state)
+        db.session.commit()
+        print('Restored game {} to event #{}'.format(game_id, last))
+
+
+@manager.option('--output', default=None,
+                help='file to write (default game-GAME_ID.crail.gz)')
+@manager.option('game_id', type=int)
+def snapshot(game_id, output):
+    """Save one game's state to a file."""
+    game = Game.query.get(game_id)
+    if game is None:
+        raise InvalidCommand('Game {} does not exist'.format(game_id))
+    if output is None:
+        output = 'game-{}.crail.gz'.format(game_id)
+    start = time.perf_counter()
+    try:
+        backup.write(game, output)
+    except ValueError as exc:
+        raise InvalidCommand(str(exc))
+    print('Saved game {} to {} in {:.3f}s'
+          .format(game_id, output, time.perf_counter() - start))
+
+
+@manager.option('filename')
+def restore(filename):
+    """Load a game saved by the snapshot command as a new game."""
+    start = time.perf_counter()
+    try:
+        game = backup.load(backup.read(filename))
+    except ValueError as exc:
+        raise InvalidCommand(str(exc))
+    db.session.commit()
+    print('Restored {} as game {} in {:.3f}s'
+          .format(filename, game.id, time.perf_counter() - start))
+
+
+@manager.option('--seed', type=int, default=None,
+                help='random seed, for repeatable results')
+@manager.option('--hand', type=int, default=3,
+                help='contract cards in a starting hand')
+@manager.option('--draws', type=int, default=30,
+                help='cards drawn in each game')
+@manager.option('--games', type=int, default=10000,
+                help='number of games to simulate')
+@manager.option('world_name', metavar='WORLD')
+def simulate(world_name, games, draws, hand, seed):
+    """Simulate many games' draws from a world."""
+    try:
+        from . import simulate as simulation
+    except ImportError:
+        raise InvalidCommand('simulate needs NumPy; '
+                             'pip install crail[simulate]')
+    try:
+        world = World.query.filter_by(name=world_name).one()
+    except NoResultFound:
+        raise InvalidCommand('World {} does not exist'.format(world_name))
+
+    deck = simulation.Deck(world)
+    start = time.perf_counter()
+    try:
+        results = simulation.simulate(deck, games, draws, hand, seed=seed)
+    except ValueError as exc:
+        raise InvalidCommand(str(exc))
+    elapsed = time.perf_counter() - start
+
+    total = games * draws
+    print('Simulated {} games of {} draws from {} cards in {:.3f}s '
+          '({:.0f} draws/sec)'.format(games, draws, len(deck), elapsed,
+                                      total / max(elapsed, 1e-9)))
+    events = results['events']
+    print('Events: {:.2f} per game ({:.1%} of draws); {:.1%} of games '
+          'see at least one'.format(events.mean(), events.sum() / total,
+                                    (events > 0).mean()))
+    print()
+    for line in simulation.percentile_table(
+            'Starting hand', ['{} cards'.format(hand)],
+            results['hand_value'][:, None]):
+        print(line)
+    print()
+    for line in simulation.percentile_table('Good', deck.goods,
+                                            results['good_payouts']):
+        print(line)
+    print()
+    for line in simulation.percentile_table('City', deck.cities,
+                                            results['city_payouts']):
+        print(line)
+
+
+@manager.option('--batch', type=int, default=1000,
+                help='rows read at a time')
+@manager.option('--full', action='store_true',
+                help='ignore the watermarks and export everything')
+@manager.option('directory')
+def export(directory, full, batch):
+    """Export the database for offline analytics."""
+    start = time.perf_counter()
+    counts = exporter.export(directory, full=full, batch=batch)
+    for name, count in sorted(counts.items()):
+        print('{}: {} rows'.format(name, count))
+    print('Exported {} rows in {:.3f}s'.format(sum(counts.values()),
+                                              time.perf_counter() - start))
+
+
+@manager.option('--count', type=int, default=1000,
+                help='number of messages or calls in each case')
+@manager.option('suite', choices=['channel', 'engine', 'statements'])
+def benchmark(suite, count):
+    """Run a local performance benchmark."""
+    from . import benchmark as benchmarks
+    for name, number, elapsed, size in getattr(benchmarks, suite)(count):
+        line = '{}: {} in {:.3f}s ({:.0f}/sec, {:.1f}us each)'.format(
+            name, number, elapsed, number / max(elapsed, 1e-9),
+            elapsed * 1e6 / max(number, 1))
+        if size is not None:
+            line += ', {:.0f} bytes/reply'.format(size / max(number, 1))
+        print(line)
+
+
+def _speed(value):
+    """Parse a replay speed: a multiple of real time, or 'max'."""
+    if value == 'max':
+        return None
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise ValueError(value)
+    return speed
+
+
+def _change(value, reference):
+    """Format a number and its difference from a reference."""
+    if value is None:
+        return '-'
+    if reference is None:
+        return '{:.1f}'.format(value)
+    return '{:.1f} ({:+.1f})'.format(value, value - reference)
+
+
+class ReplayTraffic(Command):
+    """Replay recorded traffic against a scratch database."""
+
+    option_list = (
+        Option('traces', nargs='+', metavar='TRACE',
+               help='files written by CRAIL_TRAFFIC_LOG'),
+        Option('--world', action='append', default=[], dest='worlds',
+               help='YAML world file to load first (repeatable)'),
+        Option('--speed', type=_speed, default=1.0,
+               help="multiple of the recorded pace, like 1 or 10x, or "
+               "'max'"),
+        Option('--concurrency', type=int, default=4,
+               help='number of clients sending at once'),
+        Option('--save', default=None,
+               help='write the summary to this JSON file'),
+        Option('--baseline', default=None,
+               help='compare with a summary written by --save'),
+    )
+
+    def run(self, traces, worlds, speed, concurrency, save, baseline):
+        # pylint: disable=arguments-differ,too-many-arguments
+        from . import traffic
+        from .benchmark import scratch_app
+        records = traffic.read(traces)
+        if not records:
+            raise InvalidCommand('No requests in {}'.format(
+                ', '.join(traces)))
+        reference = None
+        if baseline is not None:
+            with open(baseline, 'r') as baseline_file:
+                reference = json.load(baseline_file)
+
+        with scratch_app(world=None) as app:
+            with app.app_context():
+                for filename in worlds:
+                    game(filename)
+            start = time.perf_counter()
+            results = traffic.replay(app, records, speed=speed,
+                                     concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+        summary = traffic.summarize(results)
+
+        against = 'baseline' if reference is not None else 'recorded'
+        print('{:<24} {:>7} {:>16} {:>16} {:>9} {:>7}'.format(
+            'endpoint', 'count', 'p50 ms', 'p95 ms', 'errors', 'changed'))
+        for endpoint, row in sorted(summary.items()):
+            if reference is not None:
+                old = reference.get(endpoint, {})
+            else:
+                old = {'p50': row['recorded_p50'],
+                       'p95': row['recorded_p95'],
+                       'errors': row['recorded_errors']}
+            print('{:<24} {:>7} {:>16} {:>16} {:>9} {:>7}'.format(
+                endpoint, row['count'],
+                _change(row['p50'], old.get('p50')),
+                _change(row['p95'], old.get('p95')),
+                '{}{}'.format(row['errors'],
+                              '' if old.get('errors') is None else
+                              ' ({:+d})'.format(row['errors'] -
+                                                old['errors'])),
+                row['changed']))
+        print('Replayed {} requests in {:.3f}s ({:.0f}/sec); changes are '
+              'against the {}'.format(len(results), elapsed,
+                                      len(results) / max(elapsed, 1e-9),
+                                      against))
+
+        if save is not None:
+            with open(save, 'w') as save_file:
+                json.dump(summary, save_file, indent=2, sort_keys=True)
+
+
+manager.add_command('replay-traffic', ReplayTraffic())
+
+
+def _counts(value):
+    """Parse a comma-separated list of increasing positive counts."""
+    counts = [int(count) for count in value.split(',')]
+    if not counts or counts[0] < 1 or counts != sorted(counts):
+        raise ValueError(value)
+    return counts
+
+
+@manager.option('--world', type=int, default=None,
+                help='world ID for new games (default the first)')
+@manager.option('--think', type=float, default=2.0,
+                help='average seconds between a bot\'s actions')
+@manager.option('--table', type=int, default=4,
+                help='bots in each game')
+@manager.option('--stage', type=float, default=30.0,
+                help='seconds to run each stage')
+@manager.option('--ramp', type=_counts, default=[10, 50, 100],
+                help='comma-separated numbers of bots in each stage')
+@manager.option('url', metavar='URL')
+def loadtest(url, ramp, stage, table, think, world):
+    """Play many simulated players against a running server."""
+    try:
+        from . import loadtest as loadtests
+    except ImportError:
+        raise InvalidCommand('loadtest needs aiohttp; '
+                             'pip install crail[loadtest]')
+
+    def report(summary):
+        """Print one stage's results."""
+        print('{bots} bots at {tables} tables: {requests} requests in '
+              '{seconds:.1f}s ({throughput:.0f}/sec), p50 {p50:.1f}ms, '
+              'p95 {p95:.1f}ms, p99 {p99:.1f}ms, {errors} errors, '
+              '{busy} busy ({error_rate:.1%})'
+              .format(**dict(summary, **{key: summary[key] or 0.0
+                                         for key in ('p50', 'p95', 'p99')})))
+
+    loadtests.run(url, ramp, stage=stage, table_size=max(table, 1),
+                  think=think, world=world, report=report)
+
 
 def main():
     """Run the :program:`crail_manage` program."""
@@ -0,0 +1,95 @@
+"""Process-local instrumentation.
+
+.. Copyright © 2015, David Maze
+
+Counters, gauges, and histograms kept in memory in each worker
+process, and published as JSON by :func:`crail.routes.metrics`.  Names
+are dotted strings, like ``state.shared``.
+
+>>> from crail import metrics
+>>> metrics.increment('state.leader')
+>>> metrics.snapshot()['counters']['state.leader']
+1
+
+.. autofunction:: gauge
+.. autofunction:: increment
+.. autofunction:: observe
+.. autofunction:: reset
+.. autofunction:: snapshot
+
+"""
+import bisect
+import threading
+
+#: Upper bounds of histogram buckets; the last bucket is unbounded.
+BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+_lock = threading.Lock()  # pylint: disable=invalid-name
+_counters = {}  # pylint: disable=invalid-name
+_gauges = {}  # pylint: disable=invalid-name
+_histograms = {}  # pylint: disable=invalid-name
+
+
+def increment(name, amount=1):
+    """Add to a counter.
+
+    :param str name: name of the counter
+    :param int amount: amount to add
+
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def gauge(name, value):
+    """Set a gauge to its current value.
+
+    :param str name: name of the gauge
+    :param value: current value
+
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """Add a value to a histogram.
+
+    :param str name: name of the histogram
+    :param value: observed value, such as a size in bytes
+
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {
+                'count': 0, 'sum': 0, 'buckets': [0] * (len(BUCKETS) + 1)}
+        histogram['count'] += 1
+        histogram['sum'] += value
+        histogram['buckets'][bisect.bisect_left(BUCKETS, value)] += 1
+
+
+def snapshot():
+    """Get a copy of every metric.
+
+    :return: dictionary with `counters`, `gauges`, and `histograms`;
+      each histogram has `count`, `sum`, and `buckets`, a list of
+      counts for values up to each of :data:`BUCKETS` and beyond
+
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'histograms': {name: {'count': h['count'], 'sum': h['sum'],
+                                  'buckets': list(h['buckets'])}
+                           for name, h in _histograms.items()},
+        }
+
+
+def reset():
+    """Forget every metric."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -1,6 +1,6 @@
 from __future__ import with_statement
 from alembic import context
-from sqlalchemy import engine_from_config, pool
+from sqlalchemy import engine_from_config, event, pool
 from logging.config import fileConfig
 
 # this is the Alembic Config object, which provides
@@ -55,14 +55,37 @@ def run_migrations_online():
                                 prefix='sqlalchemy.',
                                 poolclass=pool.NullPool)
 
+    # crail_manage migrate --dry-run runs everything in one transaction
+    # and rolls it back; see crail.online
+    dry_run = context.get_x_argument(as_dictionary=True).get('dry_run')
+    if dry_run and engine.dialect.name == 'sqlite':
+        # pysqlite commits before schema changes and only begins a
+        # transaction before changing data, so turn that off and begin
+        # the transaction ourselves
+        @event.listens_for(engine, 'connect')
+        def connect(dbapi_connection, connection_record):
+            # pylint: disable=unused-argument,unused-variable
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, 'begin')
+        def begin(conn):
+            # pylint: disable=unused-variable
+            conn.execute('BEGIN')
+
     connection = engine.connect()
     context.configure(connection=connection,
                       target_metadata=target_metadata,
+                      transaction_per_migration=not dry_run,
                       **current_app.extensions['migrate'].configure_args)
 
     try:
-        with context.begin_transaction():
-            context.run_migrations()
+        if dry_run:
+            with connection.begin() as transaction:
+                context.run_migrations()
+                transaction.rollback()
+        else:
+            with context.begin_transaction():
+                context.run_migrations()
     finally:
         connection.close()
 
@@ -0,0 +1,59 @@
+"""Add the money ledger.
+
+Revision ID: 1f6c0b9a2d7e
+Revises: 4b18eb9c46c
+Create Date: 2026-10-19 10:15:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f6c0b9a2d7e'
+down_revision = '4b18eb9c46c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('money_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('game_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('contract_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['contract_id'], ['contract.id'], name=op.f('fk_money_entry_contract_id_contract')),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], name=op.f('fk_money_entry_game_id_game')),
+    sa.ForeignKeyConstraint(['player_id'], ['player.id'], name=op.f('fk_money_entry_player_id_player')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_money_entry'))
+    )
+    op.create_index('ix_money_entry_game_id_player_id_kind_amount', 'money_entry', ['game_id', 'player_id', 'kind', 'amount'], unique=False)
+    op.create_index('ix_money_entry_player_id_id_amount', 'money_entry', ['player_id', 'id', 'amount'], unique=False)
+    op.create_table('money_snapshot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('entry_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['player_id'], ['player.id'], name=op.f('fk_money_snapshot_player_id_player')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_money_snapshot'))
+    )
+    op.create_index('ix_money_snapshot_player_id_entry_id_balance', 'money_snapshot', ['player_id', 'entry_id', 'balance'], unique=False)
+
+    # Carry existing balances over as opening snapshots
+    op.execute('INSERT INTO money_snapshot (player_id, entry_id, balance) '
+               'SELECT id, 0, money FROM player WHERE money != 0')
+
+
+def downgrade():
+    # Fold the ledger back into the legacy balance column
+    op.execute('UPDATE player SET money = '
+               '(SELECT COALESCE(SUM(amount), 0) FROM money_entry '
+               ' WHERE money_entry.player_id = player.id) + '
+               'COALESCE((SELECT balance FROM money_snapshot '
+               ' WHERE money_snapshot.player_id = player.id '
+               '   AND money_snapshot.entry_id = 0), 0)')
+    op.drop_index('ix_money_snapshot_player_id_entry_id_balance', table_name='money_snapshot')
+    op.drop_table('money_snapshot')
+    op.drop_index('ix_money_entry_player_id_id_amount', table_name='money_entry')
+    op.drop_index('ix_money_entry_game_id_player_id_kind_amount', table_name='money_entry')
+    op.drop_table('money_entry')
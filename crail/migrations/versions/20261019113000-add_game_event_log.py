@@ -0,0 +1,44 @@
+"""Add the game event log.
+
+Revision ID: 3a92d4e0c5b1
+Revises: 1f6c0b9a2d7e
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a92d4e0c5b1'
+down_revision = '1f6c0b9a2d7e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('game_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=True),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], name=op.f('fk_game_event_game_id_game')),
+    sa.ForeignKeyConstraint(['player_id'], ['player.id'], name=op.f('fk_game_event_player_id_player')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_game_event')),
+    sa.UniqueConstraint('game_id', 'seq', name='uq_game_event_game_id_seq')
+    )
+    op.create_table('game_snapshot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('state', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], name=op.f('fk_game_snapshot_game_id_game')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_game_snapshot'))
+    )
+    op.create_index('ix_game_snapshot_game_id_seq', 'game_snapshot', ['game_id', 'seq'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_game_snapshot_game_id_seq', table_name='game_snapshot')
+    op.drop_table('game_snapshot')
+    op.drop_table('game_event')
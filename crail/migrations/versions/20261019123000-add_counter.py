@@ -0,0 +1,27 @@
+"""Add Counter.
+
+Revision ID: 52e8a1f7c9d4
+Revises: 3a92d4e0c5b1
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52e8a1f7c9d4'
+down_revision = '3a92d4e0c5b1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    counter = op.create_table('counter',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name', name=op.f('pk_counter'))
+    )
+    op.bulk_insert(counter, [{'name': 'lobby', 'value': 0}])
+
+
+def downgrade():
+    op.drop_table('counter')
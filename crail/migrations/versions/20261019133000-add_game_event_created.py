@@ -0,0 +1,23 @@
+"""Add GameEvent.created.
+
+Revision ID: 6d3b9e2f8a15
+Revises: 52e8a1f7c9d4
+Create Date: 2026-10-19 13:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6d3b9e2f8a15'
+down_revision = '52e8a1f7c9d4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('game_event', sa.Column('created', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('game_event') as batch_op:
+        batch_op.drop_column('created')
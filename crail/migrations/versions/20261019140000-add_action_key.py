@@ -0,0 +1,28 @@
+"""Add ActionKey.
+
+Revision ID: 7a4c2e9d1b36
+Revises: 6d3b9e2f8a15
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a4c2e9d1b36'
+down_revision = '6d3b9e2f8a15'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('action_key',
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['player_id'], ['player.id'], name=op.f('fk_action_key_player_id_player')),
+    sa.PrimaryKeyConstraint('player_id', 'key', name=op.f('pk_action_key'))
+    )
+
+
+def downgrade():
+    op.drop_table('action_key')
@@ -0,0 +1,25 @@
+"""Add World.hand_size and World.hand_counts_events.
+
+Revision ID: 8e2f6a4c9d17
+Revises: 7a4c2e9d1b36
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8e2f6a4c9d17'
+down_revision = '7a4c2e9d1b36'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('world', sa.Column('hand_size', sa.Integer(), nullable=True))
+    op.add_column('world', sa.Column('hand_counts_events', sa.Boolean(name='hand_counts_events'), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('world') as batch_op:
+        batch_op.drop_column('hand_counts_events')
+        batch_op.drop_column('hand_size')
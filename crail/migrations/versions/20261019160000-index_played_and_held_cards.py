@@ -0,0 +1,54 @@
+"""Index played_card.game_id and player_card.player_id.
+
+Both tables grow with every draw, so on SQLite the indexes are built by
+copying each table a batch at a time (see crail.online).
+
+Revision ID: 5d3b9e7a2c41
+Revises: 8e2f6a4c9d17
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d3b9e7a2c41'
+down_revision = '8e2f6a4c9d17'
+
+from alembic import op
+import sqlalchemy as sa
+
+from crail import online
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        op.create_index('ix_played_card_game_id', 'played_card', ['game_id'], unique=False)
+        op.create_index('ix_player_card_player_id', 'player_card', ['player_id'], unique=False)
+        return
+
+    metadata = sa.MetaData()
+    sa.Table('card', metadata, sa.Column('id', sa.Integer(), primary_key=True))
+    sa.Table('game', metadata, sa.Column('id', sa.Integer(), primary_key=True))
+    sa.Table('player', metadata, sa.Column('id', sa.Integer(), primary_key=True))
+    online.rebuild(sa.Table(
+        'played_card', metadata,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('game_id', sa.Integer(), nullable=False),
+        sa.Column('card_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['card_id'], ['card.id'], name='fk_played_card_card_id_card'),
+        sa.ForeignKeyConstraint(['game_id'], ['game.id'], name='fk_played_card_game_id_game'),
+        sa.PrimaryKeyConstraint('id', name='pk_played_card'),
+        sa.Index('ix_played_card_game_id', 'game_id'),
+    ))
+    online.rebuild(sa.Table(
+        'player_card', metadata,
+        sa.Column('player_id', sa.Integer(), nullable=False),
+        sa.Column('card_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['card_id'], ['card.id'], name='fk_player_card_card_id_card'),
+        sa.ForeignKeyConstraint(['player_id'], ['player.id'], name='fk_player_card_player_id_player'),
+        sa.Index('ix_player_card_player_id', 'player_id'),
+    ))
+
+
+def downgrade():
+    op.drop_index('ix_player_card_player_id', table_name='player_card')
+    op.drop_index('ix_played_card_game_id', table_name='played_card')
@@ -0,0 +1,29 @@
+"""Add GameSequence.
+
+Revision ID: 7c4d2e9f1a36
+Revises: 5d3b9e7a2c41
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c4d2e9f1a36'
+down_revision = '5d3b9e7a2c41'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('game_sequence',
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], name=op.f('fk_game_sequence_game_id_game')),
+    sa.PrimaryKeyConstraint('game_id', name=op.f('pk_game_sequence'))
+    )
+    op.execute('INSERT INTO game_sequence (game_id, seq) '
+               'SELECT game_id, MAX(seq) FROM game_event GROUP BY game_id')
+
+
+def downgrade():
+    op.drop_table('game_sequence')
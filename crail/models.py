@@ -8,13 +8,12 @@ and written to the underlying database.
 
 >>> from crail.models import db, Player
 >>> player = Player.query.get(id=1)
->>> player.money
-10
->>> player.money = 20
+>>> player.name
+'me'
+>>> player.name = 'you'
 >>> db.session.commit()
 
 .. autodata:: db
-.. autodata:: migrate
 .. autoclass:: Good
    :members:
 .. autoclass:: City
@@ -29,15 +28,30 @@ and written to the underlying database.
    :members:
 .. autoclass:: PlayedCard
    :members:
+.. autoclass:: MoneyEntry
+   :members:
+.. autoclass:: MoneySnapshot
+   :members:
+.. autoclass:: GameEvent
+   :members:
+.. autoclass:: GameSequence
+   :members:
+.. autoclass:: GameSnapshot
+   :members:
 .. autoclass:: Game
    :members:
+.. autoclass:: Counter
+   :members:
+.. autoclass:: ActionKey
+   :members:
 
 """
-from flask.ext.migrate import Migrate
-from flask.ext.sqlalchemy import SQLAlchemy
+import datetime
+
+from .routing import RoutingSQLAlchemy
 
 #: The Flask-SQLAlchemy bridge object.
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 # Get better autogenerated names for things
 db.metadata.naming_convention = {
@@ -48,9 +62,6 @@ db.metadata.naming_convention = {
     "pk": "pk_%(table_name)s"
 }
 
-#: The Flask-Migrate Alembic wrapper.
-migrate = Migrate(db=db)
-
 
 class Good(db.Model):
     """A single good.
@@ -167,7 +178,8 @@ class Contract(db.Model):
 #: Many-to-many table binding :class:`Card` to :class:`Contract`.
 card_contract = db.Table(
     'card_contract', db.metadata,
-    db.Column('card_id', db.Integer, db.ForeignKey('card.id'), nullable=False),
+    db.Column('card_id', db.Integer, db.ForeignKey('card.id'),
+              nullable=False),
     db.Column('contract_id', db.Integer, db.ForeignKey('contract.id'),
               nullable=False)
 )
@@ -252,6 +264,16 @@ class World(db.Model):
     #: The name of the world; what is printed on the box.
     name = db.Column(db.String(64), unique=True)
 
+    #: Number of cards in a full hand, or :const:`None` if this world
+    #: has no hand-size rule (see :func:`crail.actions.fill_hand`).
+    hand_size = db.Column(db.Integer)
+
+    #: Whether event cards count towards :attr:`hand_size`, or only
+    #: contract cards do.
+    hand_counts_events = db.Column(db.Boolean(name='hand_counts_events'),
+                                   nullable=False, default=False,
+                                   server_default=db.false())
+
     def __str__(self):
         return self.name
 
@@ -264,7 +286,10 @@ player_card = db.Table(
     'player_card', db.metadata,
     db.Column('player_id', db.Integer, db.ForeignKey('player.id'),
               nullable=False),
-    db.Column('card_id', db.Integer, db.ForeignKey('card.id'), nullable=False)
+    db.Column('card_id', db.Integer, db.ForeignKey('card.id'),
+              nullable=False),
+    # Covers reading a hand
+    db.Index('ix_player_card_player_id', 'player_id'),
 )
 
 
@@ -285,7 +310,9 @@ class Player(db.Model):
     #: Name of the player; what they typed as their login name.
     name = db.Column(db.Text, nullable=False)
 
-    #: Amount of money this player holds.
+    #: Legacy balance column.  The amount of money a player holds now
+    #: lives in the :class:`MoneyEntry` ledger (see :mod:`crail.ledger`)
+    #: and this column is no longer updated.
     money = db.Column(db.Integer, nullable=False)
 
     #: List of :class:`Card` this player holds.
@@ -308,6 +335,11 @@ class Player(db.Model):
 
 class PlayedCard(db.Model):
     """Record that a card has been played in a game."""
+    __table_args__ = (
+        # Covers finding a game's discard pile
+        db.Index('ix_played_card_game_id', 'game_id'),
+    )
+
     #: Integer identifier of the record.
     id = db.Column(db.Integer, db.Sequence('played_card_seq'),
                    primary_key=True)
@@ -329,6 +361,166 @@ class PlayedCard(db.Model):
                 .format(self))
 
 
+class MoneyEntry(db.Model):
+    """One movement of money in the ledger.
+
+    Entries are only ever inserted, never updated, so recording money
+    does not contend on a shared row.  A player's balance is the sum of
+    their entries; :class:`MoneySnapshot` keeps that sum cheap.  Use
+    :mod:`crail.ledger` rather than creating these directly.
+
+    """
+    __table_args__ = (
+        # Covers the balance tail sum
+        db.Index('ix_money_entry_player_id_id_amount',
+                 'player_id', 'id', 'amount'),
+        # Covers per-game and per-player-in-game aggregates
+        db.Index('ix_money_entry_game_id_player_id_kind_amount',
+                 'game_id', 'player_id', 'kind', 'amount'),
+    )
+
+    #: Integer identifier of the entry; increases over time.
+    id = db.Column(db.Integer, db.Sequence('money_entry_id_seq'),
+                   primary_key=True)
+
+    #: Integer identifier of the :class:`Player` whose money moved.
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'),
+                          nullable=False)
+
+    #: Integer identifier of the :class:`Game` the player was in, if any.
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
+
+    #: Kind of movement: ``gain``, ``spend``, ``contract``, or ``adjust``.
+    kind = db.Column(db.String(16), nullable=False)
+
+    #: Signed amount; spending is negative.
+    amount = db.Column(db.Integer, nullable=False)
+
+    #: Integer identifier of the :class:`Contract` paid out, if any.
+    contract_id = db.Column(db.Integer, db.ForeignKey('contract.id'))
+
+    def __repr__(self):
+        return ('MoneyEntry(id={0.id!r}, player_id={0.player_id!r}, '
+                'game_id={0.game_id!r}, kind={0.kind!r}, '
+                'amount={0.amount!r}, contract_id={0.contract_id!r})'
+                .format(self))
+
+
+class MoneySnapshot(db.Model):
+    """A player's balance as of some :class:`MoneyEntry`.
+
+    The balance is the latest snapshot plus the sum of entries after it.
+
+    """
+    __table_args__ = (
+        db.Index('ix_money_snapshot_player_id_entry_id_balance',
+                 'player_id', 'entry_id', 'balance'),
+    )
+
+    #: Integer identifier of the snapshot.
+    id = db.Column(db.Integer, db.Sequence('money_snapshot_id_seq'),
+                   primary_key=True)
+
+    #: Integer identifier of the :class:`Player`.
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'),
+                          nullable=False)
+
+    #: Identifier of the last :class:`MoneyEntry` included, or 0.
+    entry_id = db.Column(db.Integer, nullable=False)
+
+    #: Balance including every entry up to :attr:`entry_id`.
+    balance = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return ('MoneySnapshot(id={0.id!r}, player_id={0.player_id!r}, '
+                'entry_id={0.entry_id!r}, balance={0.balance!r})'
+                .format(self))
+
+
+class GameEvent(db.Model):
+    """One mutation recorded in a game's log.
+
+    Events are only ever appended.  Use :mod:`crail.events` rather than
+    creating these directly.
+
+    """
+    __table_args__ = (
+        db.UniqueConstraint('game_id', 'seq',
+                            name='uq_game_event_game_id_seq'),
+    )
+
+    #: Integer identifier of the event.
+    id = db.Column(db.Integer, db.Sequence('game_event_id_seq'),
+                   primary_key=True)
+
+    #: Integer identifier of the :class:`Game`.
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False)
+
+    #: Position of the event in its game's log, starting from 1.
+    seq = db.Column(db.Integer, nullable=False)
+
+    #: Kind of event, such as ``draw`` or ``complete``.
+    kind = db.Column(db.String(16), nullable=False)
+
+    #: Integer identifier of the acting :class:`Player`, if any.
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'))
+
+    #: Compact JSON object with the event details.
+    data = db.Column(db.Text, nullable=False)
+
+    #: UTC time the event was recorded.  This is :const:`None` for events
+    #: recorded before timestamps were kept.
+    created = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return ('GameEvent(id={0.id!r}, game_id={0.game_id!r}, '
+                'seq={0.seq!r}, kind={0.kind!r}, '
+                'player_id={0.player_id!r}, data={0.data!r})'.format(self))
+
+
+class GameSequence(db.Model):
+    """The last :attr:`GameEvent.seq` used in a game's log.
+
+    :func:`crail.events.record` increments this to number each event,
+    so concurrent writers to one game take turns on the row.
+
+    """
+    #: Integer identifier of the :class:`Game`.
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'),
+                        primary_key=True)
+
+    #: Sequence number of the last event recorded.
+    seq = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return ('GameSequence(game_id={0.game_id!r}, seq={0.seq!r})'
+                .format(self))
+
+
+class GameSnapshot(db.Model):
+    """A game's state as of some :class:`GameEvent`."""
+    __table_args__ = (
+        db.Index('ix_game_snapshot_game_id_seq', 'game_id', 'seq'),
+    )
+
+    #: Integer identifier of the snapshot.
+    id = db.Column(db.Integer, db.Sequence('game_snapshot_id_seq'),
+                   primary_key=True)
+
+    #: Integer identifier of the :class:`Game`.
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False)
+
+    #: :attr:`GameEvent.seq` of the last event included.
+    seq = db.Column(db.Integer, nullable=False)
+
+    #: Compact JSON object with the game state.
+    state = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return ('GameSnapshot(id={0.id!r}, game_id={0.game_id!r}, '
+                'seq={0.seq!r})'.format(self))
+
+
 class Game(db.Model):
     """A running game session.
 
@@ -356,3 +548,43 @@ class Game(db.Model):
 
     def __repr__(self):
         return 'Game(id={0.id!r}, world={0.world!r})'.format(self)
+
+
+class Counter(db.Model):
+    """A named integer that only goes up.
+
+    :mod:`crail.versions` uses these to version shared state.
+
+    """
+    #: Name of the counter.
+    name = db.Column(db.String(32), primary_key=True)
+
+    #: Current value.
+    value = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return 'Counter(name={0.name!r}, value={0.value!r})'.format(self)
+
+
+class ActionKey(db.Model):
+    """A mutating request that has already been applied.
+
+    Clients send a unique ``Idempotency-Key`` header with each action so
+    that retrying it after a lost response does not apply it twice; see
+    :mod:`crail.idempotency`.
+
+    """
+    #: Integer identifier of the :class:`Player` who sent the request.
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'),
+                          primary_key=True)
+
+    #: Client-chosen key.
+    key = db.Column(db.String(64), primary_key=True)
+
+    #: UTC time the request was applied.
+    created = db.Column(db.DateTime, nullable=False,
+                        default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return ('ActionKey(player_id={0.player_id!r}, key={0.key!r}, '
+                'created={0.created!r})'.format(self))
@@ -0,0 +1,360 @@
+"""Schema changes while games are running.
+
+.. Copyright © 2015, David Maze
+
+A migration normally runs as one transaction.  On SQLite that holds the
+database's write lock from start to finish, so copying or updating
+every row of a big table like ``played_card`` stops every game until
+it is done.  The helpers here, called from a migration's
+``upgrade()``, do that work in batches of
+:data:`crail.settings.CRAIL_ONLINE_BATCH` rows instead.  Each batch is
+its own short transaction, and they pause
+:data:`crail.settings.CRAIL_ONLINE_PAUSE` seconds between batches so
+requests get the lock in between:
+
+.. code-block:: python
+
+   from crail import online
+
+   def upgrade():
+       op.add_column('player', sa.Column('nickname', sa.String(32)))
+       online.backfill('player', {'nickname': sa.text('name')},
+                       where=sa.text('nickname IS NULL'))
+
+:func:`backfill` updates existing rows a batch at a time, and
+:func:`rebuild` copies a table into a new definition a batch at a time,
+for changes SQLite cannot make in place, like adding an index to a big
+table.  Both log their progress and record it in an
+``online_progress`` table after every batch, which is dropped again
+once they finish.  If a migration is
+interrupted, running it again picks up where it left off.  Migrations
+that use them must be safe to run again from the start, because the
+schema changes before the first helper call are not rolled back.
+
+Run such migrations with ``crail_manage migrate``, which takes the
+batch size and pause as options.  With ``--dry-run`` it runs all
+pending migrations in one transaction and rolls it back.  Each helper
+times a single batch, and the command reports how long the full run
+would take.  Other schema changes in the migrations run for real in
+the dry run, so try it on a copy of the database if they are slow.
+
+.. autofunction:: backfill
+.. autofunction:: rebuild
+.. autofunction:: dry_run
+.. autofunction:: estimated
+
+"""
+import contextlib
+import logging
+import time
+
+import sqlalchemy as sa
+from alembic import context, op
+from flask import current_app
+
+#: Name of the table recording how far each helper has got.
+PROGRESS_TABLE = 'online_progress'
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_progress = sa.table(PROGRESS_TABLE, sa.column('name'),
+                     sa.column('position'))
+
+_estimates = []  # pylint: disable=invalid-name
+
+
+def _options():
+    """Get the ``-x`` options passed to Alembic."""
+    return context.get_x_argument(as_dictionary=True)
+
+
+def dry_run():
+    """Decide whether this is a ``--dry-run`` migration.
+
+    :return: whether helpers should only estimate their time
+
+    """
+    return bool(_options().get('dry_run'))
+
+
+def estimated():
+    """Get the total estimated seconds for the helpers in a dry run.
+
+    :return: sum of every estimate logged in this process
+
+    """
+    return sum(_estimates)
+
+
+def _batch():
+    """Get the batch size and pause."""
+    options = _options()
+    return (max(1, int(options.get('batch') or
+                       current_app.config['CRAIL_ONLINE_BATCH'])),
+            float(options.get('pause') or
+                  current_app.config['CRAIL_ONLINE_PAUSE']))
+
+
+@contextlib.contextmanager
+def _batches():
+    """Leave the migration's transaction, unless this is a dry run."""
+    if dry_run():
+        yield op.get_bind()
+    else:
+        with context.get_context().autocommit_block():
+            yield op.get_bind()
+
+
+@contextlib.contextmanager
+def _atomic(connection):
+    """Run one batch as its own transaction."""
+    with connection.begin():
+        if connection.dialect.name == 'sqlite' and not dry_run():
+            # pysqlite in autocommit mode would otherwise not begin
+            connection.execute('BEGIN IMMEDIATE')
+        yield
+
+
+def _in_transaction(connection):
+    """Check that the database, not just SQLAlchemy, is in a transaction."""
+    if not connection.in_transaction():
+        return False
+    if connection.dialect.name == 'sqlite':
+        return connection.connection.in_transaction
+    return True
+
+
+def _quote(connection, name):
+    """Quote an identifier for the connection's dialect."""
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def _position(connection, name):
+    """Get a helper's saved position, creating the progress table."""
+    if not connection.dialect.has_table(connection, PROGRESS_TABLE):
+        connection.execute(
+            'CREATE TABLE {} (name VARCHAR(128) PRIMARY KEY, '
+            'position INTEGER NOT NULL)'.format(PROGRESS_TABLE))
+    return connection.execute(
+        sa.select([_progress.c.position])
+        .where(_progress.c.name == name)).scalar()
+
+
+def _save(connection, name, position):
+    """Record a helper's position, or forget it if `position` is None.
+
+    The progress table is dropped once nothing is in progress, so it
+    does not outlive the migration.
+
+    """
+    connection.execute(_progress.delete().where(_progress.c.name == name))
+    if position is not None:
+        connection.execute(_progress.insert().values(name=name,
+                                                     position=position))
+    elif not connection.execute(
+            sa.select([sa.func.count()]).select_from(_progress)).scalar():
+        connection.execute('DROP TABLE {}'.format(PROGRESS_TABLE))
+
+
+def _duration(seconds):
+    """Format a number of seconds for people."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}h{:02d}m{:02d}s'.format(hours, minutes, seconds)
+    return '{}m{:02d}s'.format(minutes, seconds)
+
+
+def _run(connection, name, key, statement, setup=None, finish=None):
+    """Run a statement over successive key ranges.
+
+    `statement` is a function of a low and high key that runs one batch.
+    In a dry run only the first batch runs, and its time is the
+    estimate.
+
+    :raise RuntimeError: in a dry run that is not inside a transaction,
+      since nothing it did would be rolled back
+
+    """
+    if dry_run() and not _in_transaction(connection):
+        raise RuntimeError('{}: dry run is not inside a transaction'
+                           .format(name))
+    size, pause = _batch()
+    with _atomic(connection):
+        low, high = connection.execute(
+            'SELECT MIN({0}), MAX({0}) FROM {1}'.format(*key)).first()
+        saved = _position(connection, name)
+        if setup is not None:
+            setup()
+    if low is None:
+        low = high = 0
+    position = low - 1 if saved is None else saved
+    batches = max(0, -(-(high - position) // size))
+    logger.info('%s: %d batches of %d from %d to %d%s', name, batches,
+                size, position + 1, high,
+                '' if saved is None else ' (resuming)')
+
+    done = 0
+    start = time.perf_counter()
+    while position < high:
+        with _atomic(connection):
+            statement(position, position + size)
+            if not dry_run():
+                _save(connection, name, position + size)
+        position += size
+        done += 1
+        elapsed = time.perf_counter() - start
+        if dry_run():
+            estimate = (elapsed + pause) * batches + (
+                0 if finish is None else elapsed)
+            _estimates.append(estimate)
+            logger.info('%s: about %s (one batch took %.3fs)', name,
+                        _duration(estimate), elapsed)
+            return
+        if done % 100 == 0 or position >= high:
+            logger.info('%s: %d/%d batches, %s left', name, done, batches,
+                        _duration(elapsed / done * (batches - done)))
+        time.sleep(pause)
+
+    with _atomic(connection):
+        if finish is not None:
+            finish()
+        _save(connection, name, None)
+    logger.info('%s: done in %s', name,
+                _duration(time.perf_counter() - start))
+
+
+def backfill(table, values, where=None, key='id', name=None):
+    """Update every row of a table, a batch at a time.
+
+    Batches are ranges of `key`, so a table with sparse keys may have
+    batches with fewer rows than the batch size.
+
+    :param str table: name of the table
+    :param dict values: map of column name to new value or SQL
+      expression, as for :meth:`~sqlalchemy.sql.expression.update.values`
+    :param where: SQL expression limiting the rows to update
+    :param str key: integer column to batch on; on SQLite ``'rowid'``
+      works for any table
+    :param str name: progress name, if one table is backfilled more
+      than once in the same migration
+
+    """
+    name = name or 'backfill:{}:{}'.format(table, ','.join(sorted(values)))
+    target = sa.table(table, sa.column(key),
+                      *[sa.column(column) for column in values])
+
+    def update(low, high):
+        """Update one batch."""
+        statement = (target.update()
+                     .where(target.c[key] > low)
+                     .where(target.c[key] <= high)
+                     .values(values))
+        if where is not None:
+            statement = statement.where(where)
+        connection.execute(statement)
+
+    with _batches() as connection:
+        _run(connection, name,
+             (_quote(connection, key), _quote(connection, table)), update)
+
+
+def rebuild(table, copy=None, name=None):
+    """Rebuild a SQLite table to a new definition, a batch at a time.
+
+    This is :meth:`alembic.operations.Operations.batch_alter_table` for
+    a table that is too big to copy in one transaction.  The new
+    definition, with all of its indexes, is created under a temporary
+    name.  Triggers on the old table keep the copy current while rows
+    are copied over a batch at a time.  A final short transaction drops
+    the old table and renames the new one into place.  Rows keep their
+    ``rowid``.
+
+    New indexes are built a batch at a time along with the copy.
+    Index names are global in SQLite, so an index the old table already
+    has is built only in that final transaction, which then takes as
+    long as building it would.
+
+    :param table: new definition of the table, as a
+      :class:`sqlalchemy.schema.Table` with the same name in its own
+      :class:`~sqlalchemy.schema.MetaData`, along with any tables its
+      foreign keys refer to
+    :param dict copy: map of new column name to SQL text computing it
+      from the old columns; other columns are copied by name, and new
+      columns not listed get their defaults
+    :param str name: progress name
+    :raise ValueError: if the database is not SQLite
+
+    """
+    name = name or 'rebuild:{}'.format(table.name)
+    copy = dict(copy or {})
+    with _batches() as connection:
+        if connection.dialect.name != 'sqlite':
+            raise ValueError('online.rebuild only supports SQLite; '
+                             'use op.batch_alter_table instead')
+        inspector = sa.inspect(connection)
+        old_columns = {column['name']
+                       for column in inspector.get_columns(table.name)}
+        existing = {index['name'] for index in inspector.get_indexes(
+            table.name)}
+
+        def quote(identifier):
+            """Quote an identifier."""
+            return _quote(connection, identifier)
+
+        staging = '_online_{}'.format(table.name)
+        shadow = table.tometadata(table.metadata, name=staging)
+        late = [index for index in table.indexes if index.name in existing]
+        for index in list(shadow.indexes):
+            if index.name in existing:
+                shadow.indexes.discard(index)
+        for column in table.columns:
+            if column.name not in copy and column.name in old_columns:
+                copy[column.name] = quote(column.name)
+        primary = list(table.primary_key.columns)
+        aliased = (len(primary) == 1 and
+                   isinstance(primary[0].type, sa.Integer))
+        columns = ([] if aliased else ['rowid']) + list(copy)
+        select = 'SELECT {} FROM {}'.format(
+            ', '.join(([] if aliased else ['rowid']) +
+                      [copy[column] for column in copy]),
+            quote(table.name))
+        insert = 'INSERT OR REPLACE INTO {} ({}) '.format(
+            quote(staging), ', '.join(quote(column) for column in columns))
+
+        def setup():
+            """Create the copy and the triggers that keep it current."""
+            shadow.create(connection, checkfirst=True)
+            for event, action in (
+                    ('INSERT', '{0}{1} WHERE rowid = NEW.rowid'),
+                    ('UPDATE', 'DELETE FROM {2} WHERE rowid = OLD.rowid; '
+                               '{0}{1} WHERE rowid = NEW.rowid'),
+                    ('DELETE', 'DELETE FROM {2} WHERE rowid = OLD.rowid')):
+                connection.execute(
+                    'CREATE TRIGGER IF NOT EXISTS {} AFTER {} ON {} '
+                    'BEGIN {}; END'.format(
+                        quote('{}_{}'.format(staging, event.lower())),
+                        event, quote(table.name),
+                        action.format(insert, select, quote(staging))))
+
+        def batch(low, high):
+            """Copy one batch."""
+            connection.execute(sa.text(
+                insert + select + ' WHERE rowid > :low AND rowid <= :high'),
+                low=low, high=high)
+
+        def finish():
+            """Swap the copy into place."""
+            for event in ('insert', 'update', 'delete'):
+                connection.execute('DROP TRIGGER {}'.format(
+                    quote('{}_{}'.format(staging, event))))
+            connection.execute('DROP TABLE {}'.format(quote(table.name)))
+            connection.execute('ALTER TABLE {} RENAME TO {}'.format(
+                quote(staging), quote(table.name)))
+            for index in late:
+                logger.info('%s: building existing index %s', name,
+                            index.name)
+                index.create(connection)
+
+        _run(connection, name, ('rowid', quote(table.name)), batch,
+             setup=setup, finish=finish)
@@ -7,33 +7,42 @@ for instance, a database object is in scope, actually setting that up is
 done in :func:`crail.app.make_app`.
 
 .. autodata:: crail_bp
-.. autodata:: crail_js
-.. autodata:: crail_css
+.. autodata:: VERSION_HEADER
+.. autodata:: state_flight
+.. autodata:: lobby_flight
 
 """
-from .actions import draw_card, get_or_create_player
+import hashlib
+import json
+
+from . import actions, catalog, engine, events, ledger, lobby, \
+    statements, table as tables, versions
+from .actions import complete_contract, discard_card, draw_card, \
+    get_or_create_player, hand, hand_ids
+from .assets import asset_urls
+from .events import dumps
 from .globals import current_player
-from .models import Card, Contract, db, Game, World
-from flask import abort, Blueprint, current_app, jsonify, render_template, \
-    request, session
-from flask.ext.assets import Bundle
+from .idempotency import idempotent
+from .metrics import snapshot as metrics_snapshot
+from .models import db, Card, Contract, Game, Player, World
+from .routing import read_only
+from .singleflight import SingleFlight
+from flask import abort, Blueprint, current_app, render_template, \
+    request, session, url_for
+from sqlalchemy.orm import joinedload
 
 
 #: Flask blueprint for crayon-rails handlers.
 crail_bp = Blueprint('crail', __name__)
 
-#: Flask-Assets bundle for :data:`crail_bp` JavaScript.
-crail_js = Bundle('bower_components/jquery/dist/jquery.js',
-                  'bower_components/bootstrap/dist/js/bootstrap.js',
-                  'bower_components/underscore/underscore.js',
-                  'bower_components/js-cookie/src/js.cookie.js',
-                  'crail.js',
-                  filters='rjsmin', output='gen/packed.js')
+#: Response header with the game version of :func:`player_state`.
+VERSION_HEADER = 'X-Crail-Version'
 
-#: Flask-Assets bundle for :data:`crail_bp` CSS.
-crail_css = Bundle('bower_components/bootstrap/dist/css/bootstrap.css',
-                   'bower_components/bootstrap/dist/css/bootstrap-theme.css',
-                   filters='cssmin', output='gen/packed.css')
+#: Coalesces concurrent identical in-game state reads.
+state_flight = SingleFlight('state')  # pylint: disable=invalid-name
+
+#: Coalesces concurrent lobby listings.
+lobby_flight = SingleFlight('lobby')  # pylint: disable=invalid-name
 
 
 @crail_bp.route('/')
@@ -42,6 +51,27 @@ def index():
     return render_template('index.html')
 
 
+@crail_bp.route('/sw.js')
+def service_worker():
+    """Return the service worker script.
+
+    This lets the page load from cache without a network connection.  It
+    is served from here rather than as a static file so that its scope
+    covers the whole application, and it names the current asset bundles
+    so that deploying new ones replaces the cached copies.
+
+    """
+    shell = [url_for('crail.index')]
+    for bundle in ('crail_css', 'crail_js'):
+        shell.extend(asset_urls(bundle))
+    version = hashlib.sha1(json.dumps(shell).encode('utf-8')).hexdigest()
+    response = current_app.response_class(
+        render_template('sw.js', shell=shell, version=version[:12]),
+        mimetype='application/javascript')
+    response.cache_control.no_cache = True
+    return response
+
+
 def player_state():
     """Get the current state as a JSON Flask response.
 
@@ -71,58 +101,314 @@ def player_state():
       `contracts`.  Each contract in turn has `id`, `good`, `city`, and
       `amount`.
 
-    """
-    response = {'player_id': None}
+    Concurrent identical requests share the work: in-game state is
+    coalesced per player and game version (see :mod:`crail.singleflight`),
+    and the lobby listing is shared between requests until the lobby
+    version changes (see :mod:`crail.lobby`).
+
+    In-game responses carry a :data:`VERSION_HEADER` of the form
+    ``GAME_ID:SEQ``, where `SEQ` is the number of the game's latest
+    :mod:`crail.events` entry, so clients can tell which of two states
+    is newer.
 
+    """
     # (Remember current_player will always be a proxy and will never be
     # None, but it could be a proxy to None)
-    if not current_player:
-        return jsonify(response)
-
-    response['player_id'] = current_player.id
-    response['player_name'] = current_player.name
-
-    if not current_player.game:
-        response['games'] = [{
-            'id': game.id,
-            'world': game.world.name,
-            'players': [player.name for player in game.players],
-        } for game in Game.query.order_by('id')]
-        response['worlds'] = [{
-            'id': world.id,
-            'name': world.name,
-        } for world in World.query.order_by('id')]
-        return jsonify(response)
-
-    response['game'] = current_player.game.world.name
-    response['money'] = current_player.money
-
-    def card_to_dict(card):
-        """Translate a card to a JSON dictionary."""
-        jcard = {'id': card.id}
-        if card.number:
-            jcard['number'] = card.number
-        if card.event:
-            jcard['event'] = card.event
-        if card.contracts:
-            jcard['contracts'] = [{'id': contract.id,
-                                   'good': contract.good.name,
-                                   'city': contract.city.name,
-                                   'amount': contract.amount}
-                                  for contract in card.contracts]
-        return jcard
-
-    response['cards'] = [card_to_dict(card) for card in current_player.cards]
-
-    return jsonify(response)
+    player = current_player._get_current_object()
+    if not player:
+        return json_response(dumps({'player_id': None}))
+
+    if player.game_id is None:
+        games, worlds = lobby.listing(
+            lambda version: lobby_flight.do(version, lobby_json))
+        return json_response(
+            '{{"games":{},"player_id":{},"player_name":{},'
+            '"worlds":{}}}'.format(games, dumps(player.id),
+                                   dumps(player.name), worlds))
+
+    return game_response(player)
+
+
+def game_response(player, **extra):
+    """Build the in-game :func:`player_state` response.
+
+    Any keyword arguments are added to the JSON object.  If the
+    :mod:`crail.engine` is running, the player's money and cards come
+    from the game's actor rather than the database.
+
+    """
+    owner = engine.get(current_app._get_current_object())
+    if owner is not None:
+        version, money, card_ids = owner.do(player.game_id, 'view', player.id)
+        cards = card_dicts(player.game.world_id, card_ids)
+        body = dumps(dict(extra,
+                          player_id=player.id,
+                          player_name=player.name,
+                          game=player.game.world.name,
+                          money=money,
+                          cards=[cards[card_id] for card_id in card_ids]))
+    else:
+        version = versions.game_version(player.game_id)
+        if extra:
+            body = game_json(player, **extra)
+        else:
+            body = state_flight.do((player.id, player.game_id, version),
+                                   lambda: game_json(player))
+    response = json_response(body)
+    response.headers[VERSION_HEADER] = '{}:{}'.format(player.game_id, version)
+    return response
+
+
+def play(player, kind, action, **data):
+    """Run an in-game action.
+
+    If the :mod:`crail.engine` is running and `player` is in a game, the
+    game's actor runs it; otherwise `action`, a function of no
+    arguments calling :mod:`crail.actions`, does.
+
+    :return: what the action returned
+
+    """
+    owner = engine.get(current_app._get_current_object())
+    if owner is None or player.game_id is None:
+        return action()
+    return owner.do(player.game_id, kind, player.id, **data)
+
+
+def release(*game_ids):
+    """Have the :mod:`crail.engine`, if running, write out some games."""
+    owner = engine.get(current_app._get_current_object())
+    if owner is not None:
+        owner.release(*game_ids)
+
+
+def json_response(body):
+    """Wrap serialized JSON in a Flask response."""
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def lobby_json():
+    """Serialize the lobby listing.
+
+    This is the `games` and `worlds` parts of :func:`player_state`,
+    built in three queries regardless of the number of games.
+
+    :return: pair of JSON texts for the games and worlds lists
+
+    """
+    names = {}
+    for game_id, name in (db.session.query(Player.game_id, Player.name)
+                          .filter(Player.game_id.isnot(None))
+                          .order_by(Player.id)):
+        names.setdefault(game_id, []).append(name)
+    games = [{
+        'id': game_id,
+        'world': world_name,
+        'players': names.get(game_id, []),
+    } for game_id, world_name in (db.session.query(Game.id, World.name)
+                                  .join(World, Game.world_id == World.id)
+                                  .order_by(Game.id))]
+    worlds = [{
+        'id': world_id,
+        'name': name,
+    } for world_id, name in (db.session.query(World.id, World.name)
+                             .order_by(World.id))]
+    return dumps(games), dumps(worlds)
+
+
+def card_to_dict(card):
+    """Translate a card to a JSON dictionary."""
+    jcard = {'id': card.id}
+    if card.number:
+        jcard['number'] = card.number
+    if card.event:
+        jcard['event'] = card.event
+    if card.contracts:
+        jcard['contracts'] = [{'id': contract.id,
+                               'good': contract.good.name,
+                               'city': contract.city.name,
+                               'amount': contract.amount}
+                              for contract in card.contracts]
+    return jcard
+
+
+def card_dicts(world_id, card_ids):
+    """Translate many cards in one world to JSON dictionaries.
+
+    The cards come from the world's compiled :mod:`crail.catalog` if it
+    has them all, and otherwise from one database query.
+
+    :return: dictionary mapping card ID to JSON dictionary
+
+    """
+    card_ids = set(card_ids)
+    cards = catalog.get(current_app, world_id)
+    if cards is not None:
+        jcards = {card_id: cards.card(card_id) for card_id in card_ids}
+        if None not in jcards.values():
+            return jcards
+    if not card_ids:
+        return {}
+    return {card.id: card_to_dict(card) for card in (
+        Card.query
+        .options(joinedload(Card.contracts).joinedload(Contract.good),
+                 joinedload(Card.contracts).joinedload(Contract.city))
+        .filter(Card.id.in_(card_ids)))}
+
+
+def hand_to_dicts(player):
+    """Translate a player's hand to JSON dictionaries.
+
+    If the world has a compiled :mod:`crail.catalog`, the cards come
+    from there and only the hand itself is read from the database.
+
+    """
+    cards = catalog.get(current_app, player.game.world_id)
+    if cards is None:
+        return [card_to_dict(card) for card in hand(player)]
+    jcards = [cards.card(card_id) for card_id in hand_ids(player)]
+    if None in jcards:
+        # The catalog is out of date; trust the database.
+        return [card_to_dict(card) for card in hand(player)]
+    return jcards
+
+
+def game_json(player, **extra):
+    """Serialize the in-game part of :func:`player_state`.
+
+    Any keyword arguments are added to the JSON object.
+
+    """
+    return dumps(dict(extra,
+                      player_id=player.id,
+                      player_name=player.name,
+                      game=player.game.world.name,
+                      money=ledger.balance(player),
+                      cards=hand_to_dicts(player)))
 
 
 @crail_bp.route('/api/state')
+@read_only
 def state():
     """Retrieve the current state."""
     return player_state()
 
 
+def table_json(game, money):
+    """Serialize :func:`table`.
+
+    This is a fixed number of queries however many players there are.
+
+    """
+    players = (db.session.query(Player.id, Player.name)
+               .filter(Player.game_id == game.id)
+               .order_by(Player.id).all())
+    held = actions.hands(game.id, [player_id for player_id, _ in players])
+    cards = card_dicts(game.world_id,
+                       [card_id for hand_ids in held.values()
+                        for card_id in hand_ids])
+    if money:
+        amounts = ledger.balances(game.id, held)
+    result = []
+    for player_id, name in players:
+        jplayer = {'id': player_id, 'name': name,
+                   'cards': [cards[card_id] for card_id in held[player_id]]}
+        if money:
+            jplayer['money'] = amounts[player_id]
+        result.append(jplayer)
+    return dumps({'id': game.id, 'game': game.world.name, 'players': result})
+
+
+@crail_bp.route('/api/game/table')
+@read_only
+def table():
+    """Retrieve every player's hand in a game.
+
+    Hands are public, so anyone, even someone not logged in, may look.
+    The query parameter `game` selects the game, by default your current
+    one.  With `money=1` each player's money is included too.
+
+    Returns a JSON object with keys `id` (the game ID), `game` (the
+    name of the world), and `players`, a list of objects with `id`,
+    `name`, `cards` (as in :func:`player_state`), and, if asked for,
+    `money`.  Like :func:`player_state` the response carries a
+    :data:`VERSION_HEADER`.  The view is cached until the game changes
+    (see :mod:`crail.table`).
+
+    """
+    game_id = request.args.get('game', type=int)
+    if game_id is None:
+        player = current_player._get_current_object()
+        if not player or player.game_id is None:
+            abort(400)
+        game_id = player.game_id
+    game = statements.get(Game, game_id)
+    if game is None:
+        abort(400)
+    money = request.args.get('money', type=int, default=0) != 0
+    version, body = tables.view(game.id, money,
+                                lambda: table_json(game, money))
+    response = json_response(body)
+    response.headers[VERSION_HEADER] = '{}:{}'.format(game.id, version)
+    return response
+
+
+@crail_bp.route('/api/game/history')
+@read_only
+def history():
+    """Retrieve what has happened in your current game, newest first.
+
+    You must be logged in and in a game.  Returns a JSON object with
+    key `events`, a list of objects with keys `seq`, `time` (ISO 8601
+    UTC, or :const:`None` for very old events), `kind`, `player_id`,
+    `player` (name), and `data` (see :mod:`crail.events`); and `next`,
+    the value of `before` to fetch the next older page, or
+    :const:`None` at the start of the game.
+
+    Query parameters `before` (a sequence number) and `limit` (at most
+    :data:`crail.settings.CRAIL_HISTORY_MAX_PAGE`) select the page.
+
+    """
+    player = current_player._get_current_object()
+    if not player or not player.game:
+        abort(400)
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int,
+                             default=current_app.config['CRAIL_HISTORY_PAGE'])
+    if limit < 1:
+        abort(400)
+    limit = min(limit, current_app.config['CRAIL_HISTORY_MAX_PAGE'])
+
+    page, cursor = events.history(player.game_id, before=before, limit=limit)
+    player_ids = {event['player_id'] for event in page} - {None}
+    names = dict(db.session.query(Player.id, Player.name)
+                 .filter(Player.id.in_(player_ids))) if player_ids else {}
+    return json_response(dumps({
+        'events': [{'seq': event['seq'],
+                    'time': (event['created'].isoformat() + 'Z'
+                             if event['created'] else None),
+                    'kind': event['kind'],
+                    'player_id': event['player_id'],
+                    'player': names.get(event['player_id']),
+                    'data': event['data']}
+                   for event in page],
+        'next': cursor,
+    }))
+
+
+@crail_bp.route('/api/metrics')
+def metrics():
+    """Retrieve this worker's :mod:`crail.metrics` as JSON.
+
+    This is only served if :data:`crail.settings.CRAIL_METRICS_PUBLIC`
+    is set.
+
+    """
+    if not current_app.config['CRAIL_METRICS_PUBLIC']:
+        abort(404)
+    return json_response(dumps(metrics_snapshot()))
+
+
 @crail_bp.route('/api/login', methods=['POST'])
 def login():
     """Log in to the system.
@@ -156,6 +442,7 @@ def logout():
 
 
 @crail_bp.route('/api/game/join', methods=['POST'])
+@idempotent(player_state)
 def join_game():
     """Join a game.
 
@@ -171,16 +458,19 @@ def join_game():
     if game_id is None:
         abort(400)
 
-    game = Game.query.get(game_id)
+    game = statements.get(Game, game_id)
     if game is None:
         abort(400)
 
-    current_player.game = game
+    player = current_player._get_current_object()
+    release(player.game_id, game.id)
+    actions.join_game(player, game)
     db.session.commit()
     return player_state()
 
 
 @crail_bp.route('/api/game/leave', methods=['POST'])
+@idempotent(player_state)
 def leave_game():
     """Leave a game.
 
@@ -190,12 +480,15 @@ def leave_game():
     """
     if not current_player:
         abort(400)
-    current_player.game = None
+    player = current_player._get_current_object()
+    release(player.game_id)
+    actions.leave_game(player)
     db.session.commit()
     return player_state()
 
 
 @crail_bp.route('/api/game/new', methods=['POST'])
+@idempotent(player_state)
 def new_game():
     """Start a new game.
 
@@ -212,18 +505,19 @@ def new_game():
     if world_id is None:
         abort(400)
 
-    world = World.query.get(world_id)
+    world = statements.get(World, world_id)
     if world is None:
         abort(400)
 
-    game = Game(world=world)
-    db.session.add(game)
-    current_player.game = game
+    player = current_player._get_current_object()
+    release(player.game_id)
+    actions.new_game(player, world)
     db.session.commit()
     return player_state()
 
 
 @crail_bp.route('/api/gain', methods=['POST'])
+@idempotent(player_state)
 def gain_money():
     """Increase the amount of money you have.
 
@@ -239,12 +533,15 @@ def gain_money():
     if amount is None:
         abort(400)
 
-    current_player.money += amount
+    player = current_player._get_current_object()
+    play(player, 'gain', lambda: actions.gain_money(player, amount),
+         amount=amount)
     db.session.commit()
     return player_state()
 
 
 @crail_bp.route('/api/spend', methods=['POST'])
+@idempotent(player_state)
 def spend_money():
     """Decrease the amount of money you have.
 
@@ -263,41 +560,74 @@ def spend_money():
     if amount is None:
         abort(400)
 
-    current_player.money -= amount
+    player = current_player._get_current_object()
+    play(player, 'spend', lambda: actions.spend_money(player, amount),
+         amount=amount)
     db.session.commit()
     return player_state()
 
 
 @crail_bp.route('/api/draw', methods=['POST'])
+@idempotent(player_state)
 def draw():
     """Draw a card.
 
     You must be logged in.  The card is added to your current cards list
     and returned.
 
-    This endpoint currently has no game knowledge.  You will always get
-    exactly one more card if it is there to be drawn.  If it is an event
-    card this will not draw another; if you already have "enough" cards
-    this will not prevent you from continuing to draw.
+    This endpoint has no game knowledge.  You will always get exactly
+    one more card if it is there to be drawn.  If it is an event card
+    this will not draw another; if you already have "enough" cards this
+    will not prevent you from continuing to draw.  :func:`fill` draws
+    up to the world's hand size instead.
 
     """
     player = current_player._get_current_object()
-    if not player:
+    if not player or not player.game:
         abort(400)
 
-    card = draw_card(player.game)
-    player.cards.append(card)
+    play(player, 'draw', lambda: draw_card(player.game, player))
     db.session.commit()
     return player_state()
 
 
+@crail_bp.route('/api/draw/fill', methods=['POST'])
+@idempotent(player_state)
+def fill():
+    """Draw cards until your hand is full.
+
+    You must be logged in and in a game whose world has a hand size
+    (see :func:`crail.actions.fill_hand`).  All of the cards are drawn
+    in one transaction.  Returns the same thing as :func:`player_state`
+    with an extra key `events`, the list of event cards drawn along the
+    way in the order they were drawn; a retried request (see
+    :mod:`crail.idempotency`) gets just the state.
+
+    """
+    player = current_player._get_current_object()
+    if not player or not player.game:
+        abort(400)
+
+    try:
+        drawn = play(player, 'fill', lambda: actions.fill_hand(player))
+    except ValueError:
+        abort(400)
+    db.session.commit()
+
+    cards = card_dicts(player.game.world_id, drawn)
+    return game_response(player,
+                         events=[cards[card_id] for card_id in drawn])
+
+
 @crail_bp.route('/api/discard', methods=['POST'])
+@idempotent(player_state)
 def discard():
     """Discard a card.
 
     The request body is a JSON object with a key `card` with the
     numeric card ID.  You must be logged in.  The card is removed from
-    your current cards list.
+    your current cards list.  It is an error to discard a card you are
+    not holding.
 
     This call "completes an event", or is one part of "flushing
     contracts".  In principle this and :func:`gain_money` can "deliver
@@ -313,21 +643,24 @@ def discard():
     if card_id is None:
         abort(400)
 
-    card = Card.query.get(card_id)
-    if card is not None and card in player.cards:
-        player.cards.remove(card)
-        db.session.commit()
+    if not play(player, 'discard', lambda: discard_card(player, card_id),
+                card=card_id):
+        current_app.logger.error('discard: not holding card %r', card_id)
+        abort(400)
+    db.session.commit()
     return player_state()
 
 
 @crail_bp.route('/api/complete', methods=['POST'])
+@idempotent(player_state)
 def complete():
     """Complete a contract.
 
     The request body is a JSON object with a key `contract` with the
     numeric contract ID.  You must be logged in and in a game.  This
     adds the amount of the contract to your money holding and discards
-    the card, but does not draw a new one to replace it.
+    the card, but does not draw a new one to replace it.  It is an
+    error to complete a contract that is not on any card you hold.
 
     """
     player = current_player._get_current_object()
@@ -341,10 +674,11 @@ def complete():
         current_app.logger.error('complete: no contract ID')
         abort(400)
 
-    contract = Contract.query.get(contract_id)
-    for card in contract.cards:
-        if player in card.players:
-            player.money += contract.amount
-            player.cards.remove(card)
+    if not play(player, 'complete',
+                lambda: complete_contract(player, contract_id),
+                contract=contract_id):
+        current_app.logger.error('complete: not holding contract %r',
+                                 contract_id)
+        abort(400)
     db.session.commit()
     return player_state()
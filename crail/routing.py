@@ -0,0 +1,234 @@
+"""Read/write and per-game routing for database sessions.
+
+.. Copyright © 2015, David Maze
+
+Read replicas
+-------------
+
+Views decorated with :func:`read_only` run their queries against a
+separate read-only engine, if one is configured, so read-heavy traffic
+like polling :func:`crail.routes.state` does not compete with writes.
+There are two ways to configure one:
+
+* Set :data:`crail.settings.CRAIL_READ_DATABASE_URI` to the URI of a
+  read replica.
+
+* With an SQLite primary database, set
+  :data:`crail.settings.CRAIL_READ_REPLICA` to :const:`True`.  The
+  primary is switched to WAL mode, and reads go through a separate pool
+  of read-only connections to the same file.
+
+A client that has just written reads from the primary for
+:data:`crail.settings.CRAIL_READ_AFTER_WRITE` seconds afterwards, so it
+always sees its own writes even if the replica lags.  The same applies
+within a single request once the session has flushed anything.
+
+Shards
+------
+
+Each game's mutable state -- hands, played cards, the money ledger, and
+the event log, the tables in :data:`SHARDED_TABLES` -- can live in a
+database of its own, so writes in unrelated games never wait on each
+other.  Set :data:`crail.settings.CRAIL_SHARDS` to a number of
+hash partitions, or to ``'game'`` for one database per game, and
+:data:`crail.settings.CRAIL_SHARD_DATABASE_URI` to a URI template; the
+sharded tables are created in each shard the first time it is used.
+Everything else, including the world catalog and the players
+themselves, stays in the primary database.  The state of players who
+are not in any game is kept in the primary database as well.
+
+Code touching sharded tables selects the shard with
+:meth:`RoutingSQLAlchemy.shard`.  Statements may not join sharded and
+unsharded tables, and ORM relationships through sharded tables (like
+:attr:`crail.models.Player.cards`) only work with sharding disabled.
+
+.. autodata:: SHARDED_TABLES
+.. autoclass:: RoutingSQLAlchemy
+.. autoclass:: RoutingSession
+.. autofunction:: read_only
+
+"""
+import contextlib
+import functools
+import sqlite3
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+from flask.ext.sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm, pool
+from sqlalchemy.sql.util import find_tables
+
+#: Key in :attr:`flask.Flask.extensions` holding the read-only engine.
+EXTENSION = 'crail_replica'
+
+#: Key in :attr:`flask.Flask.extensions` holding the shard engines.
+SHARDS_EXTENSION = 'crail_shards'
+
+#: Names of the tables holding per-game mutable state.
+SHARDED_TABLES = frozenset(['player_card', 'played_card', 'money_entry',
+                            'money_snapshot', 'game_event',
+                            'game_sequence', 'game_snapshot'])
+
+
+def read_only(view):
+    """Decorate a view function that never writes to the database."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.crail_read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.crail_read_only = False
+    return wrapper
+
+
+def _recently_wrote(app):
+    """Determine whether the current client wrote recently."""
+    wrote = session.get('crail_wrote')
+    return (wrote is not None and
+            time.time() - wrote < app.config['CRAIL_READ_AFTER_WRITE'])
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads in :func:`read_only` views to a replica."""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        self.crail_flushed = False
+        self.crail_game_id = None
+        event.listen(self, 'after_flush', self._note_flush)
+        event.listen(self, 'after_commit', self._note_commit)
+
+    def _note_flush(self, *_):
+        """Remember that this session has uncommitted writes."""
+        self.crail_flushed = True
+
+    def _note_commit(self, *_):
+        """Committed writes are covered by the read-after-write window."""
+        self.crail_flushed = False
+
+    def _touches_shard(self, mapper, clause):
+        """Determine whether a statement uses a sharded table."""
+        if mapper is not None:
+            tables = mapper.tables
+        elif clause is not None:
+            tables = find_tables(clause, include_crud=True)
+        else:
+            return False
+        return any(table.name in SHARDED_TABLES for table in tables)
+
+    def get_bind(self, mapper=None, clause=None):
+        if (self.app.config['CRAIL_SHARDS'] and
+                self._touches_shard(mapper, clause)):
+            shard = self.db.get_shard_engine(self.app, self.crail_game_id)
+            if shard is not None:
+                return shard
+
+        replica = self.app.extensions.get(EXTENSION)
+        if (replica is not None and
+                has_request_context() and
+                g.get('crail_read_only', False) and
+                not self.crail_flushed and
+                not _recently_wrote(self.app)):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy bridge that knows about read replicas."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shard_lock = threading.Lock()
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    @contextlib.contextmanager
+    def shard(self, game_id):
+        """Route statements on sharded tables to a game's shard.
+
+        Use as a context manager.  Statements on sharded tables inside
+        the block go to the shard for `game_id`; if that is
+        :const:`None`, meaning "not in a game", they go to the primary
+        database.  This has no effect if sharding is disabled.
+
+        :param int game_id: identifier of the game
+
+        """
+        session = self.session()
+        previous = session.crail_game_id
+        session.crail_game_id = game_id
+        try:
+            yield
+        finally:
+            session.crail_game_id = previous
+
+    def get_shard_engine(self, app, game_id):
+        """Get the engine holding a game's mutable state.
+
+        :param app: the Flask application
+        :param int game_id: identifier of the game, or :const:`None`
+        :return: an engine, or :const:`None` for the primary database
+
+        """
+        shards = app.config['CRAIL_SHARDS']
+        if not shards or game_id is None:
+            return None
+        key = game_id if shards == 'game' else game_id % shards
+        engines = app.extensions[SHARDS_EXTENSION]
+        engine = engines.get(key)
+        if engine is None:
+            with self._shard_lock:
+                engine = engines.get(key)
+                if engine is None:
+                    engine = create_engine(
+                        app.config['CRAIL_SHARD_DATABASE_URI'].format(key))
+                    self.Model.metadata.create_all(
+                        engine, tables=[self.Model.metadata.tables[name]
+                                        for name in sorted(SHARDED_TABLES)])
+                    engines[key] = engine
+        return engine
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.extensions[SHARDS_EXTENSION] = {}
+        replica = None
+        if app.config['CRAIL_READ_DATABASE_URI']:
+            replica = create_engine(app.config['CRAIL_READ_DATABASE_URI'])
+        elif app.config['CRAIL_READ_REPLICA']:
+            replica = self._sqlite_replica(app)
+        if replica is None:
+            return
+        app.extensions[EXTENSION] = replica
+
+        @app.after_request
+        def note_write(response):  # pylint: disable=unused-variable
+            """Send this client to the primary for a little while."""
+            if request.method != 'GET' and response.status_code < 400:
+                session['crail_wrote'] = time.time()
+            return response
+
+    def _sqlite_replica(self, app):
+        """Create a read-only pool onto an SQLite primary."""
+        primary = self.get_engine(app)
+        if primary.url.get_backend_name() != 'sqlite':
+            raise ValueError('CRAIL_READ_REPLICA needs an SQLite database; '
+                             'set CRAIL_READ_DATABASE_URI instead')
+        path = primary.url.database
+
+        @event.listens_for(primary, 'connect')
+        def use_wal(dbapi_connection, _):  # pylint: disable=unused-variable
+            """Let readers proceed while a writer holds the database."""
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+        def connect():
+            """Open a read-only connection to the primary's file."""
+            return sqlite3.connect('file:{}?mode=ro'.format(path), uri=True,
+                                   check_same_thread=False)
+
+        return create_engine('sqlite://', creator=connect,
+                             poolclass=pool.QueuePool,
+                             pool_size=app.config['CRAIL_READ_POOL_SIZE'])
@@ -12,3 +12,145 @@ in the current directory.
 """
 
 SQLALCHEMY_DATABASE_URI = 'sqlite:///crail.db'
+
+#: Never pretty-print :func:`flask.jsonify` output, even in debug mode.
+JSONIFY_PRETTYPRINT_REGULAR = False
+
+#: Sort keys in :func:`flask.jsonify` output, so equal responses are
+#: byte-for-byte identical.
+JSON_SORT_KEYS = True
+
+#: Number of :mod:`crail.ledger` entries a player may accumulate before
+#: a new balance snapshot is written.
+CRAIL_LEDGER_SNAPSHOT_INTERVAL = 32
+
+#: Number of :mod:`crail.events` in a game's log between state snapshots.
+CRAIL_EVENT_SNAPSHOT_INTERVAL = 64
+
+#: Default number of events per page of :func:`crail.routes.history`.
+CRAIL_HISTORY_PAGE = 50
+
+#: Largest page of :func:`crail.routes.history` a client may ask for.
+CRAIL_HISTORY_MAX_PAGE = 500
+
+#: Seconds a process trusts its cached lobby listing before checking
+#: the lobby version again (see :mod:`crail.lobby`).
+CRAIL_LOBBY_CHECK_INTERVAL = 1.0
+
+#: Number of game views each process keeps for
+#: :func:`crail.routes.table` (see :mod:`crail.table`).
+CRAIL_TABLE_CACHE_SIZE = 256
+
+#: If true, anyone may read :func:`crail.routes.metrics`; otherwise it
+#: is not found.
+CRAIL_METRICS_PUBLIC = False
+
+#: Most mutating requests each process runs at once, or 0 for no limit
+#: (see :mod:`crail.admission`).
+CRAIL_ADMISSION_LIMIT = 8
+
+#: Most mutating requests each process runs at once for one game.
+CRAIL_ADMISSION_GAME_LIMIT = 2
+
+#: Most mutating requests each process keeps waiting for a turn.
+CRAIL_ADMISSION_QUEUE = 32
+
+#: Most seconds a mutating request waits for a turn.
+CRAIL_ADMISSION_WAIT = 5.0
+
+#: Seconds a turned-away client is told to wait before retrying.
+CRAIL_ADMISSION_RETRY_AFTER = 1
+
+#: If true, serve the WebSocket action channel (see :mod:`crail.channel`).
+CRAIL_WEBSOCKET = False
+
+#: If true, keep games in play in memory and write them to the database
+#: behind (see :mod:`crail.engine`).  Needs a single server process.
+CRAIL_ENGINE = False
+
+#: Directory holding the :mod:`crail.engine` journals.
+CRAIL_ENGINE_JOURNAL_DIR = 'crail-journal'
+
+#: Most seconds between forcing an engine journal to disk; this is how
+#: much play a power failure can lose.
+CRAIL_ENGINE_FSYNC_INTERVAL = 0.05
+
+#: Most seconds the database lags behind an engine game in play.
+CRAIL_ENGINE_FLUSH_INTERVAL = 1.0
+
+#: Most engine actions written to the database in one transaction.
+CRAIL_ENGINE_FLUSH_BATCH = 256
+
+#: Seconds an engine game may go unplayed before it is released.
+CRAIL_ENGINE_IDLE = 300
+
+#: Seconds a request waits for an engine game to answer.
+CRAIL_ENGINE_TIMEOUT = 10
+
+#: SQLAlchemy URI of a read replica for :func:`crail.routing.read_only`
+#: views, or :const:`None`.
+CRAIL_READ_DATABASE_URI = None
+
+#: If true and there is no :data:`CRAIL_READ_DATABASE_URI`, serve
+#: :func:`crail.routing.read_only` views from read-only connections to
+#: the (SQLite) primary database in WAL mode.
+CRAIL_READ_REPLICA = False
+
+#: Number of connections in the SQLite read-only pool.
+CRAIL_READ_POOL_SIZE = 5
+
+#: Seconds after a write during which a client reads from the primary.
+CRAIL_READ_AFTER_WRITE = 5.0
+
+#: Per-game sharding for :mod:`crail.routing`: 0 to keep everything in
+#: one database, a number of hash partitions, or ``'game'`` for one
+#: database per game.
+CRAIL_SHARDS = 0
+
+#: SQLAlchemy URI template for shards, formatted with the shard number
+#: (or the game ID, for one database per game).
+CRAIL_SHARD_DATABASE_URI = 'sqlite:///crail-shard-{}.db'
+
+#: Build :mod:`crail.assets` bundles on demand.  If :const:`None`, do so
+#: only in debug mode; otherwise serve the files built by
+#: ``crail_manage assets build``.
+CRAIL_ASSETS_AUTO_BUILD = None
+
+#: Directory holding compiled :mod:`crail.catalog` world files.  If
+#: :const:`None`, worlds are not compiled and cards are always read
+#: from the database.
+CRAIL_CATALOG_DIR = None
+
+#: Seconds :mod:`crail.idempotency` remembers a request key.  Clients
+#: replaying queued actions after longer than this may apply them twice.
+CRAIL_IDEMPOTENCY_TTL = 24 * 60 * 60
+
+#: Smallest JSON response, in bytes, that :mod:`crail.compress` compresses.
+CRAIL_COMPRESS_MIN_SIZE = 512
+
+#: :mod:`gzip` compression level for responses, from 1 to 9.
+CRAIL_GZIP_LEVEL = 6
+
+#: Brotli quality for responses, from 0 to 11.
+CRAIL_BROTLI_QUALITY = 5
+
+#: File to record :mod:`crail.traffic` to, or :const:`None` to not
+#: record.  ``{pid}`` is replaced by the process ID.
+CRAIL_TRAFFIC_LOG = None
+
+#: Size in bytes past which the traffic file is rotated.
+CRAIL_TRAFFIC_MAX_BYTES = 64 * 1024 * 1024
+
+#: Number of rotated traffic files kept.
+CRAIL_TRAFFIC_BACKUPS = 5
+
+#: Request body fields whose values are replaced by a keyed hash in
+#: recorded traffic.
+CRAIL_TRAFFIC_REDACT = ('name',)
+
+#: Rows in each batch of a :mod:`crail.online` migration helper.
+CRAIL_ONLINE_BATCH = 1000
+
+#: Seconds :mod:`crail.online` migration helpers pause between batches,
+#: letting requests at the database.
+CRAIL_ONLINE_PAUSE = 0.05
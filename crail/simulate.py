@@ -0,0 +1,163 @@
+"""Monte Carlo deck simulation.
+
+.. Copyright © 2015, David Maze
+
+This answers balancing questions about a world, like "how much is a
+coal contract typically worth over a game" or "how often does an event
+come up", by playing out many games' worth of draws at once.  The
+world's cards are loaded into :mod:`numpy` arrays once, and each game
+is a row of a matrix of draws, so the work is a handful of array
+operations rather than a loop through the ORM.
+
+Draws follow :func:`crail.actions.draw_card`: every card not yet
+played is equally likely, and once the whole deck has been played it is
+reshuffled.  That makes each game's sequence of draws a series of
+independent random permutations of the deck.
+
+This needs NumPy, which is an optional dependency (``pip install
+crail[simulate]``).
+
+.. autoclass:: Deck
+   :members:
+.. autofunction:: percentile_table
+.. autofunction:: simulate
+.. autodata:: PERCENTILES
+
+"""
+import numpy as np
+from sqlalchemy import select
+
+from .models import Card, City, Contract, Good, card_contract, db
+
+#: Percentiles reported by ``crail_manage simulate``.
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+class Deck(object):
+    """A world's cards as arrays.
+
+    :param world: :class:`crail.models.World` to load
+
+    """
+
+    def __init__(self, world):
+        rows = db.session.execute(
+            select([Card.id, Card.event])
+            .where(Card.world_id == world.id)
+            .order_by(Card.id)).fetchall()
+        index = {row.id: i for i, row in enumerate(rows)}
+        #: Identifiers of the cards.
+        self.card_ids = np.array([row.id for row in rows], dtype=np.int64)
+        #: Whether each card is an event card.
+        self.is_event = np.array([bool(row.event) for row in rows],
+                                 dtype=bool)
+
+        contracts = db.session.execute(
+            select([card_contract.c.card_id, Contract.amount,
+                    Good.name, City.name])
+            .select_from(card_contract
+                         .join(Contract,
+                               Contract.id == card_contract.c.contract_id)
+                         .join(Good, Good.id == Contract.good_id)
+                         .join(City, City.id == Contract.city_id))
+            .where(card_contract.c.card_id.in_(list(index)))).fetchall()
+        #: Names of the goods, in column order of :attr:`good_amounts`.
+        self.goods = sorted({row[2] for row in contracts})
+        #: Names of the cities, in column order of :attr:`city_amounts`.
+        self.cities = sorted({row[3] for row in contracts})
+        goods = {name: i for i, name in enumerate(self.goods)}
+        cities = {name: i for i, name in enumerate(self.cities)}
+
+        #: Total contract amount for each good on each card.
+        self.good_amounts = np.zeros((len(rows), len(self.goods)),
+                                     dtype=np.int64)
+        #: Total contract amount to each city on each card.
+        self.city_amounts = np.zeros((len(rows), len(self.cities)),
+                                     dtype=np.int64)
+        #: Best single contract amount on each card.
+        self.best = np.zeros(len(rows), dtype=np.int64)
+        for card_id, amount, good, city in contracts:
+            card = index[card_id]
+            self.good_amounts[card, goods[good]] += amount
+            self.city_amounts[card, cities[city]] += amount
+            self.best[card] = max(self.best[card], amount)
+
+    def __len__(self):
+        return len(self.card_ids)
+
+
+def _draws(rng, games, size, draws):
+    """Draw orders for several games, as indexes into the deck."""
+    cycles = -(-draws // size)
+    return np.concatenate([rng.random((games, size)).argsort(axis=1)
+                           for _ in range(cycles)], axis=1)[:, :draws]
+
+
+def simulate(deck, games, draws, hand_size, seed=None, chunk=10000):
+    """Simulate many games.
+
+    Each game draws `draws` cards from a fresh deck.  The starting hand
+    is the first `hand_size` contract cards drawn; events drawn on the
+    way are resolved and replaced, as in the real game.
+
+    :param deck: :class:`Deck` to draw from
+    :param int games: number of games to simulate
+    :param int draws: number of cards drawn in each game
+    :param int hand_size: number of contract cards in a starting hand
+    :param int seed: random seed, for repeatable results
+    :param int chunk: number of games simulated at once, which bounds
+      memory use
+    :return: dictionary with per-game arrays `events` (events drawn),
+      `hand_value` (sum of the best contract on each starting hand
+      card), `good_payouts` and `city_payouts` (total contract amounts
+      drawn, with one column per :attr:`Deck.goods` or
+      :attr:`Deck.cities`)
+    :raise ValueError: if the deck is empty
+
+    """
+    if not len(deck):
+        raise ValueError('the world has no cards')
+    rng = np.random.default_rng(seed)
+    size = len(deck)
+    results = {'events': [], 'hand_value': [], 'good_payouts': [],
+               'city_payouts': []}
+    for start in range(0, games, chunk):
+        count = min(chunk, games - start)
+        order = _draws(rng, count, size, draws)
+        events = deck.is_event[order]
+        results['events'].append(events.sum(axis=1))
+
+        contracts = ~events
+        in_hand = contracts & (contracts.cumsum(axis=1) <= hand_size)
+        results['hand_value'].append(
+            (deck.best[order] * in_hand).sum(axis=1))
+
+        # How many times each game drew each card
+        offsets = order + size * np.arange(count)[:, np.newaxis]
+        drawn = np.bincount(offsets.ravel(),
+                            minlength=count * size).reshape(count, size)
+        results['good_payouts'].append(drawn.dot(deck.good_amounts))
+        results['city_payouts'].append(drawn.dot(deck.city_amounts))
+    return {key: np.concatenate(value) for key, value in results.items()}
+
+
+def percentile_table(title, names, values):
+    """Format a table of per-column percentiles.
+
+    :param str title: heading for the name column
+    :param list names: row names
+    :param values: array with one column per name and one row per game
+    :return: list of lines
+
+    """
+    width = max([len(title)] + [len(name) for name in names])
+    header = ''.join('{:>8}'.format('p{}'.format(p)) for p in PERCENTILES)
+    lines = ['{:<{}}{}{:>9}'.format(title, width, header, 'mean')]
+    table = np.percentile(values, PERCENTILES, axis=0)
+    means = values.mean(axis=0)
+    for column, name in enumerate(names):
+        lines.append('{:<{}}{}{:>9.1f}'.format(
+            name, width,
+            ''.join('{:>8.0f}'.format(v) for v in table[:, column]),
+            means[column]))
+    return lines
@@ -0,0 +1,81 @@
+"""Coalescing of identical concurrent work.
+
+.. Copyright © 2015, David Maze
+
+When many requests ask for the same thing at the same moment -- every
+phone at the table refreshing after an event card, or a double tap --
+only the first one does the work; the rest wait for it and share its
+result.  Nothing is kept once the work finishes, so this is not a
+cache: the key should include a version of whatever is being read,
+so a request that arrives after a write never gets a result computed
+before it.
+
+Each :class:`SingleFlight` counts ``NAME.leader`` (did the work) and
+``NAME.shared`` (reused another request's result) in
+:mod:`crail.metrics`.
+
+.. autoclass:: SingleFlight
+   :members:
+
+"""
+import threading
+
+from . import metrics
+
+
+class _Call(object):
+    """One in-progress piece of work."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """A group of coalesced calls.
+
+    :param str name: prefix for this group's metrics
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Call `func`, unless a call with the same `key` is running.
+
+        If another thread is already running a call for `key`, wait for
+        it and return (or raise) its result instead.
+
+        :param key: hashable key identifying the work
+        :param func: function of no arguments doing the work
+        :return: the result of `func`
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.increment(self.name + '.shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment(self.name + '.leader')
+        try:
+            call.result = func()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
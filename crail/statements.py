@@ -0,0 +1,88 @@
+"""Precompiled statements for hot paths.
+
+.. Copyright © 2015, David Maze
+
+Building a SQLAlchemy query and compiling it to SQL costs more Python
+time than running it against SQLite does for the small lookups most
+requests make.  The statements on the hottest paths -- finding the
+current player, reading a hand, a balance, or a game version, drawing a
+card -- are built once and reused:
+
+* A :class:`Statement` is a Core select with bound parameters, compiled
+  once per kind of database and executed with plain row results.
+
+* ORM lookups whose objects are modified or related afterwards use
+  :mod:`sqlalchemy.ext.baked` queries from :data:`bakery`, which cache
+  both the :class:`~sqlalchemy.orm.query.Query` and its SQL; :func:`get`
+  is a cached replacement for ``Model.query.get()``.
+
+Both still go through :meth:`crail.routing.RoutingSession.get_bind`,
+so replicas and shards work as before.  ``crail_manage benchmark
+statements`` compares the per-call cost against building the same
+queries from scratch.
+
+.. autodata:: bakery
+.. autoclass:: Statement
+   :members:
+.. autofunction:: get
+
+"""
+from sqlalchemy.ext import baked
+
+from .models import db
+
+#: Cache of baked ORM queries.
+bakery = baked.bakery(size=200)  # pylint: disable=invalid-name
+
+_getters = {}  # pylint: disable=invalid-name
+
+
+class Statement(object):
+    """A Core statement compiled once per kind of database.
+
+    Compiled forms are kept per dialect class and parameter style, not
+    per engine, so shards of the same kind share one.
+
+    :param statement: the statement, with
+      :func:`~sqlalchemy.sql.expression.bindparam` placeholders for
+      anything that varies between calls
+
+    """
+
+    def __init__(self, statement):
+        self.statement = statement
+        self._compiled = {}
+
+    def execute(self, **params):
+        """Run the statement in the current session.
+
+        :param params: values for the bound parameters
+        :return: :class:`~sqlalchemy.engine.ResultProxy`
+
+        """
+        connection = db.session.connection(clause=self.statement)
+        dialect = connection.dialect
+        key = (type(dialect), dialect.paramstyle)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self.statement.compile(dialect=dialect)
+            self._compiled[key] = compiled
+        return connection.execute(compiled, params)
+
+
+def get(model, ident):
+    """Get an object by primary key.
+
+    This is ``model.query.get(ident)``, looking in the session's
+    identity map first and otherwise running a baked query.
+
+    :param model: mapped class
+    :param ident: primary key value, or tuple for a composite key
+    :return: the object, or :const:`None`
+
+    """
+    query = _getters.get(model)
+    if query is None:
+        query = _getters[model] = bakery(
+            lambda session: session.query(model), model)
+    return query(db.session()).get(ident)
@@ -4,6 +4,36 @@
     var currentPlayerName = null;
     var currentState = null;
 
+    // localStorage keys for the last state seen and for actions not yet
+    // acknowledged by the server
+    var STATE_KEY = 'crail.state';
+    var QUEUE_KEY = 'crail.queue';
+
+    // How long to wait before retrying queued actions, in ms
+    var RETRY_INTERVAL = 10000;
+
+    // How many times to retry a request the server turned away as too
+    // busy, and the longest to wait between tries, in ms
+    var BUSY_TRIES = 5;
+    var BUSY_MAX_DELAY = 30000;
+
+    var load = function(key, fallback) {
+        try {
+            var value = window.localStorage.getItem(key);
+            return value ? JSON.parse(value) : fallback;
+        } catch (e) {
+            return fallback;
+        }
+    };
+
+    var save = function(key, value) {
+        try {
+            window.localStorage.setItem(key, JSON.stringify(value));
+        } catch (e) {
+            // Private browsing or full storage; carry on in memory
+        }
+    };
+
     var cardById = function(cardId) {
         if (!currentState) return null;
         return _.findWhere(currentState.cards, {id: cardId});
@@ -171,39 +201,271 @@
         }).remove();
     };
 
+    /**
+     * How long to wait before retrying a request turned away with a
+     * 503.  This is at least the server's Retry-After, plus a random
+     * share of an exponentially growing window, so that a room full
+     * of clients doesn't come back all at once.
+     */
+    var busyDelay = function(xhr, attempt) {
+        var after = parseFloat(xhr.getResponseHeader('Retry-After'));
+        var floor = after > 0 ? after * 1000 : 1000;
+        var spread = Math.min(floor * Math.pow(2, attempt), BUSY_MAX_DELAY);
+        return floor + Math.random() * spread;
+    };
+
     var postJson = function(url, data, options) {
-        options = _.extend(options || {}, {
+        options = options || {};
+        options = _.extend(options, {
             method: 'POST',
             data: JSON.stringify(data),
             contentType: 'application/json; charset=utf-8',
-            headers: {
+            headers: _.extend(options.headers || {}, {
                 'X-CSRFToken': $.cookie('_csrf_token')
-            },
+            }),
             dataType: 'json'
         });
-        return $.ajax(url, options);
+        var result = $.Deferred();
+        var attempt = 0;
+        var send = function() {
+            $.ajax(url, options).then(result.resolve, function(xhr) {
+                if (xhr.status === 503 && attempt < BUSY_TRIES) {
+                    window.setTimeout(send, busyDelay(xhr, attempt));
+                    attempt += 1;
+                } else {
+                    result.reject.apply(result, arguments);
+                }
+            });
+        };
+        send();
+        return result.promise();
+    };
+
+    /*
+     * Offline action queue.  In-game actions are appended to a queue
+     * kept in localStorage and sent one at a time, in order.  Each
+     * carries an Idempotency-Key chosen when it was queued, so sending
+     * it again after a lost response is harmless.  If the server can't
+     * be reached the queue waits for the connection to come back.
+     *
+     * The UI doesn't wait for any of this.  What is shown is the last
+     * state the server confirmed with every queued action applied to
+     * it locally (see predictors), so a tap takes effect immediately.
+     * When the server answers, its state replaces the prediction; if it
+     * rejected the action, or came out differently than predicted, the
+     * change is visibly undone.
+     *
+     * Each action remembers the player who queued it.  It is only sent
+     * while the server says that player is logged in, and is dropped
+     * once the server reports someone else.
+     */
+    var actionQueue = load(QUEUE_KEY, []);
+    var flushing = false;
+    var loggingIn = false;
+
+    // Last state the server sent, and the game version it was for
+    var confirmedState = null;
+    var confirmedVersion = null;
+
+    var predictors = {
+        'api/gain': function(state, data) {
+            state.money += data.amount;
+        },
+        'api/spend': function(state, data) {
+            state.money -= data.amount;
+        },
+        'api/discard': function(state, data) {
+            state.cards = _.reject(state.cards, function(card) {
+                return card.id === data.card;
+            });
+        },
+        'api/complete': function(state, data) {
+            state.cards = _.reject(state.cards, function(card) {
+                var contract = _.findWhere(card.contracts || [],
+                                           {id: data.contract});
+                if (contract) {
+                    state.money += contract.amount;
+                }
+                return !!contract;
+            });
+        }
+    };
+
+    var actionLabels = {
+        'api/gain': 'gain money',
+        'api/spend': 'spend money',
+        'api/draw': 'draw a card',
+        'api/discard': 'discard that card',
+        'api/complete': 'complete that contract'
+    };
+
+    /** Apply actions to a copy of a state, as far as we can guess. */
+    var predict = function(state, actions) {
+        if (!state || !state.game) return state;
+        state = JSON.parse(JSON.stringify(state));
+        _.each(actions, function(action) {
+            var predictor = predictors[action.url];
+            if (predictor) predictor(state, action.data);
+        });
+        return state;
+    };
+
+    var render = function() {
+        if (confirmedState) {
+            resetUiFromState(predict(confirmedState, actionQueue));
+        }
+        showPending();
+    };
+
+    var showRollback = function(text) {
+        $('#rollback-alert').text(text).removeClass('hidden');
+        window.clearTimeout(showRollback.timer);
+        showRollback.timer = window.setTimeout(function() {
+            $('#rollback-alert').addClass('hidden');
+        }, 4000);
+    };
+
+    /**
+     * Parse the X-Crail-Version header: game ID and the sequence number
+     * of the game's last event.
+     */
+    var stateVersion = function(xhr) {
+        var header = xhr && xhr.getResponseHeader('X-Crail-Version');
+        if (!header) return null;
+        var parts = header.split(':');
+        return {game: parseInt(parts[0]), seq: parseInt(parts[1])};
+    };
+
+    /**
+     * Take a state from the server as the new baseline.  A response
+     * for an older version of the same game than one we've already
+     * seen (a slow poll overtaken by an action) is ignored.
+     */
+    var acceptState = function(state, textStatus, xhr) {
+        var version = stateVersion(xhr);
+        if (version && confirmedVersion &&
+            version.game === confirmedVersion.game &&
+            version.seq < confirmedVersion.seq) {
+            return;
+        }
+        confirmedVersion = version;
+        confirmedState = state;
+        save(STATE_KEY, state);
+        if (state.player_id) {
+            var mine = _.where(actionQueue, {player: state.player_id});
+            if (mine.length !== actionQueue.length) {
+                // Queued by a different player before this login
+                actionQueue = mine;
+                save(QUEUE_KEY, actionQueue);
+            }
+        }
+        render();
+    };
+
+    var sameHand = function(a, b) {
+        return (a.money === b.money &&
+                _.isEqual(_.pluck(a.cards, 'id'), _.pluck(b.cards, 'id')));
+    };
+
+    var newKey = function() {
+        return Date.now().toString(36) + '-' +
+            Math.random().toString(36).slice(2) +
+            Math.random().toString(36).slice(2);
+    };
+
+    var showPending = function() {
+        if (actionQueue.length) {
+            $('#pending-control')
+                .text(actionQueue.length + ' action' +
+                      (actionQueue.length === 1 ? '' : 's') +
+                      ' waiting for the network')
+                .removeClass('hidden');
+        } else {
+            $('#pending-control').addClass('hidden');
+        }
+    };
+
+    var flushQueue = function() {
+        showPending();
+        if (flushing || loggingIn || !actionQueue.length) return;
+        var action = actionQueue[0];
+        if (!confirmedState || confirmedState.player_id !== action.player) {
+            // Wait until the server confirms who is logged in
+            return;
+        }
+        flushing = true;
+        postJson(action.url, action.data, {
+            headers: {'Idempotency-Key': action.key}
+        }).then(function(state, textStatus, xhr) {
+            var expected = predict(confirmedState, [action]);
+            actionQueue.shift();
+            save(QUEUE_KEY, actionQueue);
+            flushing = false;
+            if (predictors[action.url] && expected && expected.game &&
+                state.game && !sameHand(expected, state)) {
+                showRollback('The server saw that differently; ' +
+                             'showing its version.');
+            }
+            acceptState(state, textStatus, xhr);
+            flushQueue();
+        }, function(xhr) {
+            flushing = false;
+            if (xhr.status >= 400 && xhr.status < 500) {
+                // The server rejected it; retrying won't help
+                console.error('dropping rejected action', action, xhr);
+                actionQueue.shift();
+                save(QUEUE_KEY, actionQueue);
+                showRollback("Couldn't " +
+                             (actionLabels[action.url] || 'do that') +
+                             '; undone.');
+                render();
+                flushQueue();
+            } else {
+                showPending();
+            }
+        });
+    };
+
+    var queueAction = function(url, data) {
+        actionQueue.push({url: url, data: data, key: newKey(),
+                          player: currentPlayerId});
+        save(QUEUE_KEY, actionQueue);
+        render();
+        flushQueue();
     };
 
+    $(window).on('online', flushQueue);
+    window.setInterval(flushQueue, RETRY_INTERVAL);
+
     $('#login-submit').on('click', function() {
         var name = $('#login-name').val();
+        // Hold the queue until we know who this is
+        loggingIn = true;
         postJson('api/login', {
             name: name
-        }).then(resetUiFromState);
+        }).always(function() {
+            loggingIn = false;
+        }).then(acceptState).then(flushQueue);
     })
 
     $('#leave-game-action').on('click', function() {
-        postJson('api/game/leave', {}).then(resetUiFromState);
+        postJson('api/game/leave', {}).then(acceptState);
     });
     
     $('#logout-action').on('click', function() {
-        postJson('api/logout', {}).then(resetUiFromState);
+        postJson('api/logout', {}).then(function(state, textStatus, xhr) {
+            // Queued actions belong to the player who just left
+            actionQueue = [];
+            save(QUEUE_KEY, actionQueue);
+            acceptState(state, textStatus, xhr);
+        });
     });
 
     $('#game-list').on('click', '.game-choice', function() {
         // JQuery sets this to the world-choice element
         postJson('api/game/join', {
             game: $(this).data('game-id')
-        }).then(resetUiFromState);
+        }).then(acceptState);
     });
     
     $('#new-game-action').on('click', function() {
@@ -215,7 +477,7 @@
         // JQuery sets this to the world-choice element
         postJson('api/game/new', {
             world: $(this).data('world-id')
-        }).then(resetUiFromState);
+        }).then(acceptState);
     });
     
     $('#old-game-action').on('click', function() {
@@ -224,19 +486,19 @@
     });
 
     $('#gain-action').on('click', function() {
-        postJson('api/gain', {
+        queueAction('api/gain', {
             amount: parseInt($('#gain-amount').val())
-        }).then(resetUiFromState);
+        });
     });
 
     $('#spend-action').on('click', function() {
-        postJson('api/spend', {
+        queueAction('api/spend', {
             amount: parseInt($('#spend-amount').val())
-        }).then(resetUiFromState);
+        });
     });
 
     $('#cards-list').on('click', '#draw-card-action', function() {
-        postJson('api/draw', {}).then(resetUiFromState);
+        queueAction('api/draw', {});
     });
 
     $('#cards-list').on('click', '.simple-card', function() {
@@ -245,9 +507,9 @@
     });
 
     $('#discard-action').on('click', function() {
-        postJson('api/discard', {
+        queueAction('api/discard', {
             card: parseInt($('#discard-id').text())
-        }).then(resetUiFromState);
+        });
     });
 
     $('#cards-list').on('click', '.contract-card', function() {
@@ -284,9 +546,9 @@
     });
 
     $('#contract-confirm-action').on('click', function() {
-        postJson('api/complete', {
+        queueAction('api/complete', {
             contract: parseInt($('#contract-confirm-id').text())
-        }).then(resetUiFromState);
+        });
     });
 
     $('#contract-list').on('click', '#contract-discard', function() {
@@ -312,13 +574,23 @@
     });
 
     $('#contract-discard-action').on('click', function() {
-        postJson('api/discard', {
+        queueAction('api/discard', {
             card: parseInt($('#contract-discard-id').text())
-        }).then(resetUiFromState);
+        });
     });
     
+    // Show whatever we last knew right away, then catch up
+    confirmedState = load(STATE_KEY, null);
+    render();
     $.ajax('api/state', {
         'dataType': 'json',
-    }).then(resetUiFromState);
+    }).then(function(state, textStatus, xhr) {
+        acceptState(state, textStatus, xhr);
+        flushQueue();
+    });
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('sw.js');
+    }
     
 })();
@@ -0,0 +1,81 @@
+"""Shared table view.
+
+.. Copyright © 2015, David Maze
+
+Hands are public: anyone at the table may look at anyone else's cards.
+:func:`crail.routes.table` returns every hand in a game at once, and
+since a spectator's screen or a shared display at the table polls it
+far more often than the game changes, each process keeps the
+serialized view of recently viewed games keyed by the game version
+(see :mod:`crail.versions`).  Between mutations a view costs one
+version query; concurrent rebuilds of the same version are coalesced
+(see :mod:`crail.singleflight`).
+
+At most :data:`crail.settings.CRAIL_TABLE_CACHE_SIZE` views are kept
+per application, least recently used first out.  Hits and rebuilds are
+counted as ``table.hit`` and ``table.miss`` in :mod:`crail.metrics`.
+
+.. autofunction:: view
+
+"""
+import collections
+import threading
+
+from flask import current_app
+
+from . import metrics, versions
+from .singleflight import SingleFlight
+
+#: Key of the cache in the Flask application's extensions.
+EXTENSION = 'crail_table'
+
+#: Coalesces concurrent rebuilds of the same view.
+table_flight = SingleFlight('table')  # pylint: disable=invalid-name
+
+_create_lock = threading.Lock()  # pylint: disable=invalid-name
+
+
+class _Views(object):
+    """One application's cached views."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = collections.OrderedDict()
+
+
+def _cache(app):
+    """Get an application's cached views, creating them if needed."""
+    with _create_lock:
+        return app.extensions.setdefault(EXTENSION, _Views())
+
+
+def view(game_id, key, build):
+    """Get the current view of a game.
+
+    :param int game_id: identifier of the game
+    :param key: hashable variant of the view, such as whether it
+      includes money
+    :param build: function of no arguments building the view, called
+      only if there is no cached copy for the current game version
+    :return: pair of the game version and what `build` returned
+
+    """
+    app = current_app._get_current_object()
+    cache = _cache(app)
+    version = versions.game_version(game_id)
+    with cache.lock:
+        cached = cache.views.get((game_id, key))
+        if cached is not None and cached[0] == version:
+            cache.views.move_to_end((game_id, key))
+            metrics.increment('table.hit')
+            return cached
+    metrics.increment('table.miss')
+    value = table_flight.do((game_id, key, version), build)
+    with cache.lock:
+        cached = cache.views.get((game_id, key))
+        if cached is None or cached[0] <= version:
+            cache.views[(game_id, key)] = (version, value)
+            cache.views.move_to_end((game_id, key))
+        while len(cache.views) > app.config['CRAIL_TABLE_CACHE_SIZE']:
+            cache.views.popitem(last=False)
+    return version, value
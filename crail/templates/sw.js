@@ -0,0 +1,54 @@
+{#- -*- engine: django -*- -#}
+/**
+ * Service worker: serve the page and its bundles from cache, so the
+ * app still opens when the table's wifi drops out.  API calls always go
+ * to the network; crail.js keeps the last state and queues actions
+ * itself.
+ */
+var CACHE = 'crail-{{ version }}';
+var SHELL = {{ shell|tojson }};
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(caches.open(CACHE).then(function(cache) {
+        return cache.addAll(SHELL);
+    }).then(function() {
+        return self.skipWaiting();
+    }));
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(caches.keys().then(function(names) {
+        return Promise.all(names.filter(function(name) {
+            return name.indexOf('crail-') === 0 && name !== CACHE;
+        }).map(function(name) {
+            return caches.delete(name);
+        }));
+    }).then(function() {
+        return self.clients.claim();
+    }));
+});
+
+self.addEventListener('fetch', function(event) {
+    var request = event.request;
+    if (request.method !== 'GET' || request.url.indexOf('/api/') !== -1) {
+        return;
+    }
+
+    if (request.mode === 'navigate') {
+        // Network first, so a reload picks up a new deployment
+        event.respondWith(fetch(request).then(function(response) {
+            var copy = response.clone();
+            caches.open(CACHE).then(function(cache) {
+                cache.put(SHELL[0], copy);
+            });
+            return response;
+        }).catch(function() {
+            return caches.match(SHELL[0]);
+        }));
+        return;
+    }
+
+    event.respondWith(caches.match(request).then(function(cached) {
+        return cached || fetch(request);
+    }));
+});
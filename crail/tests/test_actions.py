@@ -3,8 +3,10 @@
 .. Copyright © 2015, David Maze
 
 """
-from crail.actions import draw_card, get_or_create_player
-from crail.models import Card, db, Game, Player, World
+from crail import ledger
+from crail.actions import complete_contract, discard_card, draw_card, \
+    get_or_create_player
+from crail.models import Card, City, Contract, db, Game, Good, Player, World
 
 
 def test_get_or_create_player(client):
@@ -44,3 +46,44 @@ def test_draw_card(client):
         db.session.commit()
         assert ((card1 == one and card2 == two) or
                 (card1 == two and card2 == one))
+
+
+def test_discard_card(client):
+    world = World(name='world')
+    one = Card(event='one', world=world)
+    two = Card(event='two', world=world)
+    player = Player(name='me', money=0, cards=[one])
+    db.session.add_all([world, one, two, player])
+    db.session.commit()
+
+    assert discard_card(player, two.id) == 0
+    assert discard_card(player, one.id) == 1
+    db.session.commit()
+    assert player.cards == []
+    assert discard_card(player, one.id) == 0
+
+
+def test_complete_contract(client):
+    world = World(name='world')
+    stuff = Good(name='stuff')
+    here = City(name='here', produces=[stuff], world=world)
+    contract = Contract(good=stuff, city=here, amount=5)
+    other = Contract(good=stuff, city=here, amount=7)
+    card = Card(contracts=[contract, other], world=world)
+    player = Player(name='me', money=0, cards=[card])
+    bystander = Player(name='you', money=0, cards=[card])
+    db.session.add_all([world, stuff, here, contract, other, card,
+                        player, bystander])
+    db.session.commit()
+
+    assert complete_contract(player, 12345) == 0
+    assert complete_contract(player, contract.id) == 1
+    db.session.commit()
+    assert ledger.balance(player) == 5
+    assert player.cards == []
+    assert ledger.balance(bystander) == 0
+    assert bystander.cards == [card]
+
+    assert complete_contract(player, other.id) == 0
+    db.session.commit()
+    assert ledger.balance(player) == 5
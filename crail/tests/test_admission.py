@@ -0,0 +1,59 @@
+"""Unit tests for :mod:`crail.admission`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+
+from crail import metrics
+from crail.admission import EXTENSION, Limiter
+from crail.app import make_app
+from crail.models import db
+
+
+def test_limiter():
+    """Test the global and per-game limits."""
+    limiter = Limiter(3, 2, 1)
+    assert limiter.acquire(1, 0)
+    assert limiter.acquire(1, 0)
+    assert not limiter.acquire(1, 0)
+    assert limiter.acquire(2, 0)
+    assert not limiter.acquire(None, 0)
+    limiter.release(1)
+    assert limiter.acquire(None, 0)
+    assert limiter.games == {1: 1, 2: 1}
+
+
+def test_shed(tmpdir):
+    """Test that a saturated process turns requests away quickly."""
+    app = make_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{!s}/crail.db'.format(tmpdir),
+        'SECRET_KEY': 'seeeekrit',
+        'CRAIL_ADMISSION_LIMIT': 1,
+        'CRAIL_ADMISSION_QUEUE': 0,
+    })
+    with app.app_context():
+        db.create_all()
+        db.session.commit()
+    client = app.test_client()
+    limiter = app.extensions[EXTENSION]
+    metrics.reset()
+
+    def login():
+        """Try to log in."""
+        return client.post('/api/login', data=json.dumps({'name': 'me'}),
+                           content_type='application/json')
+
+    assert limiter.acquire(None, 0)
+    response = login()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    # Reads are not limited
+    assert client.get('/api/state').status_code == 200
+
+    limiter.release(None)
+    assert login().status_code == 200
+    assert limiter.running == 0
+    counters = metrics.snapshot()['counters']
+    assert counters['admission.rejected'] == 1
+    assert counters['admission.admitted'] == 1
@@ -0,0 +1,52 @@
+"""Unit tests for :mod:`crail.backup`.
+
+.. Copyright © 2015, David Maze
+
+"""
+from crail import actions, backup, ledger
+from crail.models import Card, City, Contract, db, Good, Player, World
+
+
+def test_round_trip(client, tmpdir):
+    world = World(name='world')
+    stuff = Good(name='stuff')
+    here = City(name='here', produces=[stuff], world=world)
+    contract = Contract(good=stuff, city=here, amount=5)
+    cards = [Card(number=7, contracts=[contract], world=world),
+             Card(number=8, event='oh noes!', world=world),
+             Card(number=9, world=world)]
+    me = Player(name='me', money=0)
+    you = Player(name='you', money=0)
+    db.session.add_all([world, stuff, here, contract, me, you] + cards)
+    db.session.commit()
+    game = actions.new_game(me, world)
+    actions.join_game(you, game)
+    actions.gain_money(me, 12)
+    actions.draw_card(game, me)
+    actions.draw_card(game, you)
+    db.session.commit()
+
+    data = backup.dump(game)
+    assert data['world'] == 'world'
+    assert [p['name'] for p in data['players']] == ['me', 'you']
+    assert data['players'][0]['money'] == 12
+    assert sorted(data['played']) == sorted(
+        data['players'][0]['cards'] + data['players'][1]['cards'])
+
+    filename = str(tmpdir.join('game.crail.gz'))
+    backup.write(game, filename)
+    assert backup.read(filename) == data
+
+    # Scramble things, then restore
+    actions.spend_money(me, 100)
+    actions.draw_card(game, me)
+    db.session.commit()
+    restored = backup.load(backup.read(filename))
+    db.session.commit()
+    assert restored.id != game.id
+    assert me.game_id == restored.id and you.game_id == restored.id
+    assert ledger.balance(me) == 12
+    assert ledger.balance(you) == 0
+    again = backup.dump(restored)
+    assert again['players'] == data['players']
+    assert again['played'] == data['played']
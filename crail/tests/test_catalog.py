@@ -0,0 +1,66 @@
+"""Unit tests for :mod:`crail.catalog`.
+
+.. Copyright © 2015, David Maze
+
+"""
+from flask import current_app, url_for
+
+from crail import catalog
+from crail.models import Card, City, Contract, db, Game, Good, Player, World
+from crail.routes import card_to_dict
+
+
+def setup_world():
+    """Create a world with gaps in its card IDs."""
+    world = World(name='Boston Rails')
+    other = World(name='elsewhere')
+    beans = Good(name='Baked beans')
+    boston = City(name='Boston', world=world, produces=[beans])
+    beans_boston = Contract(good=beans, city=boston, amount=12)
+    cards = [Card(number=1, world=world, contracts=[beans_boston]),
+             Card(event='Other event', world=other),
+             Card(number=3, event='Evacuation Day', world=world),
+             Card(world=world)]
+    db.session.add_all([world, other] + cards)
+    db.session.commit()
+    return world, cards
+
+
+def test_catalog_matches_database(client, tmpdir):
+    world, cards = setup_world()
+    path = catalog.write(world, str(tmpdir))
+    compiled = catalog.Catalog(path)
+    assert compiled.world_id == world.id
+    assert compiled.name == 'Boston Rails'
+    for card in cards:
+        if card.world_id == world.id:
+            assert compiled.card(card.id) == card_to_dict(card)
+        else:
+            assert card.id not in compiled
+            assert compiled.card(card.id) is None
+    assert compiled.card(cards[-1].id + 1) is None
+    compiled.close()
+
+
+def test_state_uses_catalog(client, tmpdir):
+    world, cards = setup_world()
+    current_app.config['CRAIL_CATALOG_DIR'] = str(tmpdir)
+    catalog.write(world, str(tmpdir))
+    assert catalog.get(current_app, world.id) is not None
+
+    player = Player(name='me', money=0, game=Game(world=world),
+                    cards=[cards[0], cards[2]])
+    db.session.add(player)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['player_id'] = player.id
+
+    # Change the card behind the catalog's back; the catalog wins.
+    cards[2].event = 'changed'
+    db.session.commit()
+    response = client.get(url_for('crail.state'))
+    assert response.status_code == 200
+    state = response.json
+    assert [card['id'] for card in state['cards']] == [cards[0].id,
+                                                       cards[2].id]
+    assert state['cards'][1]['event'] == 'Evacuation Day'
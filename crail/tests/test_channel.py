@@ -0,0 +1,74 @@
+"""Unit tests for :mod:`crail.channel`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+
+from werkzeug.test import EnvironBuilder
+
+from crail.channel import Channel, delta, PATH
+from crail.models import Card, db, World
+
+
+def open_channel(app, client):
+    """Open a channel with a test client's cookies."""
+    cookie = '; '.join('{}={}'.format(c.name, c.value)
+                       for c in client.cookie_jar)
+    builder = EnvironBuilder(path=PATH, headers={'Cookie': cookie})
+    try:
+        return Channel(app, builder.get_environ())
+    finally:
+        builder.close()
+
+
+def send(channel, **message):
+    """Send a message and decode the reply."""
+    return json.loads(channel.handle(json.dumps(message)))
+
+
+def test_delta():
+    """Test describing state changes."""
+    old = {'money': 1, 'game': 'world', 'cards': [{'id': 1}, {'id': 2}]}
+    new = {'money': 3, 'game': 'world', 'cards': [{'id': 2}, {'id': 3}]}
+    assert delta(old, new) == {'set': {'money': 3}, 'unset': [],
+                               'cards': {'add': [{'id': 3}],
+                                         'remove': [1]}}
+    assert delta(new, {'player_id': None}) == {
+        'set': {'player_id': None},
+        'unset': ['cards', 'game', 'money'],
+        'cards': {'add': [], 'remove': [2, 3]}}
+
+
+def test_channel(app, client):
+    """Test playing over a channel."""
+    world = World(name='world')
+    db.session.add(world)
+    db.session.add(Card(number=1, event='FOO!', world=world))
+    db.session.commit()
+    for path, data in (('/api/login', {'name': 'me'}),
+                       ('/api/game/new', {'world': 1})):
+        client.post(path, data=json.dumps(data),
+                    content_type='application/json')
+    channel = open_channel(app, client)
+
+    reply = send(channel, id=1, action='state')
+    assert reply['status'] == 200
+    assert reply['delta']['set']['money'] == 0
+    version = reply['version']
+
+    reply = send(channel, id=2, action='gain', data={'amount': 5})
+    assert reply == {'id': 2, 'status': 200, 'version': '1:3',
+                     'delta': {'set': {'money': 5}, 'unset': []}}
+    assert reply['version'] != version
+
+    reply = send(channel, id=3, action='draw')
+    assert reply['delta']['cards'] == {
+        'add': [{'id': 1, 'number': 1, 'event': 'FOO!'}], 'remove': []}
+
+    # Same validation as over HTTP
+    assert send(channel, id=4, action='discard', data={'card': 99}) == {
+        'id': 4, 'status': 400}
+    assert send(channel, id=5, action='login') == {'id': None,
+                                                   'status': 400}
+    assert json.loads(channel.handle('not json'))['status'] == 400
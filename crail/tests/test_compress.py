@@ -0,0 +1,48 @@
+"""Unit tests for :mod:`crail.compress`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import gzip
+import json
+
+from flask import url_for
+
+from crail import metrics
+from crail.models import db, World
+
+
+def login_to_big_lobby(client):
+    """Log in with enough worlds to make a large lobby listing."""
+    db.session.add_all([World(name='world {}'.format(i)) for i in range(50)])
+    db.session.commit()
+    client.post(url_for('crail.login'), data=json.dumps({'name': 'me'}),
+                content_type='application/json')
+
+
+def test_gzip(client):
+    login_to_big_lobby(client)
+    plain = client.get(url_for('crail.state'))
+    assert 'Content-Encoding' not in plain.headers
+    assert len(plain.json['worlds']) == 50
+
+    metrics.reset()
+    response = client.get(url_for('crail.state'),
+                          headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = gzip.decompress(response.get_data())
+    assert body == plain.get_data()
+    assert len(response.get_data()) < len(body) / 2
+
+    histograms = metrics.snapshot()['histograms']
+    assert histograms['response.bytes']['sum'] == len(body)
+    assert histograms['response.sent_bytes']['sum'] == len(
+        response.get_data())
+
+
+def test_small_responses_uncompressed(client):
+    response = client.get(url_for('crail.state'),
+                          headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == b'{"player_id":null}'
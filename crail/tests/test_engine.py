@@ -0,0 +1,105 @@
+"""Unit tests for :mod:`crail.engine`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+import os
+
+from flask import url_for
+
+from crail import engine, ledger, versions
+from crail.events import dumps
+from crail.models import Card, City, Contract, db, Good, Player, World
+
+
+def post_json(client, name, data):
+    """Post JSON and check that it worked."""
+    response = client.post(url_for(name), data=json.dumps(data),
+                           content_type='application/json')
+    assert response.status_code == 200
+    return response
+
+
+def setup_engine(app, tmpdir):
+    """Turn on the engine, with a flush interval longer than any test."""
+    app.config.update({
+        'CRAIL_ENGINE': True,
+        'CRAIL_ENGINE_JOURNAL_DIR': str(tmpdir.join('journal')),
+        'CRAIL_ENGINE_FLUSH_INTERVAL': 3600,
+        'CRAIL_ENGINE_IDLE': 3600,
+    })
+
+
+def test_write_behind(app, client, tmpdir):
+    """Test that play is served from memory and written out later."""
+    setup_engine(app, tmpdir)
+    world = World(name='world')
+    stuff = Good(name='stuff')
+    here = City(name='here', produces=[stuff], world=world)
+    contract = Contract(good=stuff, city=here, amount=9)
+    db.session.add_all([world, stuff, here, contract,
+                        Card(number=1, contracts=[contract], world=world)])
+    db.session.commit()
+    post_json(client, 'crail.login', {'name': 'me'})
+    post_json(client, 'crail.new_game', {'world': 1})
+
+    post_json(client, 'crail.gain_money', {'amount': 5})
+    response = post_json(client, 'crail.draw', {})
+    assert response.json['cards'][0]['id'] == 1
+    response = post_json(client, 'crail.complete', {'contract': 1})
+    assert response.json['money'] == 14
+    assert response.json['cards'] == []
+    response = client.post(url_for('crail.complete'),
+                           data=json.dumps({'contract': 1}),
+                           content_type='application/json')
+    assert response.status_code == 400
+
+    # The database is behind, but the journal has it all
+    player = Player.query.get(1)
+    assert ledger.balance(player) == 0
+    path = engine.get(app).path(1)
+    assert len(open(path).readlines()) == 3
+
+    engine.get(app).release(1)
+    db.session.expire_all()
+    assert ledger.balance(player) == 14
+    assert versions.game_version(1) == 5
+    assert not os.path.getsize(path)
+
+    # The next action loads the game from the database again
+    response = post_json(client, 'crail.spend_money', {'amount': 4})
+    assert response.json['money'] == 10
+    assert response.headers['X-Crail-Version'] == '1:6'
+    engine.get(app).close()
+
+
+def test_recover(app, client, tmpdir):
+    """Test that a crashed process's journal is written out."""
+    setup_engine(app, tmpdir)
+    db.session.add(World(name='world'))
+    db.session.commit()
+    app.config['CRAIL_ENGINE'] = False
+    post_json(client, 'crail.login', {'name': 'me'})
+    post_json(client, 'crail.new_game', {'world': 1})
+    assert versions.game_version(1) == 2
+    app.config['CRAIL_ENGINE'] = True
+
+    os.makedirs(app.config['CRAIL_ENGINE_JOURNAL_DIR'])
+    path = os.path.join(app.config['CRAIL_ENGINE_JOURNAL_DIR'],
+                        'game-1.journal')
+    with open(path, 'w') as journal:
+        for seq, amount in ((2, 100), (3, 7), (4, -2)):
+            journal.write(dumps({'seq': seq, 'kind': 'gain', 'player_id': 1,
+                                 'data': {'amount': amount}}) + '\n')
+        journal.write('{"seq": 5, "ki')
+
+    # Seq 2 is already in the database; 3 and 4 are not; 5 was torn
+    owner = engine.get(app)
+    assert not os.path.exists(path)
+    db.session.expire_all()
+    assert ledger.balance(Player.query.get(1)) == 5
+    assert versions.game_version(1) == 4
+    response = client.get(url_for('crail.state'))
+    assert response.json['money'] == 5
+    owner.close()
@@ -0,0 +1,104 @@
+"""Unit tests for :mod:`crail.events`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import threading
+
+from crail import actions, events, ledger, versions
+from crail.models import Card, City, Contract, db, GameEvent, GameSnapshot, \
+    Good, Player, World
+
+
+def setup_game():
+    """Create a world with two cards and a two-player game."""
+    world = World(name='world')
+    stuff = Good(name='stuff')
+    here = City(name='here', produces=[stuff], world=world)
+    contract = Contract(good=stuff, city=here, amount=5)
+    card = Card(number=1, contracts=[contract], world=world)
+    event = Card(number=2, event='oh noes!', world=world)
+    me = Player(name='me', money=0)
+    you = Player(name='you', money=0)
+    db.session.add_all([world, stuff, here, contract, card, event, me, you])
+    db.session.commit()
+    game = actions.new_game(me, world)
+    actions.join_game(you, game)
+    db.session.commit()
+    return game, me, you, card, event, contract
+
+
+def test_replay_matches_tables(app, client):
+    app.config['CRAIL_EVENT_SNAPSHOT_INTERVAL'] = 4
+    game, me, you, card, event, contract = setup_game()
+
+    actions.gain_money(me, 10)
+    actions.spend_money(you, 3)
+    drawn = [actions.draw_card(game, me), actions.draw_card(game, me)]
+    actions.discard_card(me, event.id)
+    actions.complete_contract(me, contract.id)
+    actions.draw_card(game, you)
+    db.session.commit()
+    assert sorted(c.id for c in drawn) == [card.id, event.id]
+
+    state, last, count = events.replay(game.id)
+    assert last == GameEvent.query.count()
+    assert GameSnapshot.query.count() == last // 4
+    assert count == last % 4
+    assert state['players'][me.id] == {'money': 15, 'cards': []}
+    assert state['players'][you.id]['money'] == -3
+    assert state['players'][you.id]['cards'] == [c.id for c in you.cards]
+    assert len(state['played']) == 1
+
+    full, full_last, full_count = events.replay(game.id, use_snapshots=False)
+    assert (full, full_last, full_count) == (state, last, last)
+
+
+def test_replay_and_restore_earlier_state(client):
+    game, me, you, card, event, contract = setup_game()
+    actions.gain_money(me, 10)
+    db.session.commit()
+    before = events.replay(game.id)[1]
+
+    actions.leave_game(you)
+    actions.spend_money(me, 7)
+    actions.draw_card(game, me)
+    db.session.commit()
+
+    state, last, _ = events.replay(game.id, seq=before)
+    assert last == before
+    assert state == {'players': {me.id: {'money': 10, 'cards': []},
+                                 you.id: {'money': 0, 'cards': []}},
+                     'played': []}
+
+    lobby = versions.lobby_version()
+    events.restore(game.id, state)
+    db.session.commit()
+    assert versions.lobby_version() > lobby
+    assert ledger.balance(me) == 10
+    assert me.cards == []
+    assert you.game_id == game.id
+    assert events.replay(game.id)[0] == state
+
+
+def test_concurrent_record(app, client):
+    game, me, you, card, event, contract = setup_game()
+    game_id, you_id = game.id, you.id
+    first = events.record(game_id, 'gain', me.id, amount=1)
+    results = []
+
+    def other():
+        """Record from a second session while the first is open."""
+        with app.app_context():
+            results.append(events.record(game_id, 'gain', you_id,
+                                         amount=2))
+            db.session.commit()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    thread.join(0.2)
+    db.session.commit()
+    thread.join()
+    assert results == [first + 1]
+    assert [e.seq for e in GameEvent.query.order_by(GameEvent.seq)][-2:] == \
+        [first, first + 1]
@@ -0,0 +1,100 @@
+"""Unit tests for :mod:`crail.export`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import gzip
+import json
+import os
+
+from crail import actions
+from crail.app import make_app
+from crail.export import export, WATERMARKS
+from crail.models import Card, City, Contract, db, Good, Player, World
+
+
+def read_stream(directory, name):
+    """Read every row exported for a stream, across runs."""
+    rows = []
+    path = os.path.join(directory, name)
+    for filename in sorted(os.listdir(path)):
+        with gzip.open(os.path.join(path, filename), 'rt') as stream:
+            rows.extend(json.loads(line) for line in stream)
+    return rows
+
+
+def test_incremental_export(client, tmpdir):
+    world = World(name='world')
+    stuff = Good(name='stuff')
+    here = City(name='here', produces=[stuff], world=world)
+    contract = Contract(good=stuff, city=here, amount=5)
+    card = Card(number=1, contracts=[contract], world=world)
+    me = Player(name='me', money=0)
+    db.session.add_all([world, stuff, here, contract, card, me])
+    db.session.commit()
+    game = actions.new_game(me, world)
+    actions.draw_card(game, me)
+    db.session.commit()
+
+    directory = str(tmpdir.join('export'))
+    counts = export(directory, batch=1)
+    assert counts == {'game': 1, 'player': 1, 'played_card': 1, 'hand': 1,
+                      'completed_contract': 0}
+    assert read_stream(directory, 'game') == [
+        {'id': game.id, 'world_id': world.id, 'world': 'world'}]
+    assert read_stream(directory, 'hand') == [
+        {'player_id': me.id, 'card_id': card.id}]
+
+    actions.complete_contract(me, contract.id)
+    actions.draw_card(game, me)
+    db.session.commit()
+    counts = export(directory, batch=1)
+    assert counts == {'game': 0, 'player': 1, 'played_card': 1, 'hand': 1,
+                      'completed_contract': 1}
+    assert [row['card_id'] for row in
+            read_stream(directory, 'played_card')] == [card.id, card.id]
+    assert read_stream(directory, 'completed_contract')[0]['amount'] == 5
+
+    counts = export(directory, full=True)
+    assert counts['game'] == 1
+
+
+def test_sharded_export_includes_primary(tmpdir):
+    app = make_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{!s}/crail.db'.format(tmpdir),
+        'SECRET_KEY': 'seeeekrit',
+        'TEST': True,
+        'CRAIL_SHARDS': 2,
+        'CRAIL_SHARD_DATABASE_URI': 'sqlite:///{!s}/shard-{{}}.db'
+                                    .format(tmpdir),
+    })
+    with app.app_context():
+        db.create_all()
+        world = World(name='world')
+        stuff = Good(name='stuff')
+        here = City(name='here', produces=[stuff], world=world)
+        kept = Contract(good=stuff, city=here, amount=3)
+        delivered = Contract(good=stuff, city=here, amount=5)
+        card = Card(number=1, contracts=[kept], world=world)
+        other = Card(number=2, contracts=[delivered], world=world)
+        me = Player(name='me', money=0)
+        db.session.add_all([world, stuff, here, kept, delivered, card,
+                            other, me])
+        db.session.commit()
+        game = actions.new_game(me, world)
+        actions.draw_card(game, me)
+        actions.draw_card(game, me)
+        actions.leave_game(me)
+        actions.complete_contract(me, delivered.id)
+        db.session.commit()
+
+        directory = str(tmpdir.join('export'))
+        counts = export(directory)
+        assert counts['hand'] == 1
+        assert counts['completed_contract'] == 1
+        assert read_stream(directory, 'hand') == [
+            {'player_id': me.id, 'card_id': card.id}]
+        with open(os.path.join(directory, WATERMARKS)) as marks:
+            watermarks = json.load(marks)
+        assert watermarks['completed_contract@primary'] == \
+            read_stream(directory, 'completed_contract')[0]['id']
@@ -0,0 +1,55 @@
+"""Unit tests for :mod:`crail.idempotency`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+
+from flask import url_for
+
+from crail.idempotency import HEADER, REPLAYED_HEADER
+from crail.models import ActionKey, db, World
+
+
+def post(client, name, data, key):
+    """Post JSON with an idempotency key."""
+    return client.post(url_for(name), data=json.dumps(data),
+                       content_type='application/json',
+                       headers={HEADER: key})
+
+
+def setup_game(client):
+    """Log in and start a game."""
+    db.session.add(World(name='world'))
+    db.session.commit()
+    post(client, 'crail.login', {'name': 'me'}, 'login')
+    response = post(client, 'crail.new_game', {'world': 1}, 'new')
+    assert response.status_code == 200
+
+
+def test_retry_applies_once(client):
+    setup_game(client)
+    response = post(client, 'crail.gain_money', {'amount': 5}, 'gain-1')
+    assert response.json['money'] == 5
+    assert REPLAYED_HEADER not in response.headers
+
+    response = post(client, 'crail.gain_money', {'amount': 5}, 'gain-1')
+    assert response.status_code == 200
+    assert response.json['money'] == 5
+    assert response.headers[REPLAYED_HEADER] == 'true'
+
+    response = post(client, 'crail.gain_money', {'amount': 5}, 'gain-2')
+    assert response.json['money'] == 10
+    assert ActionKey.query.count() == 3
+
+
+def test_failed_request_forgets_key(client):
+    setup_game(client)
+    response = post(client, 'crail.discard', {'card': 1}, 'discard')
+    assert response.status_code == 400
+    assert ActionKey.query.filter_by(key='discard').count() == 0
+
+    response = post(client, 'crail.gain_money', {'amount': 3}, 'discard')
+    assert response.status_code == 200
+    assert response.json['money'] == 3
+
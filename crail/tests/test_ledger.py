@@ -0,0 +1,52 @@
+"""Unit tests for :mod:`crail.ledger`.
+
+.. Copyright © 2015, David Maze
+
+"""
+from crail import ledger
+from crail.models import db, Game, MoneyEntry, MoneySnapshot, Player, World
+
+
+def test_balance_and_snapshots(app, client):
+    app.config['CRAIL_LEDGER_SNAPSHOT_INTERVAL'] = 3
+    player = Player(name='me', money=0)
+    db.session.add(player)
+    db.session.commit()
+    assert ledger.balance(player) == 0
+
+    for amount in range(1, 8):
+        ledger.record(player, 'gain', amount)
+    db.session.commit()
+    assert MoneyEntry.query.count() == 7
+    # Snapshots after the third and sixth entries
+    assert ([(s.entry_id, s.balance) for s in
+             MoneySnapshot.query.order_by(MoneySnapshot.id)] ==
+            [(3, 6), (6, 21)])
+    assert ledger.balance(player) == 28
+
+    ledger.record(player, 'spend', -8)
+    assert ledger.snapshot(player) == 20
+    db.session.commit()
+    assert MoneySnapshot.query.count() == 3
+    assert ledger.balance(player) == 20
+
+
+def test_totals_and_earned(client):
+    world = World(name='world')
+    game = Game(world=world)
+    me = Player(name='me', money=0, game=game)
+    you = Player(name='you', money=0, game=game)
+    db.session.add_all([world, game, me, you])
+    db.session.commit()
+
+    ledger.record(me, 'gain', 10)
+    ledger.record(me, 'spend', -4)
+    ledger.record(you, 'gain', 3)
+    ledger.record(you, 'gain', 2)
+    db.session.commit()
+
+    assert ledger.totals(game.id) == {me.id: {'gain': 10, 'spend': -4},
+                                      you.id: {'gain': 5}}
+    assert ledger.earned(game.id) == 15
+    assert ledger.earned(game.id, you.id) == 5
+    assert ledger.earned(game.id + 1) == 0
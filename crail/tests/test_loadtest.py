@@ -0,0 +1,48 @@
+"""Unit tests for :mod:`crail.loadtest`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from crail.benchmark import scratch_app
+from crail.models import Card, City, Contract, Game, Good, Player, World, db
+
+loadtest = pytest.importorskip('crail.loadtest')
+
+
+def test_ramp():
+    """Test a short ramp of bots against a live server."""
+    with scratch_app(CRAIL_ADMISSION_LIMIT=0) as app:
+        with app.app_context():
+            world = World.query.one()
+            good = Good(name='stuff')
+            city = City(name='here', produces=[good], world=world)
+            db.session.add_all([
+                Card(number=number, world=world,
+                     contracts=[Contract(good=good, city=city, amount=5)])
+                for number in range(1, 3)])
+            db.session.add(Card(number=3, world=world, event='Storm'))
+            db.session.commit()
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            results = loadtest.run(
+                'http://127.0.0.1:{}'.format(server.server_port), [2, 6],
+                stage=1.0, table_size=3, think=0.05)
+        finally:
+            server.shutdown()
+            thread.join()
+
+        assert [summary['bots'] for summary in results] == [2, 6]
+        assert [summary['tables'] for summary in results] == [1, 2]
+        assert all(summary['requests'] > 0 for summary in results)
+        with app.app_context():
+            assert Game.query.count() == 2
+            assert Player.query.filter(Player.game_id.isnot(None)).count() \
+                == 6
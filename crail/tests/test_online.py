@@ -0,0 +1,66 @@
+"""Unit tests for :mod:`crail.online`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import sqlite3
+
+from crail.manage import make_manage_app, upgrade_database as upgrade
+from crail.online import PROGRESS_TABLE
+
+#: Revision just before the batched index migration.
+BEFORE = '8e2f6a4c9d17'
+
+
+def _names(path):
+    """List the tables and indexes in a SQLite database."""
+    with sqlite3.connect(path) as connection:
+        return {name for name, in connection.execute(
+            'SELECT name FROM sqlite_master')}
+
+
+def test_rebuild(tmpdir):
+    """Test the batched index migration, dry and for real."""
+    path = str(tmpdir.join('crail.db'))
+    app = make_manage_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(path),
+        'SECRET_KEY': 'seeeekrit',
+        'CRAIL_ONLINE_PAUSE': 0,
+    })
+    with app.app_context():
+        upgrade(revision=BEFORE)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO played_card (game_id, card_id) VALUES (?, ?)',
+        [(number % 7, number) for number in range(1, 2501)])
+    connection.executemany(
+        'INSERT INTO player_card (player_id, card_id) VALUES (?, ?)',
+        [(number % 5, number) for number in range(1, 1001)])
+    connection.execute('DELETE FROM played_card WHERE id % 10 = 0')
+    connection.commit()
+    played = connection.execute(
+        'SELECT id, game_id, card_id FROM played_card ORDER BY id').fetchall()
+
+    with app.app_context():
+        upgrade(x_arg=['dry_run=1'])
+    assert connection.execute(
+        'SELECT version_num FROM alembic_version').fetchall() == [(BEFORE,)]
+    names = _names(path)
+    assert 'ix_played_card_game_id' not in names
+    assert '_online_played_card' not in names
+    assert '_online_played_card_insert' not in names
+    assert PROGRESS_TABLE not in names
+
+    with app.app_context():
+        upgrade(x_arg=['batch=300'])
+    names = _names(path)
+    assert {'ix_played_card_game_id', 'ix_player_card_player_id'} <= names
+    assert '_online_played_card' not in names
+    assert PROGRESS_TABLE not in names
+    assert connection.execute(
+        'SELECT id, game_id, card_id FROM played_card ORDER BY id'
+    ).fetchall() == played
+    assert connection.execute(
+        'SELECT COUNT(*) FROM player_card WHERE player_id = 3'
+    ).fetchone() == (200,)
+    connection.close()
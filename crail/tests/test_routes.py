@@ -7,6 +7,7 @@ import json
 
 from flask import url_for
 
+from crail import metrics
 from crail.models import Card, City, Contract, db, Good, World
 
 
@@ -33,6 +34,15 @@ def test_index(client):
     assert response.mimetype == 'text/html'
 
 
+def test_service_worker(app, client):
+    # Serve prebuilt bundles rather than building them in debug mode
+    app.config['CRAIL_ASSETS_AUTO_BUILD'] = False
+    response = client.get(url_for('crail.service_worker'))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/javascript'
+    assert 'packed.js' in response.get_data(as_text=True)
+
+
 def test_state_initial(client):
     """Test the initial state is valid."""
     response = client.get(url_for('crail.state'))
@@ -187,7 +197,13 @@ def test_draw_discard_one_event(client):
                              'cards': [{'id': 1, 'number': 123,
                                         'event': 'oh noes!'}]}
 
-    response = post_json(client, 'crail.discard', {'card': 2})
+    # Discarding a card you don't have is an error
+    response = client.post(url_for('crail.discard'),
+                           data=json.dumps({'card': 2}),
+                           content_type='application/json')
+    assert response.status_code == 400
+
+    response = client.get(url_for('crail.state'))
     assert response.json == {'player_id': 1,
                              'player_name': 'me',
                              'game': 'world',
@@ -263,3 +279,161 @@ def test_draw_complete_two_contracts(client):
                              'money': 7,
                              'cards': [{'id': 2, 'number': 2,
                                         'event': 'FOO!'}]}
+
+    # That card is gone now, as is a contract that never existed
+    for contract_id in (1, 99):
+        response = client.post(url_for('crail.complete'),
+                               data=json.dumps({'contract': contract_id}),
+                               content_type='application/json')
+        assert response.status_code == 400
+
+
+def test_metrics(app, client):
+    """Test that state reads are counted in the metrics."""
+    bootstrap_world(client, world=None)
+    response = client.get(url_for('crail.metrics'))
+    assert response.status_code == 404
+
+    app.config['CRAIL_METRICS_PUBLIC'] = True
+    response = client.get(url_for('crail.metrics'))
+    assert response.status_code == 200
+    counters = response.json['counters']
+    assert counters['lobby.leader'] >= 1
+    assert counters['state.leader'] >= 1
+
+
+def test_history(client):
+    """Test paging backwards through the game history."""
+    response = client.get(url_for('crail.history'))
+    assert response.status_code == 400
+
+    bootstrap_world(client, world=None)
+    for amount in range(1, 6):
+        post_json(client, 'crail.gain_money', {'amount': amount})
+
+    # new, join, and five gains
+    response = client.get(url_for('crail.history', limit=3))
+    assert response.status_code == 200
+    page = response.json
+    assert [event['seq'] for event in page['events']] == [7, 6, 5]
+    assert page['events'][0]['kind'] == 'gain'
+    assert page['events'][0]['player'] == 'me'
+    assert page['events'][0]['data'] == {'amount': 5}
+    assert page['events'][0]['time'].endswith('Z')
+    assert page['next'] == 5
+
+    response = client.get(url_for('crail.history', limit=3,
+                                  before=page['next']))
+    page = response.json
+    assert [event['seq'] for event in page['events']] == [4, 3, 2]
+    response = client.get(url_for('crail.history', limit=3,
+                                  before=page['next']))
+    page = response.json
+    assert [event['kind'] for event in page['events']] == ['new']
+    assert page['next'] is None
+
+
+def test_state_version(client):
+    """Test that in-game states say which game version they show."""
+    bootstrap_world(client, world=None)
+    response = client.get(url_for('crail.state'))
+    game, seq = response.headers['X-Crail-Version'].split(':')
+    assert game == '1'
+
+    response = post_json(client, 'crail.gain_money', {'amount': 5})
+    assert response.headers['X-Crail-Version'] == '1:{}'.format(int(seq) + 1)
+
+    post_json(client, 'crail.leave_game', {})
+    response = client.get(url_for('crail.state'))
+    assert 'X-Crail-Version' not in response.headers
+
+
+def test_lobby_cache(client):
+    """Test that the lobby listing is only rebuilt when it changes."""
+    world = World(name='world')
+    db.session.add(world)
+    db.session.commit()
+    post_json(client, 'crail.login', {'name': 'me'})
+    metrics.reset()
+
+    for _ in range(3):
+        response = client.get(url_for('crail.state'))
+        assert response.json['worlds'] == [{'id': 1, 'name': 'world'}]
+    counters = metrics.snapshot()['counters']
+    assert counters['lobby.hit'] == 3
+    assert 'lobby.miss' not in counters
+
+    post_json(client, 'crail.new_game', {'world': 1})
+    response = post_json(client, 'crail.leave_game', {})
+    assert response.json['games'] == [{'id': 1, 'world': 'world',
+                                       'players': []}]
+    assert metrics.snapshot()['counters']['lobby.miss'] == 1
+
+
+def test_table(client):
+    """Test the table view of every hand in a game."""
+    response = client.get(url_for('crail.table'))
+    assert response.status_code == 400
+
+    world = World(name='world')
+    db.session.add(world)
+    card = Card(number=123, event='oh noes!', world=world)
+    db.session.add(card)
+    db.session.commit()
+    bootstrap_world(client, world)
+    post_json(client, 'crail.draw', {})
+    post_json(client, 'crail.gain_money', {'amount': 5})
+    post_json(client, 'crail.logout', {})
+    post_json(client, 'crail.login', {'name': 'you'})
+    post_json(client, 'crail.join_game', {'game': 1})
+    metrics.reset()
+
+    expected = {'id': 1, 'game': 'world', 'players': [
+        {'id': 1, 'name': 'me',
+         'cards': [{'id': 1, 'number': 123, 'event': 'oh noes!'}]},
+        {'id': 2, 'name': 'you', 'cards': []},
+    ]}
+    for _ in range(2):
+        response = client.get(url_for('crail.table'))
+        assert response.status_code == 200
+        assert response.json == expected
+    counters = metrics.snapshot()['counters']
+    assert counters['table.miss'] == 1
+    assert counters['table.hit'] == 1
+
+    post_json(client, 'crail.logout', {})
+    response = client.get(url_for('crail.table', game=1, money=1))
+    assert [player['money'] for player in response.json['players']] == [5, 0]
+    assert response.headers['X-Crail-Version'] == '1:5'
+
+
+def test_fill(client):
+    """Test drawing up to the hand size."""
+    world = World(name='world')
+    good = Good(name='stuff')
+    city = City(name='here', produces=[good], world=world)
+    contract = Contract(good=good, city=city, amount=5)
+    db.session.add_all([world, good, city, contract])
+    db.session.add_all([Card(number=n, contracts=[contract], world=world)
+                        for n in range(1, 4)])
+    db.session.add(Card(number=4, event='FOO!', world=world))
+    db.session.commit()
+    bootstrap_world(client, world)
+
+    # No hand size yet
+    response = client.post(url_for('crail.fill'), data='{}',
+                           content_type='application/json')
+    assert response.status_code == 400
+
+    world.hand_size = 3
+    db.session.commit()
+    response = post_json(client, 'crail.fill', {})
+    cards = response.json['cards']
+    assert len([card for card in cards if 'contracts' in card]) == 3
+    assert response.json['events'] == [card for card in cards
+                                       if 'event' in card]
+
+    # Already full
+    response = post_json(client, 'crail.fill', {})
+    assert response.json['events'] == []
+    assert response.json['cards'] == cards
@@ -0,0 +1,131 @@
+"""Unit tests for :mod:`crail.routing`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+
+import pytest
+from flask import url_for
+from sqlalchemy import event
+
+from crail.app import make_app
+from crail.models import Card, db, World
+from crail.routing import EXTENSION
+
+
+@pytest.fixture
+def app(tmpdir):
+    """Application with an SQLite read-only pool."""
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{!s}/crail.db'.format(tmpdir),
+        'SECRET_KEY': 'seeeekrit',
+        'DEBUG': True,
+        'TEST': True,
+        'CRAIL_READ_REPLICA': True,
+    }
+    app = make_app(config)
+    with app.app_context():
+        db.create_all()
+        db.session.commit()
+    return app
+
+
+def test_state_reads_from_replica(app, client):
+    statements = []
+    event.listen(app.extensions[EXTENSION], 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+
+    response = client.post(url_for('crail.login'),
+                           data=json.dumps({'name': 'me'}),
+                           content_type='application/json')
+    assert response.status_code == 200
+    assert statements == []
+
+    # Immediately after a write, read your own writes from the primary
+    response = client.get(url_for('crail.state'))
+    assert response.json['player_name'] == 'me'
+    assert statements == []
+
+    app.config['CRAIL_READ_AFTER_WRITE'] = 0
+    response = client.get(url_for('crail.state'))
+    assert response.json['player_name'] == 'me'
+    assert statements != []
+    with db.engine.connect() as connection:
+        mode = connection.execute('PRAGMA journal_mode').scalar()
+    assert mode == 'wal'
+
+
+def test_replica_is_read_only(app, client):
+    with app.extensions[EXTENSION].connect() as connection:
+        with pytest.raises(Exception):
+            connection.execute('CREATE TABLE oops (x INTEGER)')
+
+
+@pytest.fixture
+def sharded_app(tmpdir):
+    """Application with two hash-partitioned shards."""
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{!s}/crail.db'.format(tmpdir),
+        'SECRET_KEY': 'seeeekrit',
+        'DEBUG': True,
+        'TEST': True,
+        'CRAIL_SHARDS': 2,
+        'CRAIL_SHARD_DATABASE_URI': 'sqlite:///{!s}/shard-{{}}.db'
+                                    .format(tmpdir),
+    }
+    app = make_app(config)
+    with app.app_context():
+        db.create_all()
+        world = World(name='world')
+        db.session.add_all([world,
+                            Card(number=1, event='one', world=world),
+                            Card(number=2, event='two', world=world)])
+        db.session.commit()
+    return app
+
+
+def post(client, path, data):
+    """Post JSON and return the JSON response."""
+    response = client.post(path, data=json.dumps(data),
+                           content_type='application/json')
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True))
+
+
+def count_rows(app, game_id, table):
+    """Count rows of a table in the primary and in a game's shard."""
+    query = 'SELECT COUNT(*) FROM {}'.format(table)
+    with db.get_engine(app).connect() as connection:
+        primary = connection.execute(query).scalar()
+    with db.get_shard_engine(app, game_id).connect() as connection:
+        shard = connection.execute(query).scalar()
+    return primary, shard
+
+
+def test_game_state_lives_in_shard(sharded_app):
+    client = sharded_app.test_client()
+    post(client, '/api/login', {'name': 'me'})
+    post(client, '/api/gain', {'amount': 3})
+    post(client, '/api/game/new', {'world': 1})
+    post(client, '/api/draw', {})
+    state = post(client, '/api/gain', {'amount': 4})
+    assert state['money'] == 7
+    assert len(state['cards']) == 1
+
+    assert db.get_shard_engine(sharded_app, 1).url.database.endswith(
+        'shard-1.db')
+    assert count_rows(sharded_app, 1, 'player_card') == (0, 1)
+    assert count_rows(sharded_app, 1, 'played_card') == (0, 1)
+    # gain before the game, then move in, then gain in the game
+    assert count_rows(sharded_app, 1, 'money_entry') == (2, 2)
+    assert count_rows(sharded_app, 1, 'game_event')[0] == 0
+
+    # Leaving brings the hand and money back to the primary
+    post(client, '/api/game/leave', {})
+    assert count_rows(sharded_app, 1, 'player_card') == (1, 0)
+    state = post(client, '/api/game/join', {'game': 1})
+    assert state['money'] == 7
+    assert len(state['cards']) == 1
+    state = post(client, '/api/discard', {'card': state['cards'][0]['id']})
+    assert state['cards'] == []
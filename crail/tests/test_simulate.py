@@ -0,0 +1,43 @@
+"""Unit tests for :mod:`crail.simulate`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import pytest
+
+from crail.models import Card, City, Contract, db, Good, World
+
+simulate = pytest.importorskip('crail.simulate')
+
+
+def test_reshuffle_semantics(client):
+    world = World(name='world')
+    stuff = Good(name='stuff')
+    here = City(name='here', produces=[stuff], world=world)
+    there = City(name='there', world=world)
+    cards = [Card(number=1, world=world,
+                  contracts=[Contract(good=stuff, city=here, amount=5),
+                             Contract(good=stuff, city=there, amount=8)]),
+             Card(number=2, event='oh noes!', world=world),
+             Card(number=3, world=world,
+                  contracts=[Contract(good=stuff, city=here, amount=2)])]
+    db.session.add_all([world, stuff, here, there] + cards)
+    db.session.commit()
+
+    deck = simulate.Deck(world)
+    assert len(deck) == 3
+    assert deck.goods == ['stuff']
+    assert deck.cities == ['here', 'there']
+
+    # Two full passes through the deck: every card exactly twice
+    results = simulate.simulate(deck, 100, 6, 2, seed=1, chunk=30)
+    assert (results['events'] == 2).all()
+    assert (results['good_payouts'] == [[30]]).all()
+    assert (results['city_payouts'] == [[14, 16]]).all()
+    assert (results['hand_value'] == 10).all()
+
+    # A single draw is equally likely to be any card
+    results = simulate.simulate(deck, 3000, 1, 1, seed=1)
+    assert 800 < (results['events'] == 1).sum() < 1200
+    with pytest.raises(ValueError):
+        simulate.simulate(simulate.Deck(World(name='empty')), 1, 1, 1)
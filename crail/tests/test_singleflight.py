@@ -0,0 +1,61 @@
+"""Unit tests for :mod:`crail.singleflight`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import threading
+
+import pytest
+
+from crail import metrics
+from crail.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_result():
+    metrics.reset()
+    flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'result'
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(flight.do('key', work)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(
+        target=lambda: results.append(flight.do('key', work)))
+        for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    # Wait until every follower is parked on the leader's call
+    while metrics.snapshot()['counters'].get('test.shared', 0) < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert results == ['result'] * 4
+    assert calls == [1]
+    assert metrics.snapshot()['counters'] == {'test.leader': 1,
+                                              'test.shared': 3}
+
+    # Nothing is remembered afterwards
+    assert flight.do('key', lambda: 'again') == 'again'
+
+
+def test_errors_propagate():
+    flight = SingleFlight('test')
+
+    def fail():
+        raise ValueError('nope')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'fine') == 'fine'
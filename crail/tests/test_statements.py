@@ -0,0 +1,68 @@
+"""Unit tests for :mod:`crail.statements`.
+
+.. Copyright © 2015, David Maze
+
+"""
+from sqlalchemy import bindparam, select
+
+from crail import actions, statements
+from crail.app import make_app
+from crail.models import Card, db, Player, World
+
+
+def test_statement(app):
+    """Test that a statement compiles once and runs many times."""
+    worlds = World.__table__
+    statement = statements.Statement(
+        select([worlds.c.name]).where(worlds.c.id == bindparam('world_id')))
+    with app.app_context():
+        db.session.add_all([World(name='One'), World(name='Two')])
+        db.session.commit()
+        assert statement.execute(world_id=1).scalar() == 'One'
+        assert statement.execute(world_id=2).scalar() == 'Two'
+        assert statement.execute(world_id=3).scalar() is None
+        # pylint: disable=protected-access
+        assert len(statement._compiled) == 1
+
+
+def test_statement_shared_by_shards(tmpdir):
+    """Test that per-game shards do not each compile their own copy."""
+    app = make_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{!s}/crail.db'.format(tmpdir),
+        'SECRET_KEY': 'seeeekrit',
+        'TEST': True,
+        'CRAIL_SHARDS': 'game',
+        'CRAIL_SHARD_DATABASE_URI': 'sqlite:///{!s}/shard-{{}}.db'
+                                    .format(tmpdir),
+    })
+    # pylint: disable=protected-access
+    with app.app_context():
+        db.create_all()
+        world = World(name='world')
+        me = Player(name='me', money=0)
+        db.session.add_all([world, me] +
+                           [Card(number=n, event='card', world=world)
+                            for n in range(1, 4)])
+        db.session.commit()
+        sizes = []
+        for _ in range(5):
+            game = actions.new_game(me, world)
+            actions.draw_card(game, me)
+            actions.hand_ids(me)
+            db.session.commit()
+            sizes.append((len(actions._hand._compiled),
+                          len(actions._played._compiled)))
+        assert sizes == [sizes[0]] * 5
+
+
+def test_get(app):
+    """Test the cached primary-key lookup."""
+    with app.app_context():
+        db.session.add(World(name='One'))
+        db.session.commit()
+        world = statements.get(World, 1)
+        assert world.name == 'One'
+        assert statements.get(World, 1) is world
+        db.session.expunge_all()
+        assert statements.get(World, 1).name == 'One'
+        assert statements.get(World, 2) is None
@@ -0,0 +1,62 @@
+"""Unit tests for :mod:`crail.traffic`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+
+from crail import traffic
+from crail.benchmark import scratch_app
+
+
+def _play(app, name):
+    """Log in, start a game, and make some moves."""
+    client = app.test_client()
+    for path, data in (('/api/login', {'name': name}),
+                       ('/api/game/new', {'world': 1}),
+                       ('/api/gain', {'amount': 5}),
+                       ('/api/spend', {})):
+        client.post(path, data=json.dumps(data),
+                    content_type='application/json')
+    client.get('/api/state')
+
+
+def test_record(tmpdir):
+    """Test that requests are recorded, sanitized, and rotated."""
+    path = str(tmpdir.join('traffic.jsonl'))
+    with scratch_app(CRAIL_TRAFFIC_LOG=path, CRAIL_TRAFFIC_MAX_BYTES=1000,
+                     CRAIL_TRAFFIC_BACKUPS=1) as app:
+        _play(app, 'Alice')
+        _play(app, 'Alice')
+        app.extensions[traffic.EXTENSION].close()
+
+    assert tmpdir.join('traffic.jsonl.1').check()
+    assert not tmpdir.join('traffic.jsonl.2').check()
+    assert 'Alice' not in tmpdir.join('traffic.jsonl.1').read()
+    records = traffic.read([path + '.1', path])
+    assert [record['endpoint'] for record in records[-5:]] == [
+        'crail.login', 'crail.new_game', 'crail.gain_money',
+        'crail.spend_money', 'crail.state']
+    login, _, gain, spend, _ = records[-5:]
+    assert login['player'] is None and login['then'] == 1
+    assert login['body']['name'].startswith('anon-')
+    assert gain['body'] == {'amount': 5}
+    assert (gain['status'], spend['status']) == (200, 400)
+
+
+def test_replay(tmpdir):
+    """Test replaying a recording against a fresh database."""
+    path = str(tmpdir.join('traffic.jsonl'))
+    with scratch_app(CRAIL_TRAFFIC_LOG=path) as app:
+        _play(app, 'Alice')
+        _play(app, 'Bob')
+        app.extensions[traffic.EXTENSION].close()
+    records = traffic.read([path])
+
+    with scratch_app() as app:
+        results = traffic.replay(app, records, concurrency=2)
+    summary = traffic.summarize(results)
+    assert len(results) == 10
+    assert summary['crail.gain_money']['count'] == 2
+    assert all(row['changed'] == 0 and row['errors'] == 0
+               for row in summary.values())
@@ -0,0 +1,40 @@
+"""Unit tests for :mod:`crail.wsgi`.
+
+.. Copyright © 2015, David Maze
+
+"""
+import json
+import subprocess
+import sys
+
+#: Modules only needed by :mod:`crail.manage`, never to serve requests.
+MANAGE_ONLY = ['alembic', 'cssmin', 'flask_assets', 'flask_migrate',
+               'flask_script', 'rjsmin', 'webassets', 'yaml']
+
+#: Upper bound on the time to import :mod:`crail.wsgi`, in seconds.
+IMPORT_BUDGET = 1.5
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import crail.wsgi
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+'''
+
+
+def probe():
+    """Import :mod:`crail.wsgi` in a fresh interpreter."""
+    output = subprocess.check_output([sys.executable, '-c', PROBE])
+    return json.loads(output.decode('utf-8'))
+
+
+def test_no_manage_imports():
+    modules = set(probe()['modules'])
+    assert [name for name in MANAGE_ONLY if name in modules] == []
+
+
+def test_import_budget():
+    # Take the best of a few runs to ride out a busy machine.
+    elapsed = min(probe()['elapsed'] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET
@@ -0,0 +1,372 @@
+"""Recording and replaying real traffic.
+
+.. Copyright © 2015, David Maze
+
+Synthetic benchmarks like :mod:`crail.benchmark` only send the actions
+someone thought to write down.  To measure a build against the mix of
+actions people actually make, set
+:data:`crail.settings.CRAIL_TRAFFIC_LOG` to a file name and every
+``/api/`` request is recorded there as one line of JSON:
+
+.. code-block:: json
+
+   {"time": 1445270400.25, "method": "POST", "path": "/api/gain",
+    "query": "", "endpoint": "crail.gain_money", "body": {"amount": 5},
+    "key": "...", "player": 3, "then": 3, "status": 200, "ms": 4.1}
+
+`player` and `then` are the session's player ID before and after the
+request, `key` is its idempotency key (see :mod:`crail.idempotency`),
+and `ms` is how long it took.  Nothing else from the request is kept;
+in particular there are no cookies or addresses, and the values of the
+body fields named in :data:`crail.settings.CRAIL_TRAFFIC_REDACT`
+(player names, by default) are replaced by a keyed hash, so the same
+name always becomes the same stand-in.  The file is rotated like a log
+file once it passes :data:`crail.settings.CRAIL_TRAFFIC_MAX_BYTES`,
+keeping :data:`crail.settings.CRAIL_TRAFFIC_BACKUPS` old copies.  A
+``{pid}`` in the file name is replaced by the process ID, so that
+several worker processes do not write the same file.
+
+``crail_manage replay-traffic`` loads worlds into a scratch database,
+sends the recorded requests to the current build in-process, and
+reports each endpoint's latency and errors next to the recorded ones
+(or those of an earlier replay), so two builds can be compared on the
+same traffic:
+
+.. code-block:: sh
+
+   crail_manage replay-traffic --world game.yaml --speed max \\
+       --concurrency 8 --save before.json traffic.jsonl*
+   git checkout new-build
+   crail_manage replay-traffic --world game.yaml --speed max \\
+       --concurrency 8 --baseline before.json traffic.jsonl*
+
+Requests are replayed one client at a time in their original order,
+each client with its own session; a client that was already logged in
+when recording started is logged in under a made-up name first.  Game
+and world IDs are sent as recorded, so load the same worlds in the
+same order, and prefer traces that start on a fresh server.  Clients
+are only kept in step with each other when replaying at a recorded
+pace; at full speed one client can, say, try to join a game another
+has not created yet, which shows up as a changed status.
+
+.. autoclass:: Recorder
+   :members:
+.. autofunction:: init_app
+.. autofunction:: percentile
+.. autofunction:: read
+.. autofunction:: replay
+.. autofunction:: summarize
+
+"""
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import os
+import threading
+import time
+
+from flask import g, request, session
+
+from .idempotency import HEADER as KEY_HEADER
+
+#: Key of the recorder in the Flask application's extensions.
+EXTENSION = 'crail_traffic'
+
+
+class Recorder(object):
+    """A JSON-lines file that rotates itself.
+
+    :param str path: name of the file
+    :param int max_bytes: size past which the file is rotated
+    :param int backups: number of rotated files to keep
+
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        """Append one record.
+
+        :param dict record: JSON-serializable record
+
+        """
+        line = json.dumps(record, sort_keys=True,
+                          separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if self.max_bytes and self.file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        """Move the current file aside and start a new one."""
+        self.file.close()
+        for number in range(self.backups - 1, 0, -1):
+            older = '{}.{}'.format(self.path, number)
+            if os.path.exists(older):
+                os.replace(older, '{}.{}'.format(self.path, number + 1))
+        if self.backups:
+            os.replace(self.path, '{}.1'.format(self.path))
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        """Close the file."""
+        with self.lock:
+            self.file.close()
+
+
+def _sanitize(value, fields, secret):
+    """Replace the values of sensitive fields in a request body."""
+    if isinstance(value, dict):
+        return {key: (_pseudonym(item, secret)
+                      if key in fields and isinstance(item, str)
+                      else _sanitize(item, fields, secret))
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_sanitize(item, fields, secret) for item in value]
+    return value
+
+
+def _pseudonym(value, secret):
+    """Get a stable stand-in for a sensitive string."""
+    digest = hmac.new(secret, value.encode('utf-8'), hashlib.sha256)
+    return 'anon-{}'.format(digest.hexdigest()[:12])
+
+
+def _start(app):
+    """Note what a request looks like before it runs."""
+    if not request.path.startswith('/api/'):
+        return
+    g.crail_trace = {
+        'time': time.time(),
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('utf-8', 'replace'),
+        'endpoint': request.endpoint,
+        'body': _sanitize(request.get_json(silent=True),
+                          app.config['CRAIL_TRAFFIC_REDACT'],
+                          str(app.config['SECRET_KEY']).encode('utf-8')),
+        'key': request.headers.get(KEY_HEADER),
+        'player': session.get('player_id'),
+        'start': time.perf_counter(),
+    }
+
+
+def _finish(recorder, status):
+    """Record a request once it has run."""
+    record = g.pop('crail_trace', None)
+    if record is None:
+        return
+    record['ms'] = round((time.perf_counter() - record.pop('start')) * 1000,
+                         3)
+    record['status'] = status
+    record['then'] = session.get('player_id')
+    recorder.write(record)
+
+
+def init_app(app):
+    """Record an application's traffic, if that is enabled.
+
+    Call this before anything else that can answer a request early, so
+    that those answers are recorded too.
+
+    :param app: the Flask application
+
+    """
+    path = app.config['CRAIL_TRAFFIC_LOG']
+    if not path:
+        return
+    recorder = app.extensions[EXTENSION] = Recorder(
+        path.format(pid=os.getpid()),
+        app.config['CRAIL_TRAFFIC_MAX_BYTES'],
+        app.config['CRAIL_TRAFFIC_BACKUPS'])
+
+    @app.before_request
+    def start():  # pylint: disable=unused-variable
+        """Start timing the request."""
+        _start(app)
+
+    @app.after_request
+    def status(response):  # pylint: disable=unused-variable
+        """Remember the response status."""
+        if 'crail_trace' in g:
+            g.crail_trace['status'] = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish(exc=None):  # pylint: disable=unused-variable
+        """Write the record."""
+        if 'crail_trace' in g:
+            default = 200 if exc is None else 500
+            _finish(recorder, g.crail_trace.pop('status', default))
+
+
+def read(paths):
+    """Read recorded requests.
+
+    :param paths: names of files written by :class:`Recorder`, in
+      any order
+    :return: list of record dictionaries, oldest first
+
+    """
+    records = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as trace:
+            for line in trace:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # a line cut off by a crash
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+def _clients(records):
+    """Split records into the streams of each client, in order."""
+    streams, owners = [], {}
+    for record in records:
+        player = record.get('player')
+        stream = owners.get(player) if player is not None else None
+        if stream is None:
+            stream = []
+            streams.append(stream)
+            if player is not None:
+                owners[player] = stream
+        stream.append(record)
+        if record.get('then') is not None:
+            owners[record['then']] = stream
+    return streams
+
+
+def _send(client, record):
+    """Send one recorded request, returning the response status."""
+    headers = {}
+    if record.get('key'):
+        headers[KEY_HEADER] = record['key']
+    kwargs = {}
+    if record.get('body') is not None:
+        kwargs = {'data': json.dumps(record['body']),
+                  'content_type': 'application/json'}
+    response = client.open(record['path'], method=record['method'],
+                           query_string=record.get('query', ''),
+                           headers=headers, **kwargs)
+    response.close()
+    return response.status_code
+
+
+def _worker(app, streams, origin, speed, results):
+    """Replay some clients' requests, interleaved in time order."""
+    clients = []
+    for stream in streams:
+        client = app.test_client()
+        player = stream[0].get('player')
+        if player is not None:
+            client.post('/api/login', content_type='application/json',
+                        data=json.dumps({'name': 'replay-{}'.format(player)}))
+        clients.append(client)
+    ordered = heapq.merge(*[[(record['time'], index, number, record)
+                             for number, record in enumerate(stream)]
+                            for index, stream in enumerate(streams)])
+    start = time.perf_counter()
+    for when, index, _, record in ordered:
+        if speed is not None:
+            delay = start + (when - origin) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent = time.perf_counter()
+        try:
+            status = _send(clients[index], record)
+        except Exception:  # pylint: disable=broad-except
+            status = 500
+        results.append((record.get('endpoint'),
+                        (time.perf_counter() - sent) * 1000, status,
+                        record.get('ms'), record.get('status')))
+
+
+def replay(app, records, speed=None, concurrency=1):
+    """Send recorded requests to an application.
+
+    :param app: the Flask application, usually with a scratch database
+    :param list records: records from :func:`read`
+    :param float speed: multiple of the recorded pace, or
+      :const:`None` to send requests as fast as possible
+    :param int concurrency: number of clients sending at once
+    :return: list of tuples of endpoint, replayed milliseconds,
+      replayed status, recorded milliseconds, and recorded status
+
+    """
+    if not records:
+        return []
+    streams = _clients(records)
+    concurrency = max(1, min(concurrency, len(streams)))
+    origin = records[0]['time']
+    results = []
+    threads = [threading.Thread(target=_worker,
+                                args=(app, streams[number::concurrency],
+                                      origin, speed, results))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(values, fraction):
+    """Get a nearest-rank percentile of some values.
+
+    :param values: sequence of numbers
+    :param float fraction: percentile, between 0 and 1
+    :return: the percentile, or :const:`None` if there are no values
+
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _endpoint(result):
+    """Get the endpoint of a replayed request, for sorting."""
+    return result[0] or ''
+
+
+def summarize(results):
+    """Summarize replayed requests by endpoint.
+
+    Server errors are responses of 500 and up; `changed` counts
+    responses whose status differs from the recorded one.
+
+    :param list results: tuples from :func:`replay`
+    :return: dictionary mapping endpoint to a dictionary of `count`,
+      `p50`, `p95`, `errors`, `changed`, `recorded_p50`,
+      `recorded_p95`, and `recorded_errors`
+
+    """
+    summary = {}
+    for endpoint, group in itertools.groupby(
+            sorted(results, key=_endpoint), key=_endpoint):
+        group = list(group)
+        recorded = [result[3] for result in group if result[3] is not None]
+        summary[endpoint] = {
+            'count': len(group),
+            'p50': percentile([result[1] for result in group], 0.50),
+            'p95': percentile([result[1] for result in group], 0.95),
+            'errors': sum(1 for result in group if result[2] >= 500),
+            'changed': sum(1 for result in group if result[4] is not None
+                           and result[2] != result[4]),
+            'recorded_p50': percentile(recorded, 0.50),
+            'recorded_p95': percentile(recorded, 0.95),
+            'recorded_errors': sum(1 for result in group
+                                   if (result[4] or 0) >= 500),
+        }
+    return summary
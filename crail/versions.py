@@ -0,0 +1,87 @@
+"""Version numbers for shared state.
+
+.. Copyright © 2015, David Maze
+
+A version number changes whenever the state it covers changes, so it
+can key caches and :mod:`crail.singleflight` calls.
+
+* A game's version is the sequence number of the last event in its
+  :mod:`crail.events` log, which covers every player's hand and money
+  in the game.
+
+* The lobby version is a :class:`crail.models.Counter` bumped whenever
+  the list of games, their players, or the list of worlds changes.
+
+Bumping does not commit.  :func:`lobby_bumps` counts the bumps made
+by this process, so a per-process cache can notice its own writes
+without waiting to poll the counter (see :mod:`crail.lobby`).
+
+.. autofunction:: bump_lobby
+.. autofunction:: game_version
+.. autofunction:: lobby_bumps
+.. autofunction:: lobby_version
+
+"""
+import itertools
+
+from sqlalchemy import bindparam, func, select
+
+from .models import Counter, GameEvent, db
+from .statements import Statement
+
+counters = Counter.__table__  # pylint: disable=invalid-name
+events = GameEvent.__table__  # pylint: disable=invalid-name
+
+#: Name of the lobby :class:`crail.models.Counter`.
+LOBBY = 'lobby'
+
+_game_version = Statement(  # pylint: disable=invalid-name
+    select([func.coalesce(func.max(events.c.seq), 0)])
+    .where(events.c.game_id == bindparam('game_id')))
+
+_lobby_version = Statement(  # pylint: disable=invalid-name
+    select([counters.c.value]).where(counters.c.name == LOBBY))
+
+_bumps = itertools.count(1)  # pylint: disable=invalid-name
+_last_bump = 0  # pylint: disable=invalid-name
+
+
+def game_version(game_id):
+    """Get the current version of a game.
+
+    :param int game_id: identifier of the game
+    :return: integer version, 0 if nothing has happened yet
+
+    """
+    with db.shard(game_id):
+        return _game_version.execute(game_id=game_id).scalar()
+
+
+def lobby_version():
+    """Get the current version of the lobby.
+
+    :return: integer version
+
+    """
+    return _lobby_version.execute().scalar() or 0
+
+
+def lobby_bumps():
+    """Count the lobby bumps made by this process.
+
+    :return: integer that increases on every :func:`bump_lobby`
+
+    """
+    return _last_bump
+
+
+def bump_lobby():
+    """Note that the lobby has changed."""
+    global _last_bump  # pylint: disable=global-statement,invalid-name
+    _last_bump = next(_bumps)
+    result = db.session.execute(
+        counters.update()
+        .where(counters.c.name == LOBBY)
+        .values(value=counters.c.value + 1))
+    if not result.rowcount:
+        db.session.execute(counters.insert().values(name=LOBBY, value=1))
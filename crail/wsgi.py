@@ -4,21 +4,34 @@
 
 Pass this module to WSGI runners, like :mod:`uwsgi` or :mod:`gunicorn`.
 
+The application is created on the first request, not at import time,
+and then reused.  Nothing only needed for management (migrations, asset
+building, YAML loading, the command line) is imported on this path.
+
 .. autofunction:: application
 
 """
+import threading
+
 from .app import make_app
 
+_app = None  # pylint: disable=invalid-name
+_app_lock = threading.Lock()  # pylint: disable=invalid-name
+
 
 def application(environ, start_response):
     """WSGI entry point.
 
-    Creates and runs the application.
+    Creates the application if needed, and runs it.
 
     :param dict environ: WSGI environment dictionary
     :param start_response: WSGI completion callback
     :return: Iterable of content lines
 
     """
-    app = make_app()
-    return app(environ, start_response)
+    global _app  # pylint: disable=global-statement,invalid-name
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = make_app()
+    return _app(environ, start_response)
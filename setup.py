@@ -10,26 +10,36 @@ setup(
     license='MIT',
     classifiers=[
         'Development Status :: 3 - Alpha',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.5',
     ],
     keywords=[],
     packages=find_packages(),
     install_requires=[
+        # online migrations use autocommit_block()
+        'alembic>=1.2',
         'cssmin',
         'flask',
         'flask-assets',
         # This uses Alembic as its migration engine
-        'flask-migrate',
+        'flask-migrate>=2.0',
         'flask-script',
         'flask-seasurf',
-        'flask-sqlalchemy',
+        'flask-sqlalchemy>=2.2',
         'PyYAML',
+        # expanding bind parameters
+        'sqlalchemy>=1.2',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'loadtest': ['aiohttp>=3.3'],
+        'simulate': ['numpy>=1.17'],
+        'websocket': ['flask-sockets'],
+    },
     package_data={
         'crail.static': [('*/') * depth + '*.' + suffix
                          for depth in range(5)
                          for suffix in ['js', 'css']],
-        'crail.templates': ['*.html'],
+        'crail.templates': ['*.html', '*.js'],
     },
     entry_points={
         'console_scripts': [